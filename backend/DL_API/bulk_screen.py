@@ -0,0 +1,305 @@
+"""
+Dépistage hors ligne d'un dossier (ou d'une liste) d'images de fond d'œil.
+
+    python bulk_screen.py /data/campagne --output resultats.csv
+    python bulk_screen.py /data/campagne --output resultats.parquet --heatmaps heatmaps/
+    python bulk_screen.py liste.txt --output resultats.csv --batch-size 64 --workers 8
+    python bulk_screen.py /data/entrant --output resultats.csv --watch 30
+    python bulk_screen.py /data/campagne --output resultats.csv --adaptive
+
+Le décodage et le prétraitement (CLAHE, médian) tournent dans un pool de
+processus, l'inférence par lots dans le processus principal. Les résultats
+sont ajoutés au CSV de reprise après chaque lot : relancer la même commande
+après une interruption reprend là où elle s'était arrêtée, en retraitant les
+images en erreur (--keep-errors pour les garder telles quelles).
+"""
+import argparse
+import csv
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from early_exit import adaptive_predict
+from image_utils import compute_gradcam_maps, preprocess_image_from_bytes, prepare_tensor, render_gradcam_figure
+from model_utils import LABELS, load_model_weights
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+FIELDS = ["path", "image_sha256", "prediction_class", "prediction_label", "probability", "early_exit", "heatmap", "error"]
+# Intervalle minimal entre deux lignes de progression (secondes)
+PROGRESS_INTERVAL = 5
+
+def list_images(sources):
+    """Dossiers parcourus récursivement ; un fichier .txt est lu comme une liste de chemins."""
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield os.path.join(root, name)
+        elif source.endswith(".txt"):
+            with open(source) as f:
+                for line in f:
+                    if line.strip():
+                        yield line.strip()
+        else:
+            yield source
+
+def _init_worker():
+    # Un thread torch par processus : le parallélisme vient du pool
+    torch.set_num_threads(1)
+
+def load_image(path):
+    """Étape parallèle : lecture, empreinte, prétraitement OpenCV et Tensor."""
+    try:
+        with open(path, "rb") as f:
+            contents = f.read()
+        image_sha256 = hashlib.sha256(contents).hexdigest()
+        array = prepare_tensor(preprocess_image_from_bytes(contents)).numpy()
+        return path, image_sha256, array, None
+    except Exception as e:
+        return path, None, None, str(e) or type(e).__name__
+
+def save_heatmap(array, gradcam_map, gradcam_pp_map, out_path):
+    """Rendu matplotlib délégué au pool (le calcul GradCAM reste sur le modèle)."""
+    png_bytes = render_gradcam_figure(torch.from_numpy(array), gradcam_map, gradcam_pp_map)
+    with open(out_path, "wb") as f:
+        f.write(png_bytes)
+    return out_path
+
+def iter_loaded(pool, paths, max_pending):
+    """Images prétraitées au fil de l'eau, avec un nombre borné d'images en vol."""
+    pending = set()
+    for path in paths:
+        pending.add(pool.submit(load_image, path))
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+def read_checkpoint(path, retry_errors=True):
+    """
+    Chemins déjà traités ; une ligne tronquée par une interruption est ignorée.
+    Les lignes en erreur (souvent passagères : fichier en cours de copie,
+    disque réseau) sont retirées du fichier pour que l'image soit retraitée :
+    le CSV garde une seule ligne par image.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline="") as f:
+        rows = [row for row in csv.DictReader(f) if None not in row.values()]
+    if retry_errors and any(row["error"] for row in rows):
+        rows = [row for row in rows if not row["error"]]
+        # Réécriture atomique : une interruption laisse l'ancien fichier intact
+        with open(path + ".tmp", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(path + ".tmp", path)
+    return {row["path"] for row in rows}
+
+def open_checkpoint(path):
+    exists = os.path.exists(path) and os.path.getsize(path) > 0
+    if exists:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            truncated = f.read(1) != b"\n"
+    f = open(path, "a", newline="")
+    if exists and truncated:
+        f.write("\n")
+    writer = csv.DictWriter(f, fieldnames=FIELDS)
+    if not exists:
+        writer.writeheader()
+    return f, writer
+
+def export_parquet(checkpoint_path, output_path):
+    import pandas as pd
+    pd.read_csv(checkpoint_path).to_parquet(output_path, index=False)
+
+class Screener:
+    def __init__(self, model, device, pool, heatmap_dir=None, adaptive=False):
+        self.model = model
+        self.device = device
+        self.pool = pool
+        self.adaptive = adaptive
+        self.heatmap_dir = heatmap_dir
+        if heatmap_dir:
+            os.makedirs(heatmap_dir, exist_ok=True)
+
+    def predict(self, arrays):
+        batch = torch.from_numpy(np.concatenate(arrays)).to(self.device)
+        if self.adaptive:
+            # Seules les images incertaines du lot repassent par le modèle complet
+            return adaptive_predict(self.model, batch)
+        with torch.inference_mode():
+            probs = F.softmax(self.model(batch), dim=1)
+            probability, pred_idx = probs.max(dim=1)
+        return pred_idx.tolist(), probability.tolist(), [False] * len(arrays)
+
+    def explain(self, items, rows, pred_idx):
+        """
+        GradCAM/GradCAM++ du lot en une passe avant et une passe arrière
+        (hors inference_mode), puis rendu des PNG dans le pool.
+        """
+        selected = [i for i, row in enumerate(rows) if not row["early_exit"]]
+        if not selected:
+            return []
+        batch = torch.from_numpy(np.concatenate([items[i][2] for i in selected])).to(self.device)
+        gradcam_maps, gradcam_pp_maps = compute_gradcam_maps(self.model, batch, [pred_idx[i] for i in selected])
+        renders = []
+        for k, i in enumerate(selected):
+            out_path = os.path.join(self.heatmap_dir, f"{rows[i]['image_sha256']}.png")
+            renders.append((rows[i], self.pool.submit(
+                save_heatmap, items[i][2], gradcam_maps[k:k + 1], gradcam_pp_maps[k:k + 1], out_path)))
+        return renders
+
+    def run_batch(self, items):
+        """Inférence d'un lot puis, si demandé, heatmaps rendues en parallèle."""
+        pred_idx, probability, early_exit = self.predict([array for _, _, array in items])
+        rows = []
+        for (path, image_sha256, array), idx, prob, exited in zip(items, pred_idx, probability, early_exit):
+            rows.append({"path": path, "image_sha256": image_sha256, "prediction_class": idx,
+                         "prediction_label": LABELS[idx], "probability": round(prob, 4),
+                         "early_exit": int(exited), "heatmap": "", "error": ""})
+        renders = self.explain(items, rows, pred_idx) if self.heatmap_dir else []
+        for row, future in renders:
+            try:
+                row["heatmap"] = future.result()
+            except Exception as e:
+                row["error"] = f"heatmap: {e}"
+        return rows
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.errors = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def rate(self):
+        return self.done / max(time.perf_counter() - self.start, 1e-9)
+
+    def update(self, rows):
+        self.done += len(rows)
+        self.errors += sum(1 for row in rows if row["error"])
+        now = time.perf_counter()
+        if now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            print(f"{self.done}/{self.total} images, {self.rate():.1f} img/s, {self.errors} erreurs", file=sys.stderr)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        return f"{self.done} images en {elapsed:.1f} s ({self.rate():.1f} img/s), {self.errors} erreurs"
+
+def screen(paths, screener, writer, f, batch_size, max_pending):
+    progress = Progress(len(paths))
+    batch = []
+
+    def flush(rows):
+        writer.writerows(rows)
+        f.flush()
+        progress.update(rows)
+
+    for path, image_sha256, array, error in iter_loaded(screener.pool, paths, max_pending):
+        if error is not None:
+            flush([{"path": path, "image_sha256": image_sha256 or "", "prediction_class": "",
+                    "prediction_label": "", "probability": "", "early_exit": "", "heatmap": "", "error": error}])
+            continue
+        batch.append((path, image_sha256, array))
+        if len(batch) >= batch_size:
+            flush(screener.run_batch(batch))
+            batch = []
+    if batch:
+        flush(screener.run_batch(batch))
+    return progress
+
+def pending_paths(sources, done, settle=0):
+    """Images pas encore traitées ; en surveillance, on ignore celles en cours de copie."""
+    now = time.time()
+    paths = []
+    for path in list_images(sources):
+        if path in done:
+            continue
+        if settle and os.path.exists(path) and now - os.path.getmtime(path) < settle:
+            continue
+        paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="dossiers, images ou listes .txt")
+    parser.add_argument("--output", required=True, help="résultats .csv ou .parquet (pandas + pyarrow)")
+    parser.add_argument("--checkpoint", help="CSV de reprise (défaut : --output si CSV, sinon <output>.partial.csv)")
+    parser.add_argument("--restart", action="store_true", help="ignorer le CSV de reprise existant")
+    parser.add_argument("--keep-errors", action="store_true",
+                        help="ne pas retraiter les images en erreur dans le CSV de reprise")
+    parser.add_argument("--model", default="best_model.pth")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processus de prétraitement")
+    parser.add_argument("--threads", type=int, help="torch.set_num_threads pour l'inférence")
+    parser.add_argument("--heatmaps", metavar="DIR", help="écrire les heatmaps GradCAM (<sha256>.png)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="premier étage basse résolution, seuls les cas incertains passent au modèle complet")
+    parser.add_argument("--watch", type=float, metavar="SECONDES",
+                        help="surveiller les dossiers et traiter les nouvelles images à cet intervalle")
+    args = parser.parse_args()
+
+    parquet = args.output.endswith(".parquet")
+    if parquet:
+        try:
+            import pandas  # noqa: F401
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("l'export Parquet nécessite pandas et pyarrow")
+    checkpoint = args.checkpoint or (args.output + ".partial.csv" if parquet else args.output)
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = load_model_weights(args.model, device=args.device)
+    done = read_checkpoint(checkpoint, retry_errors=not args.keep_errors)
+    if done:
+        print(f"Reprise : {len(done)} images déjà traitées dans {checkpoint}", file=sys.stderr)
+
+    f, writer = open_checkpoint(checkpoint)
+    # spawn : pas de fork d'un processus où torch a déjà démarré ses threads
+    context = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=_init_worker) as pool:
+            screener = Screener(model, args.device, pool, args.heatmaps, args.adaptive)
+            max_pending = max(args.workers * 4, args.batch_size * 2)
+            while True:
+                paths = pending_paths(args.sources, done, settle=args.watch or 0)
+                if paths:
+                    progress = screen(paths, screener, writer, f, args.batch_size, max_pending)
+                    # En surveillance, une image en erreur attend la prochaine relance (pas de boucle sur un fichier corrompu)
+                    done.update(paths)
+                    print(progress.summary(), file=sys.stderr)
+                    if parquet:
+                        export_parquet(checkpoint, args.output)
+                if not args.watch:
+                    break
+                time.sleep(args.watch)
+    except KeyboardInterrupt:
+        print(f"Interrompu : relancer la même commande pour reprendre depuis {checkpoint}", file=sys.stderr)
+        return 130
+    finally:
+        f.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import os
+import torch
+import torch.nn.functional as F
+
+from metrics import early_exit_total, stage
+
+# Premier étage : même modèle sur une entrée réduite (le pooling adaptatif accepte toute taille)
+EARLY_EXIT_SIZE = int(os.getenv("EARLY_EXIT_SIZE", "128"))
+# Seuil calibré avec benchmarks/calibrate_early_exit.py sur un dossier annoté
+EARLY_EXIT_THRESHOLD = float(os.getenv("EARLY_EXIT_THRESHOLD", "0.98"))
+# Classes autorisées à sortir tôt. Asymétrie voulue : par défaut seuls les cas sains (0), majoritaires
+# en dépistage, sortent au seuil ; un glaucome suspecté (1), même à 0.999, repasse toujours par le
+# modèle complet et garde son GradCAM. Le seuil ne s'applique qu'aux classes listées ici.
+EARLY_EXIT_CLASSES = [int(c) for c in os.getenv("EARLY_EXIT_CLASSES", "0").split(",") if c.strip()]
+# Mode adaptatif par défaut des routes /predict/ et /analyze/ (surchargeable par requête)
+ADAPTIVE_DEFAULT = os.getenv("ADAPTIVE_INFERENCE", "0") == "1"
+
+def downscale(batch, size=EARLY_EXIT_SIZE):
+    with stage("downscale"):
+        return F.interpolate(batch, size=(size, size), mode="area")
+
+def first_stage(model, batch, size=EARLY_EXIT_SIZE):
+    """Probabilités du premier étage (entrée réduite)."""
+    with stage("early_exit_forward"), torch.inference_mode():
+        return F.softmax(model(downscale(batch, size)), dim=1)
+
+def adaptive_predict(model, batch, threshold=EARLY_EXIT_THRESHOLD, size=EARLY_EXIT_SIZE, classes=EARLY_EXIT_CLASSES):
+    """
+    Sortie anticipée pour les images du lot jugées sûres par le premier
+    étage ; les autres repassent par le modèle complet en 224×224.
+    Retourne (classes, probabilités, sorties anticipées), une entrée par image.
+    """
+    probability, pred_idx = first_stage(model, batch, size).max(dim=1)
+    with torch.inference_mode():
+        allowed = torch.zeros_like(pred_idx, dtype=torch.bool)
+        for c in classes:
+            allowed |= pred_idx == c
+        exit_mask = allowed & (probability >= threshold)
+        escalate = (~exit_mask).nonzero().flatten()
+        if len(escalate):
+            with stage("forward"):
+                full_probability, full_idx = F.softmax(model(batch[escalate]), dim=1).max(dim=1)
+            probability[escalate] = full_probability
+            pred_idx[escalate] = full_idx
+
+    exits = exit_mask.tolist()
+    early_exit_total.inc(sum(exits), "exit")
+    early_exit_total.inc(len(exits) - sum(exits), "escalate")
+    return pred_idx.tolist(), probability.tolist(), exits
@@ -0,0 +1,83 @@
+import os
+import logging
+import torch
+import torch.nn.functional as F
+import torchvision.transforms.functional as TF
+
+from metrics import stage
+from model_utils import load_model_weights
+
+# Checkpoints supplémentaires (chemins séparés par des virgules) chargés à côté de best_model.pth
+ENSEMBLE_MODEL_PATHS = [p.strip() for p in os.getenv("ENSEMBLE_MODEL_PATHS", "").split(",") if p.strip()]
+logger = logging.getLogger("uvicorn")
+
+def _zoom(x, scale):
+    size = list(x.shape[-2:])
+    resized = F.interpolate(x, scale_factor=scale, mode="bilinear", align_corners=False)
+    # center_crop complète par des zéros (la couleur moyenne après normalisation) en dézoom
+    return TF.center_crop(resized, size)
+
+# Vues calculées sur le Tensor déjà prétraité : le CLAHE n'est fait qu'une fois
+TTA_VIEWS = {
+    "identity": lambda x: x,
+    "hflip": lambda x: torch.flip(x, dims=[3]),
+    "vflip": lambda x: torch.flip(x, dims=[2]),
+    "rot10": lambda x: TF.rotate(x, 10),
+    "rot-10": lambda x: TF.rotate(x, -10),
+    "zoom90": lambda x: _zoom(x, 0.9),
+    "zoom110": lambda x: _zoom(x, 1.1),
+}
+
+def load_ensemble_models(paths=ENSEMBLE_MODEL_PATHS):
+    """Modèles additionnels nommés d'après leur fichier ; un checkpoint illisible est ignoré."""
+    models = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            models[name] = load_model_weights(path)
+        except Exception as e:
+            logger.error(f"Checkpoint d'ensemble ignoré ({path}): {e}")
+    return models
+
+def parse_selection(value, available, what):
+    """'a,b' -> noms validés ; None ou 'all' -> tous les noms disponibles."""
+    if value is None or value == "all":
+        return list(available)
+    names = [v.strip() for v in value.split(",") if v.strip()]
+    unknown = [n for n in names if n not in available]
+    if unknown or not names:
+        raise ValueError(f"{what} inconnus: {', '.join(unknown)} (disponibles: {', '.join(available)})")
+    return names
+
+def build_views(image_tensor, view_names):
+    """Empile toutes les vues augmentées d'une image en un seul lot."""
+    with stage("tta"):
+        return torch.cat([TTA_VIEWS[name](image_tensor) for name in view_names])
+
+def ensemble_predict(models, image_tensor, view_names):
+    """
+    Une passe avant par modèle sur le lot de vues, puis moyenne et variance
+    des probabilités sur l'ensemble (modèles × vues).
+    """
+    batch = build_views(image_tensor, view_names)
+    all_probs = []
+    per_model = {}
+    with stage("ensemble_forward"), torch.inference_mode():
+        for name, model in models.items():
+            probs = F.softmax(model(batch), dim=1)
+            all_probs.append(probs)
+            per_model[name] = probs.mean(dim=0)
+
+    probs = torch.cat(all_probs)
+    mean = probs.mean(dim=0)
+    variance = probs.var(dim=0, unbiased=False)
+    pred_idx = int(mean.argmax())
+    return {
+        "prediction_class": pred_idx,
+        "probability": round(mean[pred_idx].item(), 4),
+        "probability_mean": [round(v, 4) for v in mean.tolist()],
+        "probability_variance": [round(v, 6) for v in variance.tolist()],
+        "per_model": {name: round(p[pred_idx].item(), 4) for name, p in per_model.items()},
+        "views": view_names,
+        "models": list(models),
+    }
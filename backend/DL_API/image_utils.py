@@ -1,13 +1,17 @@
 import cv2
-import numpy as np
 from PIL import Image
 import torch
 import torchvision.transforms as transforms
-import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
 import io
 import base64
-from model_utils import GradCAM, GradCAMPlusPlus
+import threading
+from model_utils import TargetLayerGradients, gradcam_from, gradcam_pp_from
+from metrics import stage
+from quality import decode_image
 import torch.nn.functional as F
 
 IMAGENET_MEAN = [0.485, 0.456, 0.406]
@@ -22,115 +26,145 @@ def preprocess_image_from_bytes(image_bytes):
     Lit les bytes de l'image, applique le prétraitement OpenCV (CLAHE, etc.)
     et retourne une image PIL.
     """
-    # Convertir les bytes en numpy array
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # Prétraitement (Le code original de votre Streamlit)
-    lab_image = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab_image)
-    
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    cl = clahe.apply(l)
-    lab_image = cv2.merge((cl, a, b))
-    
-    clahe_image = cv2.cvtColor(lab_image, cv2.COLOR_LAB2BGR)
-    median_filtered_image = cv2.medianBlur(clahe_image, 5)
-    image_rgb = cv2.cvtColor(median_filtered_image, cv2.COLOR_BGR2RGB)
-    
-    return Image.fromarray(image_rgb)
+    # Contrôle d'en-tête, décodage réduit des grandes photos et contrôle qualité
+    image = decode_image(image_bytes)
+
+    with stage("preprocess"):
+        # Prétraitement (Le code original de votre Streamlit)
+        lab_image = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+        l, a, b = cv2.split(lab_image)
+
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        cl = clahe.apply(l)
+        lab_image = cv2.merge((cl, a, b))
+
+        clahe_image = cv2.cvtColor(lab_image, cv2.COLOR_LAB2BGR)
+        median_filtered_image = cv2.medianBlur(clahe_image, 5)
+        image_rgb = cv2.cvtColor(median_filtered_image, cv2.COLOR_BGR2RGB)
+
+        return Image.fromarray(image_rgb)
+
+# Construite une fois pour toutes (sans état)
+TENSOR_TRANSFORM = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+])
 
 def prepare_tensor(image_pil):
     """Transforme l'image PIL en Tensor PyTorch"""
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
-    ])
-
-    if image_pil.mode == 'RGBA':
-        image_pil = image_pil.convert('RGB')
-    
-    image_tensor = transform(image_pil).unsqueeze(0) 
+    with stage("tensor"):
+        if image_pil.mode == 'RGBA':
+            image_pil = image_pil.convert('RGB')
+
+        image_tensor = TENSOR_TRANSFORM(image_pil).unsqueeze(0)
     return image_tensor
 
-def generate_gradcam_base64(model, image_tensor):
+class HeatmapFigure:
     """
-    Génère la visualisation GradCAM et la retourne sous forme de chaîne Base64
-    pour qu'elle puisse être affichée directement dans React via <img src="..." />
+    Figure GradCAM / GradCAM++ réutilisée d'une requête à l'autre (une par
+    thread, matplotlib n'étant pas thread-safe) : seules les données des
+    images changent, le tampon PNG est lui aussi recyclé.
     """
-    gradcam = GradCAM(model)
-    gradcam_pp = GradCAMPlusPlus(model)
-    
-    gradcam_map = gradcam(image_tensor)
-    gradcam_pp_map = gradcam_pp(image_tensor)
-    
-    image = image_tensor.squeeze().cpu().numpy().transpose(1, 2, 0)
-    image = (image - image.min()) / (image.max() - image.min())
-    
-    # Création du plot Matplotlib
-    fig = plt.figure(figsize=(10, 6))
-    gs = gridspec.GridSpec(1, 2, width_ratios=[1, 1])  
-    
-    ax0 = plt.subplot(gs[0, 0])
-    ax0.imshow(image)
-    ax0.imshow(cv2.resize(gradcam_map[0], (image.shape[1], image.shape[0])), 
-           cmap='jet', alpha=0.5)
-    ax0.set_title('GradCAM')
-    ax0.axis('off')
-
-    ax1 = plt.subplot(gs[0, 1])
-    ax1.imshow(image)
-    ax1.imshow(cv2.resize(gradcam_pp_map, (image.shape[1], image.shape[0])), 
-           cmap='jet', alpha=0.5)
-    ax1.set_title('GradCAM++')
-    ax1.axis('off')
-
-    # Sauvegarde dans un buffer mémoire au lieu d'un fichier
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    plt.close(fig) # Important pour libérer la mémoire
-    buf.seek(0)
-    
-    # Encodage en Base64
-    img_str = base64.b64encode(buf.read()).decode('utf-8')
-    return f"data:image/png;base64,{img_str}"
-
-# ajoutez ceci dans backend/DL_API/image_utils.py (par exemple en fin de fichier)
 
-def generate_gradcam_png_bytes(model, image_tensor):
+    def __init__(self, shape):
+        self.shape = shape
+        self.figure = Figure(figsize=(10, 6))
+        FigureCanvasAgg(self.figure)
+        gs = gridspec.GridSpec(1, 2, width_ratios=[1, 1], figure=self.figure)
+        self.layers = []
+        for i, title in enumerate(("GradCAM", "GradCAM++")):
+            ax = self.figure.add_subplot(gs[0, i])
+            base = ax.imshow(np.zeros(shape + (3,)))
+            overlay = ax.imshow(np.zeros(shape), cmap='jet', alpha=0.5)
+            ax.set_title(title)
+            ax.axis('off')
+            self.layers.append((base, overlay))
+        self.buffer = io.BytesIO()
+
+    def render(self, image, cams):
+        for (base, overlay), cam in zip(self.layers, cams):
+            base.set_data(image)
+            overlay.set_data(cam)
+            overlay.autoscale()  # même normalisation qu'un imshow neuf
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.figure.savefig(self.buffer, format='png', bbox_inches='tight')
+        return self.buffer.getvalue()
+
+_figures = threading.local()
+
+def render_gradcam_figure(image_tensor, gradcam_map, gradcam_pp_map):
     """
-    Génère le visuel GradCAM / GradCAM++ superposé et retourne les octets PNG.
+    Superpose GradCAM et GradCAM++ sur l'image (côte à côte) et retourne
+    les octets PNG. Les cartes sont celles d'un lot d'une image (1, h, w).
     """
-    gradcam = GradCAM(model)
-    gradcam_pp = GradCAMPlusPlus(model)
+    with stage("render"):
+        image = image_tensor.squeeze().cpu().numpy().transpose(1, 2, 0)
+        image = (image - image.min()) / (image.max() - image.min())
+        size = (image.shape[1], image.shape[0])
+        cams = (cv2.resize(gradcam_map[0], size), cv2.resize(gradcam_pp_map[0], size))
+
+        figure = getattr(_figures, "figure", None)
+        if figure is None or figure.shape != image.shape[:2]:
+            figure = _figures.figure = HeatmapFigure(image.shape[:2])
 
-    gradcam_map = gradcam(image_tensor)
-    gradcam_pp_map = gradcam_pp(image_tensor)
+    with stage("encode"):
+        return figure.render(image, cams)
 
+def compute_gradcam_maps(model, image_tensor, class_idx=None):
+    """
+    Cartes GradCAM et GradCAM++ (N, h, w) d'un lot de N images : les deux
+    méthodes partagent une seule passe avant et une seule passe arrière.
+    """
+    with stage("gradcam"):
+        activations, gradients = TargetLayerGradients(model).activations_and_gradients(image_tensor, class_idx)
+        gradcam_map = gradcam_from(activations, gradients)
+    with stage("gradcam_pp"):
+        gradcam_pp_map = gradcam_pp_from(activations, gradients)
+    return gradcam_map, gradcam_pp_map
+
+def _to_uint8(cam):
+    return (np.clip(cam, 0, 1) * 255).round().astype(np.uint8)
+
+def tensor_thumbnail_jpeg(image_tensor, quality=85):
+    """Image prétraitée (224×224, même normalisation d'affichage que la heatmap) en JPEG."""
     image = image_tensor.squeeze().cpu().numpy().transpose(1, 2, 0)
     image = (image - image.min()) / (image.max() - image.min())
+    buf = io.BytesIO()
+    Image.fromarray(_to_uint8(image)).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
 
-    fig = plt.figure(figsize=(10, 6))
-    gs = gridspec.GridSpec(1, 2, width_ratios=[1, 1])
-
-    ax0 = plt.subplot(gs[0, 0])
-    ax0.imshow(image)
-    ax0.imshow(cv2.resize(gradcam_map[0], (image.shape[1], image.shape[0])),
-               cmap='jet', alpha=0.5)
-    ax0.set_title('GradCAM')
-    ax0.axis('off')
+def compute_raw_cams(model, image_tensor):
+    """
+    Cartes GradCAM et GradCAM++ brutes (h×w, uint8) et vignette JPEG :
+    quelques Ko, composités à la demande par le client au lieu d'un PNG figé.
+    """
+    gradcam_map, gradcam_pp_map = compute_gradcam_maps(model, image_tensor)
+    with stage("encode"):
+        return {
+            "shape": list(gradcam_map.shape[1:]),
+            "dtype": "uint8",
+            "gradcam": base64.b64encode(_to_uint8(gradcam_map[0]).tobytes()).decode(),
+            "gradcam_pp": base64.b64encode(_to_uint8(gradcam_pp_map[0]).tobytes()).decode(),
+            "thumbnail": base64.b64encode(tensor_thumbnail_jpeg(image_tensor)).decode(),
+        }
 
-    ax1 = plt.subplot(gs[0, 1])
-    ax1.imshow(image)
-    ax1.imshow(cv2.resize(gradcam_pp_map, (image.shape[1], image.shape[0])),
-               cmap='jet', alpha=0.5)
-    ax1.set_title('GradCAM++')
-    ax1.axis('off')
+def generate_gradcam_base64(model, image_tensor):
+    """
+    Génère la visualisation GradCAM et la retourne sous forme de chaîne Base64
+    pour qu'elle puisse être affichée directement dans React via <img src="..." />
+    """
+    png_bytes = generate_gradcam_png_bytes(model, image_tensor)
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    plt.close(fig)
-    buf.seek(0)
-    return buf.getvalue()
+    # Encodage en Base64
+    with stage("encode"):
+        img_str = base64.b64encode(png_bytes).decode('utf-8')
+    return f"data:image/png;base64,{img_str}"
 
+def generate_gradcam_png_bytes(model, image_tensor):
+    """
+    Génère le visuel GradCAM / GradCAM++ superposé et retourne les octets PNG.
+    """
+    gradcam_map, gradcam_pp_map = compute_gradcam_maps(model, image_tensor)
+    return render_gradcam_figure(image_tensor, gradcam_map, gradcam_pp_map)
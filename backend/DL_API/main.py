@@ -1,99 +1,351 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Query
+from typing import Optional
 from contextlib import asynccontextmanager
+from collections import OrderedDict
+import asyncio
+import hashlib
+import os
+import secrets
+import sys
+import threading
 import torch
 import torch.nn.functional as F
-from model_utils import load_model_weights
-from image_utils import preprocess_image_from_bytes, prepare_tensor, generate_gradcam_base64
+from model_utils import LABELS
 import logging
 
-from image_utils import preprocess_image_from_bytes, prepare_tensor, generate_gradcam_base64, generate_gradcam_png_bytes
-from fastapi.responses import Response
+from image_utils import (preprocess_image_from_bytes, prepare_tensor, generate_gradcam_base64,
+                         generate_gradcam_png_bytes, compute_raw_cams)
+from metrics import latency, registry, stage
+from tracing import TracingMiddleware, get_request_id
+from early_exit import ADAPTIVE_DEFAULT, adaptive_predict
+from ensemble import TTA_VIEWS, ensemble_predict, parse_selection
+from quality import ImageRejected, probe_image
+from memory import MemoryGuardMiddleware
+from scheduler import PriorityMiddleware, QueueFull, Scheduler, priority_var
+from model_registry import ADMIN_TOKEN, ModelRegistry, ModelVersionMiddleware
+# backend/ : modules communs aux deux services (l'image Docker les copie dans /app/common)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import PROFILING_ENABLED, ProfilingMiddleware, profile_torch
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 
 # --- Configuration ---
 MODEL_PATH = "best_model.pth"
+# Tenseurs prétraités gardés en mémoire pour calculer la heatmap plus tard
+# sans renvoyer l'image (~600 Ko par entrée)
+TENSOR_CACHE_SIZE = 64
+# Calculs simultanés sur le modèle (aucun état partagé : GradCAM compris, plusieurs créneaux possibles)
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "1"))
 logger = logging.getLogger("uvicorn")
 
-# Variables globales pour le modèle
-ml_models = {}
+# Modèle servi : chargement, échauffement et remplacement à chaud
+serving = ModelRegistry()
+tensor_cache = OrderedDict()
+tensor_cache_lock = threading.Lock()
+# Créneaux de calcul partagés par classe de priorité (en-tête X-Priority)
+scheduler = Scheduler(INFERENCE_CONCURRENCY)
+
+async def run_compute(fn, *args, priority=None):
+    """
+    Exécute le calcul PyTorch/OpenCV dans un thread, pour ne pas bloquer la
+    boucle d'événements ; l'attente d'un créneau dépend de la classe de
+    priorité de la requête, et le créneau reste pris jusqu'à la fin du
+    thread, même si la requête est annulée.
+    """
+    return await scheduler.run_in_thread(priority or priority_var.get(), profile_torch, fn, *args)
+
+async def run_background(fn, *args):
+    # Chargements et échauffements : jamais devant une requête interactive
+    return await run_compute(fn, *args, priority="background")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Charger le modèle au démarrage de l'app (pour ne le faire qu'une fois)
-    try:
-        logger.info("Chargement du modèle Deep Learning...")
-        ml_models["glaucoma_net"] = load_model_weights(MODEL_PATH)
-        logger.info("Modèle chargé avec succès sur CPU.")
-    except Exception as e:
-        logger.error(f"Erreur lors du chargement du modèle: {e}")
-        ml_models["glaucoma_net"] = None
+    # Chargement + échauffement en tâche de fond : /health/live répond tout de suite,
+    # /health/ready seulement une fois le modèle prêt
+    logger.info("Chargement du modèle Deep Learning...")
+    loading = asyncio.create_task(serving.start(MODEL_PATH, run_background))
     yield
     # Nettoyage à l'arrêt (si besoin)
-    ml_models.clear()
+    loading.cancel()
+    serving.served = None
+    tensor_cache.clear()
+
+def current_model():
+    """Modèle figé pour la requête (même version du début à la fin, même pendant un remplacement)."""
+    served = serving.current()
+    if served is None:
+        raise HTTPException(status_code=503, detail="Le modèle n'est pas chargé.")
+    return served
 
 app = FastAPI(title="Glaucoma DL Service", lifespan=lifespan)
+if PROFILING_ENABLED:
+    # Interne au traçage : l'id de requête nomme les fichiers de profil
+    app.add_middleware(ProfilingMiddleware, get_request_id=get_request_id)
+# Plafond RSS (vidage puis arrêt), malloc_trim et bilan des fuites (MEMORY_DEBUG=1)
+app.add_middleware(MemoryGuardMiddleware, get_model=lambda: serving.served.model if serving.served else None,
+                   on_drain=serving.drain, is_busy=lambda: scheduler.free < scheduler.slots)
+app.add_middleware(ModelVersionMiddleware, registry=serving)
+app.add_middleware(PriorityMiddleware)
+app.add_middleware(TracingMiddleware)
 
-@app.post("/analyze/")
-async def analyze_image(file: UploadFile = File(...)):
-    if ml_models["glaucoma_net"] is None:
-        raise HTTPException(status_code=503, detail="Le modèle n'est pas chargé.")
+@app.exception_handler(ImageRejected)
+async def image_rejected_handler(request, exc: ImageRejected):
+    # 4xx explicite plutôt qu'un 500 après un calcul inutile
+    logger.info(f"[{get_request_id()}] Image refusée ({exc.reason}): {exc.message}")
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.message, "reason": exc.reason})
 
-    # 1. Lecture du fichier
+@app.exception_handler(QueueFull)
+async def queue_full_handler(request, exc: QueueFull):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+def prepare_image(contents):
+    """Prétraitement (OpenCV + PIL) puis Tensor, mis en cache par empreinte."""
+    image_id = hashlib.sha256(contents).hexdigest()
+    image_tensor = prepare_tensor(preprocess_image_from_bytes(contents))
+    with tensor_cache_lock:
+        tensor_cache[image_id] = image_tensor
+        tensor_cache.move_to_end(image_id)
+        if len(tensor_cache) > TENSOR_CACHE_SIZE:
+            tensor_cache.popitem(last=False)
+    return image_id, image_tensor
+
+def predict_tensor(model, image_tensor):
+    # inference_mode : pas de graphe autograd, plus rapide que no_grad
+    with stage("forward"), torch.inference_mode():
+        output = model(image_tensor)
+        probs = F.softmax(output, dim=1)
+        pred_idx = output.argmax(dim=1).item()
+        probability = probs[0][pred_idx].item()
+    return pred_idx, probability
+
+def classify(model, image_tensor, adaptive):
+    """Classe et probabilité ; en mode adaptatif, indique aussi si le premier étage a suffi."""
+    if not adaptive:
+        return (*predict_tensor(model, image_tensor), False)
+    pred_idx, probability, early_exit = adaptive_predict(model, image_tensor)
+    return pred_idx[0], probability[0], early_exit[0]
+
+def predict_job(model, contents, adaptive=False):
+    image_id, image_tensor = prepare_image(contents)
+    pred_idx, probability, early_exit = classify(model, image_tensor, adaptive)
+    return image_id, pred_idx, probability, early_exit
+
+def analyze_job(model, contents, heatmap, adaptive=False):
+    # 2-3. Prétraitement (OpenCV + PIL) et préparation Tensor
+    image_id, image_tensor = prepare_image(contents)
+
+    # 4. Prédiction
+    pred_idx, probability, early_exit = classify(model, image_tensor, adaptive)
+
+    # 5. Génération GradCAM (Visualisation)
+    # Note: GradCAM nécessite le calcul des gradients, donc on réactive le contexte nécessaire
+    # Les cas tranchés par le premier étage n'ont pas besoin d'explication
+    gradcam_image_base64 = generate_gradcam_base64(model, image_tensor) if heatmap and not early_exit else None
+    return image_id, pred_idx, probability, gradcam_image_base64, early_exit
+
+def ensemble_job(models, contents, view_names):
+    # Prétraitement unique, partagé par toutes les vues et tous les modèles
+    image_id, image_tensor = prepare_image(contents)
+    result = ensemble_predict(models, image_tensor, view_names)
+    return {**result, "prediction_label": LABELS[result["prediction_class"]], "image_id": image_id}
+
+def heatmap_job(model, contents):
+    _, image_tensor = prepare_image(contents)
+    # GradCAM nécessite backward -> on n'utilise pas torch.no_grad()
+    return generate_gradcam_png_bytes(model, image_tensor)
+
+def cams_job(model, contents):
+    _, image_tensor = prepare_image(contents)
+    return compute_raw_cams(model, image_tensor)
+
+async def read_image_upload(file: UploadFile):
+    current_model()
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Fichier invalide.")
-    
     contents = await file.read()
-    
+    # En-tête seul : une image corrompue, minuscule ou démesurée n'occupe pas de créneau de calcul
+    probe_image(contents)
+    return contents
+
+@app.post("/predict/")
+async def predict_image(file: UploadFile = File(...), adaptive: bool = Query(ADAPTIVE_DEFAULT)):
+    """Chemin rapide : prétraitement + une passe avant, sans GradCAM."""
+    contents = await read_image_upload(file)
     try:
-        # 2. Prétraitement (OpenCV + PIL)
-        pil_image = preprocess_image_from_bytes(contents)
-        
-        # 3. Préparation Tensor
-        image_tensor = prepare_tensor(pil_image)
-        
-        # 4. Prédiction
-        model = ml_models["glaucoma_net"]
-        with torch.no_grad():
-            output = model(image_tensor)
-            probs = F.softmax(output, dim=1)
-            pred_idx = output.argmax(dim=1).item()
-            probability = probs[0][pred_idx].item()
-        
-        # 5. Génération GradCAM (Visualisation)
-        # Note: GradCAM nécessite le calcul des gradients, donc on réactive le contexte nécessaire
-        gradcam_image_base64 = generate_gradcam_base64(model, image_tensor)
-
-        # Mapping des labels
-        labels = {0: "No Glaucoma", 1: "Glaucoma Detected"}
-        
+        with latency.time("predict_adaptive" if adaptive else "predict"):
+            image_id, pred_idx, probability, early_exit = await run_compute(
+                predict_job, current_model().model, contents, adaptive
+            )
         return {
             "prediction_class": pred_idx,
-            "prediction_label": labels[pred_idx],
+            "prediction_label": LABELS[pred_idx],
             "probability": round(probability, 4),
-            "gradcam_image": gradcam_image_base64 # Image encodée en base64 pour affichage direct
+            "early_exit": early_exit,
+            "image_id": image_id  # Pour GET /heatmap/{image_id}
         }
+    except (ImageRejected, QueueFull):
+        raise
+    except Exception as e:
+        logger.error(f"[{get_request_id()}] Erreur lors de la prédiction: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la prédiction: {str(e)}")
 
+@app.post("/predict/ensemble/")
+async def predict_ensemble(
+    file: UploadFile = File(...),
+    views: Optional[str] = Query(None, description="Vues TTA séparées par des virgules (défaut: toutes)"),
+    models: Optional[str] = Query(None, description="Modèles séparés par des virgules (défaut: tous)"),
+):
+    """Cas limites : TTA et ensemble de checkpoints, une passe avant par modèle."""
+    contents = await read_image_upload(file)
+    try:
+        view_names = parse_selection(views, TTA_VIEWS, "Vues")
+        ensemble = current_model().ensemble
+        selected = {name: ensemble[name] for name in parse_selection(models, ensemble, "Modèles")}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        with latency.time("ensemble"):
+            return await run_compute(ensemble_job, selected, contents, view_names)
+    except (ImageRejected, QueueFull):
+        raise
     except Exception as e:
-        logger.error(f"Erreur lors de l'analyse: {str(e)}")
+        logger.error(f"[{get_request_id()}] Erreur lors de la prédiction d'ensemble: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la prédiction d'ensemble: {str(e)}")
+
+@app.post("/analyze/")
+async def analyze_image(
+    file: UploadFile = File(...),
+    heatmap: bool = Query(True),
+    adaptive: bool = Query(ADAPTIVE_DEFAULT),
+):
+    # 1. Lecture du fichier
+    contents = await read_image_upload(file)
+
+    try:
+        path = "analyze" if heatmap else "analyze_no_heatmap"
+        with latency.time(path + "_adaptive" if adaptive else path):
+            image_id, pred_idx, probability, gradcam_image_base64, early_exit = await run_compute(
+                analyze_job, current_model().model, contents, heatmap, adaptive
+            )
+
+        return {
+            "prediction_class": pred_idx,
+            "prediction_label": LABELS[pred_idx],
+            "probability": round(probability, 4),
+            "gradcam_image": gradcam_image_base64, # Image encodée en base64 pour affichage direct
+            "early_exit": early_exit,
+            "image_id": image_id
+        }
+
+    except (ImageRejected, QueueFull):
+        raise
+    except Exception as e:
+        logger.error(f"[{get_request_id()}] Erreur lors de l'analyse: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erreur lors de l'analyse: {str(e)}")
 
 # Lancer avec: uvicorn main:app --reload --port 8001
 
 @app.post("/heatmap/")
 async def heatmap_image(file: UploadFile = File(...)):
-    if ml_models.get("glaucoma_net") is None:
-        raise HTTPException(status_code=503, detail="Le modèle n'est pas chargé.")
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="Fichier invalide.")
-
-    contents = await file.read()
+    contents = await read_image_upload(file)
     try:
-        pil_image = preprocess_image_from_bytes(contents)
-        image_tensor = prepare_tensor(pil_image)
-        model = ml_models["glaucoma_net"]
+        with latency.time("heatmap"):
+            png_bytes = await run_compute(heatmap_job, current_model().model, contents)
+        return Response(content=png_bytes, media_type="image/png")
+    except (ImageRejected, QueueFull):
+        raise
+    except Exception as e:
+        logger.error(f"[{get_request_id()}] Erreur heatmap: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur generation heatmap: {e}")
 
-        # GradCAM nécessite backward -> on n'utilise pas torch.no_grad()
-        png_bytes = generate_gradcam_png_bytes(model, image_tensor)
+@app.get("/heatmap/{image_id}")
+async def heatmap_from_cache(image_id: str):
+    """Heatmap à la demande pour une image déjà passée par /predict/ ou /analyze/."""
+    served = current_model()
+    with tensor_cache_lock:
+        image_tensor = tensor_cache.get(image_id)
+    if image_tensor is None:
+        # Expulsée du cache : le client renvoie l'image via POST /heatmap/
+        raise HTTPException(status_code=404, detail="Image inconnue ou expirée, utilisez POST /heatmap/.")
+    try:
+        with latency.time("heatmap"):
+            png_bytes = await run_compute(generate_gradcam_png_bytes, served.model, image_tensor)
         return Response(content=png_bytes, media_type="image/png")
+    except QueueFull:
+        raise
+    except Exception as e:
+        logger.error(f"[{get_request_id()}] Erreur heatmap: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur generation heatmap: {e}")
+
+@app.post("/cams/")
+async def cams_image(file: UploadFile = File(...)):
+    """Cartes GradCAM / GradCAM++ brutes et vignette, à composer côté client."""
+    contents = await read_image_upload(file)
+    try:
+        with latency.time("cams"):
+            return await run_compute(cams_job, current_model().model, contents)
+    except (ImageRejected, QueueFull):
+        raise
+    except Exception as e:
+        logger.error(f"[{get_request_id()}] Erreur cartes GradCAM: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur cartes GradCAM: {e}")
+
+@app.get("/cams/{image_id}")
+async def cams_from_cache(image_id: str):
+    """Comme POST /cams/, pour une image encore dans le cache de tenseurs."""
+    served = current_model()
+    with tensor_cache_lock:
+        image_tensor = tensor_cache.get(image_id)
+    if image_tensor is None:
+        raise HTTPException(status_code=404, detail="Image inconnue ou expirée, utilisez POST /cams/.")
+    try:
+        with latency.time("cams"):
+            return await run_compute(compute_raw_cams, served.model, image_tensor)
+    except QueueFull:
+        raise
     except Exception as e:
-        logger.error(f"Erreur heatmap: {e}")
-        raise HTTPException(status_code=500, detail=f"Erreur generation heatmap: {e}")
\ No newline at end of file
+        logger.error(f"[{get_request_id()}] Erreur cartes GradCAM: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur cartes GradCAM: {e}")
+
+@app.get("/health/live")
+async def liveness():
+    """Le processus répond (le modèle peut encore être en cours de chargement)."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Prêt à servir : modèle chargé, validé et échauffé."""
+    status = serving.status()
+    return JSONResponse(status_code=200 if status["state"] == "ready" else 503, content=status)
+
+def check_admin(token):
+    if not ADMIN_TOKEN or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Accès administrateur refusé.")
+
+@app.get("/admin/model")
+async def model_status(x_admin_token: str = Header("")):
+    check_admin(x_admin_token)
+    return serving.status()
+
+@app.post("/admin/model/swap", status_code=202)
+async def swap_model(path: str = Query(..., description="Checkpoint à mettre en service"),
+                     x_admin_token: str = Header("")):
+    """
+    Remplacement à chaud : chargement, validation et échauffement en tâche de
+    fond (priorité background), puis bascule atomique. Suivi via GET /admin/model.
+    """
+    check_admin(x_admin_token)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=400, detail=f"Checkpoint introuvable : {path}")
+    if not serving.swap(path, run_background):
+        raise HTTPException(status_code=409, detail="Un remplacement est déjà en cours.")
+    return serving.status()
+
+@app.get("/stats/latency")
+async def latency_stats():
+    """Percentiles p50/p95/p99 (ms) par chemin : predict, ensemble, analyze, heatmap, cams."""
+    return latency.percentiles()
+
+@app.get("/metrics")
+async def metrics():
+    """Métriques au format texte Prometheus (étapes, file, RSS, threads torch)."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
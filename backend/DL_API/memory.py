@@ -0,0 +1,109 @@
+import asyncio
+import ctypes
+import gc
+import logging
+import os
+import signal
+import time
+
+from metrics import process_rss_bytes
+
+# --- Configuration ---
+# Plafond de RSS : au-delà, le worker s'arrête proprement pour être relancé (0 = pas de plafond)
+MAX_RSS_MB = float(os.getenv("MAX_RSS_MB", "0"))
+# Attente maximale des requêtes en cours avant l'arrêt d'un worker recyclé
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "60"))
+DRAIN_POLL_SECONDS = 0.1
+# Rend au système les pages libres des arènes malloc toutes les N requêtes (0 = jamais)
+MALLOC_TRIM_EVERY = int(os.getenv("MALLOC_TRIM_EVERY", "50"))
+# Bilan des tenseurs et hooks restés vivants après chaque requête (coûteux, une requête à la fois)
+MEMORY_DEBUG = os.getenv("MEMORY_DEBUG", "0") == "1"
+logger = logging.getLogger("uvicorn")
+
+def _load_malloc_trim():
+    try:
+        return ctypes.CDLL("libc.so.6").malloc_trim
+    except (OSError, AttributeError):
+        return None  # Hors glibc (macOS, musl)
+
+malloc_trim = _load_malloc_trim()
+
+def live_tensors():
+    import torch
+    gc.collect()
+    return sum(1 for obj in gc.get_objects() if torch.is_tensor(obj))
+
+def count_hooks(model):
+    """Hooks posés sur l'ensemble des modules du modèle."""
+    if model is None:
+        return 0
+    return sum(len(m._forward_hooks) + len(m._forward_pre_hooks) + len(m._backward_hooks) for m in model.modules())
+
+class MemoryGuardMiddleware:
+    """
+    Après chaque requête : malloc_trim périodique, plafond de RSS et, en
+    mode debug, bilan des tenseurs et hooks laissés par la requête.
+
+    Au-delà du plafond, le worker est vidé avant d'être arrêté : `on_drain`
+    le déclare non prêt (/health/ready en 503, le trafic part ailleurs),
+    puis SIGTERM n'est envoyé qu'une fois les requêtes en cours et les
+    calculs signalés par `is_busy` terminés (ou après DRAIN_TIMEOUT_SECONDS).
+    Le superviseur relance un worker neuf.
+    """
+
+    def __init__(self, app, get_model=lambda: None, on_drain=lambda: None, is_busy=lambda: False):
+        self.app = app
+        self.get_model = get_model
+        self.on_drain = on_drain
+        self.is_busy = is_busy
+        self.requests = 0
+        self.active = 0
+        self.recycling = False
+        self.drain_task = None
+
+    def snapshot(self):
+        return live_tensors(), count_hooks(self.get_model())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        before = self.snapshot() if MEMORY_DEBUG else None
+        self.active += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.active -= 1
+            if before is not None:
+                tensors, hooks = self.snapshot()
+                if tensors > before[0] or hooks > before[1]:
+                    logger.warning(f"Fuite possible sur {scope['path']} : "
+                                   f"+{tensors - before[0]} tenseurs, +{hooks - before[1]} hooks")
+            self.after_request()
+
+    def after_request(self):
+        self.requests += 1
+        if malloc_trim is not None and MALLOC_TRIM_EVERY > 0 and self.requests % MALLOC_TRIM_EVERY == 0:
+            malloc_trim(0)
+
+        if MAX_RSS_MB > 0 and not self.recycling:
+            rss_mb = process_rss_bytes() / 2**20
+            if rss_mb > MAX_RSS_MB:
+                self.recycling = True
+                logger.warning(f"RSS {rss_mb:.0f} Mo > MAX_RSS_MB={MAX_RSS_MB:.0f} : recyclage du worker "
+                               f"après {self.requests} requêtes, {self.active} en cours")
+                self.on_drain()
+                self.drain_task = asyncio.get_running_loop().create_task(self.drain())
+
+    async def drain(self):
+        deadline = time.monotonic() + DRAIN_TIMEOUT_SECONDS
+        while (self.active > 0 or self.is_busy()) and time.monotonic() < deadline:
+            await asyncio.sleep(DRAIN_POLL_SECONDS)
+        if self.active > 0 or self.is_busy():
+            logger.warning(f"Arrêt après {DRAIN_TIMEOUT_SECONDS:.0f} s d'attente : {self.active} requêtes en cours")
+        self.stop()
+
+    def stop(self):
+        # uvicorn termine ce qui reste puis s'arrête ; le superviseur
+        # (restart: unless-stopped, gunicorn, uvicorn --workers) relance un worker neuf
+        os.kill(os.getpid(), signal.SIGTERM)
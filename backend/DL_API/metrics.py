@@ -0,0 +1,189 @@
+import os
+import time
+import resource
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Bornes (secondes) des histogrammes : de la milliseconde au délai d'un upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labelnames, values, extra=""):
+    pairs = [f'{k}="{v}"' for k, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """Histogramme cumulatif au format d'exposition Prometheus."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: [0] * len(self.buckets))
+        self._sum = defaultdict(float)
+        self._total = defaultdict(int)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._counts[labels]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sum[labels] += value
+            self._total[labels] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, counts in sorted(self._counts.items()):
+                for bound, count in zip(self.buckets, counts):
+                    bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                inf_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+                plain_labels = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_bucket{inf_labels} {self._total[labels]}")
+                lines.append(f"{self.name}_sum{plain_labels} {self._sum[labels]}")
+                lines.append(f"{self.name}_count{plain_labels} {self._total[labels]}")
+        return lines
+
+class Gauge:
+    """Jauge ; `function` permet une valeur calculée au moment du scrape."""
+
+    def __init__(self, name, documentation, labelnames=(), function=None, kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] += amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if self.function is not None:
+            lines.append(f"{self.name} {self.function()}")
+            return lines
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Counter(Gauge):
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames, kind="counter")
+
+def process_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Sans /proc : pic de RSS (en ko)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _torch_threads():
+    import torch
+    return torch.get_num_threads()
+
+def _torch_interop_threads():
+    import torch
+    return torch.get_num_interop_threads()
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "dl_stage_seconds", "Durée de chaque étape du pipeline d'analyse", ["stage"]))
+request_seconds = registry.register(Histogram(
+    "dl_request_seconds", "Durée des requêtes HTTP", ["path", "status"]))
+in_flight = registry.register(Gauge(
+    "dl_requests_in_flight", "Requêtes en cours de traitement"))
+queue_depth = registry.register(Gauge(
+    "dl_inference_queue_depth", "Requêtes en attente d'un créneau de calcul", ["priority"]))
+queue_wait_seconds = registry.register(Histogram(
+    "dl_queue_wait_seconds", "Attente d'un créneau de calcul par classe de priorité", ["priority"]))
+running_jobs = registry.register(Gauge(
+    "dl_compute_running", "Calculs en cours par classe de priorité", ["priority"]))
+model_load_seconds = registry.register(Gauge(
+    "dl_model_load_seconds", "Durée du dernier chargement du modèle"))
+model_warmup_seconds = registry.register(Gauge(
+    "dl_model_warmup_seconds", "Durée du dernier échauffement (passes avant + GradCAM)"))
+model_info = registry.register(Gauge(
+    "dl_model_info", "Version du modèle servi (1) et versions précédentes (0)", ["version"]))
+model_swaps_total = registry.register(Counter(
+    "dl_model_swaps_total", "Remplacements à chaud du modèle, par issue", ["outcome"]))
+early_exit_total = registry.register(Counter(
+    "dl_early_exit_total", "Décisions du premier étage adaptatif (exit ou escalate)", ["outcome"]))
+image_rejected_total = registry.register(Counter(
+    "dl_image_rejected_total", "Images refusées avant inférence, par motif", ["reason"]))
+registry.register(Gauge("dl_torch_num_threads", "torch.get_num_threads()", function=_torch_threads))
+registry.register(Gauge("dl_torch_num_interop_threads", "torch.get_num_interop_threads()", function=_torch_interop_threads))
+registry.register(Gauge("dl_process_rss_bytes", "Mémoire résidente du processus", function=process_rss_bytes))
+
+def stage(name):
+    """Chronomètre une étape : `with stage("forward"): ...`"""
+    return stage_seconds.time(name)
+
+class LatencyRecorder:
+    """Fenêtre glissante des dernières latences par route, avec percentiles."""
+
+    def __init__(self, window=1000):
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, name, seconds):
+        self.samples[name].append(seconds * 1000)
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def percentiles(self):
+        result = {}
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            if not ordered:
+                continue
+            pick = lambda p: round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 1)
+            result[name] = {"count": len(ordered), "p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99)}
+        return result
+
+latency = LatencyRecorder()
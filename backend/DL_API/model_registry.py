@@ -0,0 +1,179 @@
+import os
+import time
+import asyncio
+import hashlib
+import contextvars
+import logging
+from typing import NamedTuple, Optional
+
+import torch
+
+from model_utils import LABELS, load_model_weights
+from image_utils import compute_gradcam_maps
+from ensemble import load_ensemble_models
+from metrics import model_info, model_load_seconds, model_swaps_total, model_warmup_seconds
+
+# --- Configuration ---
+# Tailles de lot échauffées au démarrage et avant un remplacement (1 = requêtes HTTP)
+WARMUP_BATCH_SIZES = [int(size) for size in os.getenv("WARMUP_BATCH_SIZES", "1").split(",") if size.strip()]
+WARMUP_PASSES = int(os.getenv("WARMUP_PASSES", "2"))
+# Jeton des routes /admin/ (en-tête X-Admin-Token) ; vide = routes désactivées
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+MODEL_VERSION_HEADER = "x-model-version"
+logger = logging.getLogger("uvicorn")
+
+class ServedModel(NamedTuple):
+    model: torch.nn.Module
+    version: str
+    path: str
+    ensemble: dict
+
+# Modèle figé pour toute la durée de la requête, posé par ModelVersionMiddleware
+served_var = contextvars.ContextVar("served_model", default=None)
+
+def checkpoint_version(path):
+    """Empreinte courte du checkpoint : deux fichiers identiques ont la même version."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+def validate(model):
+    """Refuse un checkpoint qui charge mais ne produit pas des sorties exploitables."""
+    with torch.inference_mode():
+        output = model(torch.randn(2, 3, 224, 224))
+    if tuple(output.shape) != (2, len(LABELS)):
+        raise ValueError(f"sortie {tuple(output.shape)}, attendu (2, {len(LABELS)})")
+    if not torch.isfinite(output).all():
+        raise ValueError("sortie non finie (NaN ou inf)")
+
+def warm_up_pass(model, batch_size):
+    """
+    Une passe avant et une passe GradCAM (avant + arrière) : croissance de
+    l'allocateur, choix des noyaux oneDNN et premier graphe autograd sont
+    payés ici plutôt que par les premières requêtes.
+    """
+    batch = torch.randn(batch_size, 3, 224, 224)
+    with torch.inference_mode():
+        model(batch)
+    compute_gradcam_maps(model, batch)
+
+class ModelRegistry:
+    """
+    Modèle servi et cycle de vie : chargement, validation et échauffement
+    avant toute mise en service, puis remplacement atomique. Une requête
+    utilise du début à la fin le modèle en service à son arrivée ; celles en
+    cours au moment d'un remplacement terminent sur l'ancien.
+    """
+
+    def __init__(self):
+        self.served: Optional[ServedModel] = None
+        self.state = "starting"  # starting, ready, failed, draining
+        self.error = None
+        self.swap_status = {"state": "idle"}
+        self._swap_task = None
+
+    async def prepare(self, path, run, ensemble=None):
+        """Charge, valide et échauffe un checkpoint ; `run` exécute chaque étape de calcul."""
+        start = time.perf_counter()
+        model = await asyncio.to_thread(load_model_weights, path)
+        version = await asyncio.to_thread(checkpoint_version, path)
+        if ensemble is None:
+            # Premier chargement : checkpoints supplémentaires de ENSEMBLE_MODEL_PATHS
+            ensemble = await asyncio.to_thread(load_ensemble_models)
+        model_load_seconds.set(time.perf_counter() - start)
+
+        await run(validate, model)
+        start = time.perf_counter()
+        # Une passe par créneau : le trafic en cours s'intercale entre deux passes
+        for batch_size in WARMUP_BATCH_SIZES:
+            for _ in range(WARMUP_PASSES):
+                await run(warm_up_pass, model, batch_size)
+        model_warmup_seconds.set(time.perf_counter() - start)
+        return ServedModel(model, version, path, {**ensemble, "glaucoma_net": model})
+
+    def activate(self, served):
+        previous = self.served
+        # Simple affectation : les requêtes suivantes voient le nouveau modèle
+        self.served = served
+        if self.state != "draining":
+            self.state, self.error = "ready", None
+        if previous is not None:
+            model_info.set(0, previous.version)
+        model_info.set(1, served.version)
+        logger.info(f"Modèle {served.version} en service ({served.path})")
+
+    async def start(self, path, run):
+        try:
+            self.activate(await self.prepare(path, run))
+        except Exception as e:
+            self.state, self.error = "failed", str(e)
+            logger.error(f"Erreur lors du chargement du modèle: {e}")
+
+    def swap(self, path, run):
+        """Lance le remplacement en tâche de fond ; False si un remplacement est déjà en cours."""
+        if self._swap_task is not None and not self._swap_task.done():
+            return False
+        self.swap_status = {"state": "loading", "path": path, "started_at": time.time()}
+        self._swap_task = asyncio.create_task(self._swap(path, run))
+        return True
+
+    async def _swap(self, path, run):
+        try:
+            ensemble = {name: m for name, m in self.served.ensemble.items() if name != "glaucoma_net"} \
+                if self.served is not None else None
+            served = await self.prepare(path, run, ensemble)
+        except Exception as e:
+            model_swaps_total.inc(1, "failed")
+            self.swap_status = {**self.swap_status, "state": "failed", "error": str(e)}
+            logger.error(f"Remplacement du modèle refusé ({path}): {e}")
+            return
+        previous = self.served.version if self.served is not None else None
+        self.activate(served)
+        model_swaps_total.inc(1, "swapped")
+        self.swap_status = {**self.swap_status, "state": "swapped", "version": served.version, "previous": previous}
+
+    def drain(self):
+        """Worker sur le point d'être recyclé : il sert encore, mais n'est plus prêt."""
+        self.state = "draining"
+        logger.info("Worker en cours de vidage : /health/ready passe à 503")
+
+    def current(self):
+        """Modèle de la requête courante (ou modèle en service hors requête)."""
+        return served_var.get() or self.served
+
+    def status(self):
+        served = self.served
+        return {
+            "state": self.state,
+            "model_version": served.version if served else None,
+            "model_path": served.path if served else None,
+            "error": self.error,
+            "swap": self.swap_status,
+        }
+
+class ModelVersionMiddleware:
+    """Middleware ASGI : fige le modèle servi pour la requête et renvoie sa version (X-Model-Version)."""
+
+    def __init__(self, app, registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        served = self.registry.served
+        token = served_var.set(served)
+
+        async def send_with_version(message):
+            if message["type"] == "http.response.start" and served is not None:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (MODEL_VERSION_HEADER.encode(), served.version.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_version)
+        finally:
+            served_var.reset(token)
@@ -2,7 +2,8 @@ import torch
 import torch.nn as nn
 from torchvision.models import mobilenet_v3_large, MobileNet_V3_Large_Weights
 import torch.nn.functional as F
-import numpy as np
+
+LABELS = {0: "No Glaucoma", 1: "Glaucoma Detected"}
 
 # --- 1. ARCHITECTURE DU MODÈLE (Copié de votre code) ---
 
@@ -61,72 +62,69 @@ def load_model_weights(model_path, device='cpu'):
 
 # --- 2. LOGIQUE GRADCAM (Copié et nettoyé) ---
 
-class GradCAM:
-    def __init__(self, model):
-        self.model = model
-        self.feature_extractor = model[0]  
-        self.target_layer = self.feature_extractor[-3]
-        self.gradients = None
-        self.activations = None
-        self.target_layer.register_forward_hook(self.save_activation)
-        self.target_layer.register_full_backward_hook(self.save_gradient)
-    
-    def save_activation(self, module, input, output):
-        self.activations = output
-    
-    def save_gradient(self, module, grad_input, grad_output):
-        self.gradients = grad_output[0]
-    
-    def __call__(self, x, class_idx=None):
-        self.model.eval()
-        output = self.model(x)
-        if class_idx is None:
-            class_idx = output.argmax(dim=1)
-        self.model.zero_grad()
-        one_hot = torch.zeros_like(output)
-        one_hot[0][class_idx] = 1
-        output.backward(gradient=one_hot, retain_graph=True)
-        weights = torch.mean(self.gradients, dim=(2, 3))
-        cam = torch.sum(weights[:, :, None, None] * self.activations, dim=1)
-        cam = F.relu(cam)
-        cam = cam - torch.min(cam)
-        cam = cam / (torch.max(cam) + 1e-7)
-        return cam.detach().cpu().numpy()
-
-class GradCAMPlusPlus:
+class TargetLayerGradients:
+    """
+    Activations et gradients de la couche cible pour un lot d'images. La
+    passe avant est découpée à la couche cible au lieu d'y poser un hook :
+    le modèle partagé n'est jamais modifié, et deux calculs simultanés
+    (plusieurs créneaux de calcul) ne voient chacun que leurs propres
+    activations. Le gradient est obtenu par autograd.grad (ni .grad sur les
+    poids, ni graphe conservé) : rien ne survit à l'appel.
+    """
+
     def __init__(self, model):
         self.model = model
         self.feature_extractor = model[0]
-        self.target_layer = self.feature_extractor[-3] 
-        self.gradients = None
-        self.activations = None
-        self.target_layer.register_forward_hook(self.save_activation)
-        self.target_layer.register_full_backward_hook(self.save_gradient)
-    
-    def save_gradient(self, module, grad_input, grad_output):
-        self.gradients = grad_output[0]
-    
-    def save_activation(self, module, input, output):
-        self.activations = output
-    
-    def __call__(self, x, class_idx=None):
+        # Couche cible : dernier bloc de features (feature_extractor[-3]), avant attention et pooling
+        self.to_target = self.feature_extractor[:-2]
+        self.from_target = self.feature_extractor[-2:]
+
+    def activations_and_gradients(self, x, class_idx=None):
+        """
+        Une passe avant et une passe arrière pour tout le lot. `class_idx` :
+        None (classe prédite), un entier commun ou une classe par image.
+        """
         self.model.eval()
-        output = self.model(x)
+        activations = self.to_target(x)
+        output = self.model[1](self.from_target(activations))
         if class_idx is None:
             class_idx = output.argmax(dim=1)
-        self.model.zero_grad()
+        class_idx = torch.as_tensor(class_idx, device=output.device).reshape(-1).expand(len(output))
+        # Les images du lot sont indépendantes (BN en mode eval) : le gradient de la
+        # somme des scores ciblés donne le gradient de chaque image
         one_hot = torch.zeros_like(output)
-        one_hot[0][class_idx] = 1
-        output.backward(gradient=one_hot, retain_graph=True)
-        grad = self.gradients[0]
-        activation = self.activations[0]
-        alpha_num = grad.pow(2)
-        alpha_denom = 2.0 * grad.pow(2)
-        alpha_denom += torch.sum(activation * grad.pow(3), dim=(1, 2), keepdim=True)
-        alpha = alpha_num / (alpha_denom + 1e-7)
-        weights = torch.sum(alpha * F.relu(grad), dim=(1, 2))
-        cam = torch.sum(weights[:, None, None] * activation, dim=0)
-        cam = F.relu(cam)
-        cam = cam - torch.min(cam)
-        cam = cam / (torch.max(cam) + 1e-7)
-        return cam.detach().cpu().numpy()
\ No newline at end of file
+        one_hot[torch.arange(len(output)), class_idx] = 1
+        gradients, = torch.autograd.grad(output, activations, grad_outputs=one_hot)
+        return activations.detach(), gradients
+
+def _normalize(cam):
+    """ReLU puis mise à l'échelle [0, 1] image par image."""
+    cam = F.relu(cam)
+    cam = cam - cam.amin(dim=(1, 2), keepdim=True)
+    return cam / (cam.amax(dim=(1, 2), keepdim=True) + 1e-7)
+
+def gradcam_from(activations, gradients):
+    weights = torch.mean(gradients, dim=(2, 3))
+    cam = torch.sum(weights[:, :, None, None] * activations, dim=1)
+    return _normalize(cam).cpu().numpy()
+
+def gradcam_pp_from(activations, gradients):
+    alpha_num = gradients.pow(2)
+    alpha_denom = 2.0 * gradients.pow(2)
+    alpha_denom += torch.sum(activations * gradients.pow(3), dim=(2, 3), keepdim=True)
+    alpha = alpha_num / (alpha_denom + 1e-7)
+    weights = torch.sum(alpha * F.relu(gradients), dim=(2, 3))
+    cam = torch.sum(weights[:, :, None, None] * activations, dim=1)
+    return _normalize(cam).cpu().numpy()
+
+class GradCAM(TargetLayerGradients):
+    """Cartes (N, h, w) pour un lot de N images."""
+
+    def __call__(self, x, class_idx=None):
+        return gradcam_from(*self.activations_and_gradients(x, class_idx))
+
+class GradCAMPlusPlus(TargetLayerGradients):
+    """Cartes (N, h, w) pour un lot de N images."""
+
+    def __call__(self, x, class_idx=None):
+        return gradcam_pp_from(*self.activations_and_gradients(x, class_idx))
@@ -0,0 +1,119 @@
+import io
+import os
+import cv2
+import numpy as np
+from PIL import Image
+
+from metrics import image_rejected_total, stage
+
+# --- Configuration ---
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "100000000"))
+# Petit côté visé au décodage : au-delà, décodage réduit (1/2, 1/4, 1/8 ; réduction DCT en JPEG).
+# 0 = toujours décoder en pleine résolution
+DECODE_TARGET_SIDE = int(os.getenv("DECODE_TARGET_SIDE", "512"))
+# Contrôle taille / netteté / exposition, désactivé par défaut : les seuils ci-dessous sont des
+# points de départ, à calibrer sur les images du site (`python quality.py images/*.jpg`)
+QUALITY_GATE = os.getenv("QUALITY_GATE", "0") == "1"
+MIN_IMAGE_SIDE = int(os.getenv("MIN_IMAGE_SIDE", "224"))
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "5"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "15"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "235"))
+QUALITY_MIN_FIELD = float(os.getenv("QUALITY_MIN_FIELD", "0.05"))
+# Les scores sont calculés sur une vignette de taille fixe, indépendante de la source
+QUALITY_SIDE = 512
+
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+class ImageRejected(Exception):
+    """Image inutilisable : `reason` identifie la cause, `status_code` le code 4xx renvoyé."""
+
+    def __init__(self, reason, message, status_code=422):
+        super().__init__(f"{reason}: {message}")
+        self.reason = reason
+        self.message = message
+        self.status_code = status_code
+
+def reject(reason, message, status_code=422):
+    image_rejected_total.inc(1, reason)
+    return ImageRejected(reason, message, status_code)
+
+def probe_image(image_bytes):
+    """
+    Dimensions lues dans l'en-tête seul : PIL ne décode pas les pixels à
+    l'ouverture. Le minimum de côté n'est appliqué qu'avec QUALITY_GATE.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        raise reject("too_large", f"plus de {MAX_IMAGE_PIXELS} pixels", 413)
+    except Exception:
+        raise reject("undecodable", "format non reconnu ou fichier corrompu", 415)
+    if width * height > MAX_IMAGE_PIXELS:
+        raise reject("too_large", f"{width}x{height} dépasse {MAX_IMAGE_PIXELS} pixels", 413)
+    if QUALITY_GATE and min(width, height) < MIN_IMAGE_SIDE:
+        raise reject("too_small", f"{width}x{height}, minimum {MIN_IMAGE_SIDE} px de côté")
+    return width, height
+
+def reduced_flag(width, height, target=DECODE_TARGET_SIDE):
+    """Plus forte réduction gardant le petit côté au-dessus de `target`."""
+    if target > 0:
+        for factor, flag in REDUCED_FLAGS:
+            if min(width, height) // factor >= target:
+                return flag
+    return cv2.IMREAD_COLOR
+
+def quality_scores(image):
+    """Netteté (variance du laplacien) et luminosité, mesurées dans le champ rétinien."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = QUALITY_SIDE / max(gray.shape)
+    gray = cv2.resize(gray, (round(gray.shape[1] * scale), round(gray.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    # Le fond noir et le bord du disque rétinien faussent les deux mesures : on les exclut
+    field = cv2.erode((gray > 10).astype(np.uint8), np.ones((7, 7), np.uint8)).astype(bool)
+    if not field.any():
+        return {"field": 0.0, "brightness": 0.0, "sharpness": 0.0}
+    return {
+        "field": float(field.mean()),
+        "brightness": float(gray[field].mean()),
+        "sharpness": float(cv2.Laplacian(gray, cv2.CV_64F)[field].var()),
+    }
+
+def check_quality(image):
+    scores = quality_scores(image)
+    if scores["field"] < QUALITY_MIN_FIELD:
+        raise reject("no_field", "champ rétinien introuvable (image noire ou presque)")
+    if scores["brightness"] < QUALITY_MIN_BRIGHTNESS:
+        raise reject("underexposed", f"luminosité {scores['brightness']:.0f} < {QUALITY_MIN_BRIGHTNESS:.0f}")
+    if scores["brightness"] > QUALITY_MAX_BRIGHTNESS:
+        raise reject("overexposed", f"luminosité {scores['brightness']:.0f} > {QUALITY_MAX_BRIGHTNESS:.0f}")
+    if scores["sharpness"] < QUALITY_MIN_SHARPNESS:
+        raise reject("blurry", f"netteté {scores['sharpness']:.1f} < {QUALITY_MIN_SHARPNESS:.1f}")
+    return scores
+
+def decode_image(image_bytes):
+    """
+    Décodage OpenCV précédé du contrôle d'en-tête, à résolution réduite pour
+    les grandes photos, puis contrôle qualité. Lève ImageRejected.
+    """
+    width, height = probe_image(image_bytes)
+    with stage("decode"):
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), reduced_flag(width, height))
+    if image is None:
+        raise reject("undecodable", "décodage OpenCV impossible", 415)
+    if QUALITY_GATE:
+        with stage("quality"):
+            check_quality(image)
+    return image
+
+if __name__ == "__main__":
+    # Calibration : scores d'images jugées acceptables, pour choisir les seuils du site
+    import sys
+
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            data = f.read()
+        width, height = Image.open(io.BytesIO(data)).size
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), reduced_flag(width, height))
+        scores = quality_scores(image)
+        print(f"{path}\t{width}x{height}\tchamp {scores['field']:.2f}\t"
+              f"luminosité {scores['brightness']:.0f}\tnetteté {scores['sharpness']:.1f}")
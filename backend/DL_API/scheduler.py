@@ -0,0 +1,144 @@
+import os
+import time
+import asyncio
+import contextvars
+from collections import deque
+
+from metrics import queue_depth, queue_wait_seconds, running_jobs
+
+PRIORITY_HEADER = "x-priority"
+DEFAULT_PRIORITY = "interactive"
+
+def _parse(value):
+    """'interactive=8,bulk=1' -> {'interactive': 8, 'bulk': 1}"""
+    pairs = (item.split("=", 1) for item in value.split(",") if "=" in item)
+    return {name.strip(): int(number) for name, number in pairs}
+
+# Poids du partage équitable : à file pleine partout, 8 calculs interactifs pour 1 de masse
+PRIORITY_WEIGHTS = {"interactive": 8, "background": 2, "bulk": 1,
+                    **_parse(os.getenv("PRIORITY_WEIGHTS", ""))}
+# Calculs simultanés maximum par classe (défaut : tous les créneaux)
+PRIORITY_MAX_CONCURRENCY = _parse(os.getenv("PRIORITY_MAX_CONCURRENCY", ""))
+# Requêtes en attente maximum par classe, au-delà : 503 (défaut : illimité)
+PRIORITY_MAX_QUEUE = {"interactive": 64, **_parse(os.getenv("PRIORITY_MAX_QUEUE", ""))}
+
+# Classe de la requête courante, posée par PriorityMiddleware
+priority_var = contextvars.ContextVar("priority", default=DEFAULT_PRIORITY)
+
+class QueueFull(Exception):
+    def __init__(self, priority):
+        super().__init__(f"File '{priority}' pleine")
+        self.priority = priority
+
+class _Class:
+    def __init__(self, name, weight, max_concurrency, max_queue):
+        self.name = name
+        self.stride = 1 / max(weight, 1)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.waiting = deque()
+        self.running = 0
+        self.pass_value = 0.0
+
+class Scheduler:
+    """
+    Créneaux de calcul partagés entre classes de priorité par ordonnancement
+    à pas (approximation du weighted fair queuing) : chaque classe avance de
+    1/poids à chaque créneau obtenu, la classe en attente la moins avancée
+    passe. Une classe ne dépasse jamais sa concurrence maximale, ce qui
+    garde des créneaux libres pour le trafic interactif.
+    """
+
+    def __init__(self, slots, weights=PRIORITY_WEIGHTS, max_concurrency=PRIORITY_MAX_CONCURRENCY,
+                 max_queue=PRIORITY_MAX_QUEUE):
+        self.slots = slots
+        self.free = slots
+        self.virtual_time = 0.0
+        self.classes = {
+            name: _Class(name, weight, min(max_concurrency.get(name, slots), slots), max_queue.get(name))
+            for name, weight in weights.items()
+        }
+
+    def priority_of(self, name):
+        return name if name in self.classes else DEFAULT_PRIORITY
+
+    async def acquire(self, name):
+        cls = self.classes[self.priority_of(name)]
+        if cls.max_queue is not None and len(cls.waiting) >= cls.max_queue:
+            raise QueueFull(cls.name)
+        if not cls.waiting:
+            # Une classe qui sort d'inactivité ne rattrape pas le temps perdu
+            cls.pass_value = max(cls.pass_value, self.virtual_time)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, time.perf_counter())
+        cls.waiting.append(entry)
+        queue_depth.inc(1, cls.name)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Créneau attribué pendant l'annulation : on le rend
+                self.release(cls.name)
+            else:
+                cls.waiting.remove(entry)
+                queue_depth.dec(1, cls.name)
+            raise
+        return cls.name
+
+    async def run_in_thread(self, name, fn, *args):
+        """
+        Exécute `fn` dans un thread sur un créneau de la classe `name`. Si
+        l'appelant est annulé, le thread continue (il ne peut pas être
+        interrompu) : le créneau n'est rendu qu'à la fin du calcul.
+        """
+        name = await self.acquire(name)
+        task = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+
+        def done(task):
+            self.release(name)
+            if not task.cancelled():
+                task.exception()  # Résultat d'un appelant annulé : pas d'avertissement "never retrieved"
+
+        task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    def release(self, name):
+        cls = self.classes[name]
+        cls.running -= 1
+        running_jobs.dec(1, name)
+        self.free += 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.free > 0:
+            eligible = [c for c in self.classes.values() if c.waiting and c.running < c.max_concurrency]
+            if not eligible:
+                return
+            cls = min(eligible, key=lambda c: c.pass_value)
+            future, enqueued = cls.waiting.popleft()
+            queue_depth.dec(1, cls.name)
+            queue_wait_seconds.observe(time.perf_counter() - enqueued, cls.name)
+            self.virtual_time = cls.pass_value
+            cls.pass_value += cls.stride
+            cls.running += 1
+            running_jobs.inc(1, cls.name)
+            self.free -= 1
+            future.set_result(None)
+
+class PriorityMiddleware:
+    """Middleware ASGI : classe de priorité lue dans l'en-tête X-Priority (interactive par défaut)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        priority = dict(scope["headers"]).get(PRIORITY_HEADER.encode(), b"").decode().strip().lower()
+        token = priority_var.set(priority or DEFAULT_PRIORITY)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            priority_var.reset(token)
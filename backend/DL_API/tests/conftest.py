@@ -0,0 +1,36 @@
+# backend/DL_API/tests/conftest.py
+import os
+import sys
+
+import pytest
+import torch
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+# backend/ : package common (comme main.py)
+sys.path.append(os.path.dirname(SERVICE_DIR))
+
+# Script client manuel (serveur lancé, `requests`) : pas un test pytest
+collect_ignore = ["test_heatmap_client.py"]
+
+@pytest.fixture(scope="session")
+def model():
+    """Architecture du service à poids aléatoires, pour les tests GradCAM sans checkpoint."""
+    import model_utils
+    from torchvision.models import mobilenet_v3_large
+
+    # Pas de téléchargement des poids ImageNet
+    original = model_utils.mobilenet_v3_large
+    model_utils.mobilenet_v3_large = lambda weights=None: mobilenet_v3_large(weights=None)
+    try:
+        torch.manual_seed(0)
+        net = model_utils.build_mobilenetv3_model()
+        # Tête élargie : avec l'initialisation par défaut, les gradients (et les cartes) sont quasi nuls
+        for layer in net[1]:
+            if isinstance(layer, torch.nn.Linear):
+                torch.nn.init.normal_(layer.weight, std=1.0)
+    finally:
+        model_utils.mobilenet_v3_large = original
+    for param in net.parameters():
+        param.requires_grad = True  # hooks arrière de la référence
+    return net.eval()
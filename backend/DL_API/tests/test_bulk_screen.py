@@ -0,0 +1,112 @@
+# backend/DL_API/tests/test_bulk_screen.py
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+from bulk_screen import FIELDS, Screener, list_images, open_checkpoint, pending_paths, read_checkpoint, screen
+
+class MeanLogits(torch.nn.Module):
+    """Classe 1 si le canal rouge domine : prédictions déterministes sans checkpoint."""
+
+    def forward(self, x):
+        return torch.stack([x[:, 1].mean((1, 2)), x[:, 0].mean((1, 2))], dim=1)
+
+def write_image(path, color):
+    Image.new("RGB", (256, 256), color).save(path)
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+def run(sources, checkpoint, retry_errors=True, batch_size=2):
+    """Un passage de la commande : reprise, images restantes, lots, CSV."""
+    done = read_checkpoint(checkpoint, retry_errors)
+    f, writer = open_checkpoint(checkpoint)
+    try:
+        with ThreadPoolExecutor(2) as pool:
+            paths = pending_paths(sources, done)
+            if paths:
+                screen(paths, Screener(MeanLogits(), "cpu", pool), writer, f, batch_size, 4)
+            return paths
+    finally:
+        f.close()
+
+def test_list_images_walks_folders_and_reads_lists(tmp_path):
+    (tmp_path / "b").mkdir()
+    for name in ("b/2.png", "1.JPG", "notes.txt.bak"):
+        (tmp_path / name).write_bytes(b"")
+    listing = tmp_path / "liste.txt"
+    listing.write_text("/ailleurs/x.png\n\n/ailleurs/y.tif\n")
+    assert list(list_images([str(tmp_path)])) == [str(tmp_path / "1.JPG"), str(tmp_path / "b" / "2.png")]
+    assert list(list_images([str(listing)])) == ["/ailleurs/x.png", "/ailleurs/y.tif"]
+
+def test_screen_writes_one_row_per_image(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    write_image(folder / "a.png", (200, 20, 20))
+    write_image(folder / "b.png", (20, 200, 20))
+    write_image(folder / "c.png", (200, 20, 20))
+    (folder / "broken.png").write_bytes(b"pas une image")
+    checkpoint = str(tmp_path / "resultats.csv")
+
+    run([str(folder)], checkpoint)
+    rows = {os.path.basename(row["path"]): row for row in read_rows(checkpoint)}
+    assert sorted(rows) == ["a.png", "b.png", "broken.png", "c.png"]
+    assert rows["broken.png"]["error"] and rows["broken.png"]["prediction_class"] == ""
+    for name in ("a.png", "b.png", "c.png"):
+        assert rows[name]["error"] == "" and len(rows[name]["image_sha256"]) == 64
+        assert 0.5 <= float(rows[name]["probability"]) <= 1
+    assert rows["a.png"]["prediction_class"] == rows["c.png"]["prediction_class"]
+
+def test_errored_rows_are_retried_on_resume(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    write_image(folder / "a.png", (200, 20, 20))
+    (folder / "late.png").write_bytes(b"copie en cours")
+    checkpoint = str(tmp_path / "resultats.csv")
+
+    assert len(run([str(folder)], checkpoint)) == 2
+    # L'échec était passager : la relance retraite seulement cette image
+    write_image(folder / "late.png", (20, 200, 20))
+    assert run([str(folder)], checkpoint) == [str(folder / "late.png")]
+    rows = read_rows(checkpoint)
+    assert sorted(os.path.basename(row["path"]) for row in rows) == ["a.png", "late.png"]
+    assert all(row["error"] == "" for row in rows)
+    assert run([str(folder)], checkpoint) == []
+
+def test_keep_errors_leaves_failed_rows_alone(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    (folder / "broken.png").write_bytes(b"pas une image")
+    checkpoint = str(tmp_path / "resultats.csv")
+    run([str(folder)], checkpoint)
+    assert run([str(folder)], checkpoint, retry_errors=False) == []
+    assert len(read_rows(checkpoint)) == 1
+
+def test_truncated_last_line_is_ignored_and_repaired(tmp_path):
+    checkpoint = tmp_path / "resultats.csv"
+    complete = dict.fromkeys(FIELDS, "")
+    complete.update(path="/x/a.png", image_sha256="0" * 64, prediction_class="0", probability="0.9")
+    with open(checkpoint, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerow(complete)
+        f.write("/x/b.png,abc")  # interruption au milieu d'une ligne
+    assert read_checkpoint(str(checkpoint)) == {"/x/a.png"}
+
+    f, writer = open_checkpoint(str(checkpoint))
+    writer.writerow({**complete, "path": "/x/c.png"})
+    f.close()
+    assert read_checkpoint(str(checkpoint)) == {"/x/a.png", "/x/c.png"}
+
+def test_predict_batches_match_single_images():
+    screener = Screener(MeanLogits(), "cpu", None)
+    arrays = [np.random.default_rng(i).random((1, 3, 8, 8), dtype=np.float32) for i in range(3)]
+    batched = screener.predict(arrays)
+    single = [screener.predict([a]) for a in arrays]
+    assert batched[0] == [s[0][0] for s in single]
+    assert np.allclose(batched[1], [s[1][0] for s in single])
@@ -0,0 +1,41 @@
+# backend/DL_API/tests/test_early_exit.py
+import torch
+
+from early_exit import EARLY_EXIT_CLASSES, EARLY_EXIT_THRESHOLD, adaptive_predict
+
+class ChannelLogits(torch.nn.Module):
+    """Logits = moyenne des canaux 0 et 1 : la confiance ne dépend pas de la résolution."""
+
+    def __init__(self):
+        super().__init__()
+        self.sizes = []
+
+    def forward(self, x):
+        self.sizes.append((len(x), x.shape[-1]))
+        return torch.stack([x[:, 0].mean((1, 2)), x[:, 1].mean((1, 2))], dim=1)
+
+def images(*logits):
+    batch = torch.zeros(len(logits), 3, 224, 224)
+    for i, (healthy, glaucoma) in enumerate(logits):
+        batch[i, 0], batch[i, 1] = healthy, glaucoma
+    return batch
+
+def test_defaults_only_let_healthy_cases_exit():
+    assert EARLY_EXIT_CLASSES == [0]
+    assert EARLY_EXIT_THRESHOLD == 0.98
+
+def test_threshold_applies_to_class_zero_only():
+    model = ChannelLogits()
+    # Sain sûr (p ≈ 0.993), glaucome sûr (p ≈ 0.993), sain incertain (p ≈ 0.73)
+    pred_idx, probability, exits = adaptive_predict(model, images((5, 0), (0, 5), (1, 0)))
+    assert pred_idx == [0, 1, 0]
+    assert exits == [True, False, False]
+    assert probability[0] > EARLY_EXIT_THRESHOLD and probability[1] > EARLY_EXIT_THRESHOLD
+    # Premier étage sur tout le lot en 128, puis modèle complet pour les deux cas repassés
+    assert model.sizes == [(3, 128), (2, 224)]
+
+def test_both_classes_can_exit_when_configured():
+    model = ChannelLogits()
+    _, _, exits = adaptive_predict(model, images((5, 0), (0, 5)), classes=[0, 1])
+    assert exits == [True, True]
+    assert model.sizes == [(2, 128)]
@@ -0,0 +1,186 @@
+# backend/DL_API/tests/test_memory.py
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+import memory
+from memory import MemoryGuardMiddleware
+
+# Écart float32 entre convolutions en lot et image par image, bien sous un pas uint8 (1/255)
+CAM_ATOL = 1e-3
+
+class Recorder(MemoryGuardMiddleware):
+    """Garde mémoire dont l'arrêt est noté au lieu d'envoyer SIGTERM."""
+
+    def __init__(self, app, **kwargs):
+        super().__init__(app, **kwargs)
+        self.events = []
+
+    def stop(self):
+        self.events.append("stop")
+
+def slow_app(release):
+    async def app(scope, receive, send):
+        if scope["path"] == "/slow":
+            await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+    return app
+
+async def request(guard, path):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    await guard({"type": "http", "path": path, "headers": []}, receive, send)
+    return sent[0]["status"]
+
+@pytest.fixture
+def over_limit(monkeypatch):
+    monkeypatch.setattr(memory, "MAX_RSS_MB", 1)
+    monkeypatch.setattr(memory, "process_rss_bytes", lambda: 2 * 2**20)
+    monkeypatch.setattr(memory, "DRAIN_POLL_SECONDS", 0.01)
+
+def test_recycling_waits_for_in_flight_requests(over_limit):
+    async def scenario():
+        release = asyncio.Event()
+        guard = Recorder(slow_app(release))
+        guard.on_drain = lambda: guard.events.append("drain")
+
+        slow = asyncio.create_task(request(guard, "/slow"))
+        await asyncio.sleep(0)
+        assert await request(guard, "/fast") == 200  # dépasse le plafond : vidage
+        assert guard.events == ["drain"]
+        await asyncio.sleep(0.05)
+        assert guard.events == ["drain"]  # la requête lente n'est pas coupée
+
+        release.set()
+        assert await slow == 200
+        await guard.drain_task
+        return guard.events
+
+    assert asyncio.run(scenario()) == ["drain", "stop"]
+
+def test_recycling_waits_for_busy_compute_then_times_out(over_limit, monkeypatch):
+    monkeypatch.setattr(memory, "DRAIN_TIMEOUT_SECONDS", 0.05)
+
+    async def scenario():
+        guard = Recorder(slow_app(asyncio.Event()), is_busy=lambda: True)
+        await request(guard, "/fast")
+        await asyncio.sleep(0.02)
+        assert guard.events == []
+        await guard.drain_task
+        return guard.events
+
+    assert asyncio.run(scenario()) == ["stop"]
+
+def test_draining_worker_is_not_ready():
+    from fastapi.testclient import TestClient
+
+    import main
+    from model_registry import ModelRegistry, ServedModel
+
+    registry = ModelRegistry()
+    registry.activate(ServedModel(None, "v1", "", {}))
+    registry.drain()
+    registry.activate(ServedModel(None, "v2", "", {}))  # un remplacement ne rend pas le worker prêt
+    assert registry.status()["state"] == "draining"
+
+    with TestClient(main.app) as client:
+        main.serving.activate(ServedModel(None, "test", "", {}))
+        assert client.get("/health/ready").status_code == 200
+        main.serving.drain()
+        response = client.get("/health/ready")
+        assert response.status_code == 503
+        assert response.json()["state"] == "draining"
+        assert client.get("/health/live").status_code == 200
+    main.serving.state, main.serving.served = "starting", None
+
+def per_image_cams(model, image):
+    """Calcul d'origine, image par image : hooks avant/arrière et output.backward."""
+    saved = {}
+    layer = model[0][-3]
+    handles = [layer.register_forward_hook(lambda m, i, o: saved.update(activations=o)),
+               layer.register_full_backward_hook(lambda m, gi, go: saved.update(gradients=go[0]))]
+    try:
+        output = model(image)
+        one_hot = torch.zeros_like(output)
+        one_hot[0][output.argmax(dim=1)] = 1
+        model.zero_grad()
+        output.backward(gradient=one_hot)
+    finally:
+        for handle in handles:
+            handle.remove()
+    grad, activation = saved["gradients"][0], saved["activations"][0].detach()
+
+    def normalize(cam):
+        cam = F.relu(cam)
+        cam = cam - torch.min(cam)
+        return (cam / (torch.max(cam) + 1e-7)).detach().numpy()
+
+    gradcam = normalize(torch.sum(grad.mean(dim=(1, 2))[:, None, None] * activation, dim=0))
+    alpha = grad.pow(2) / (2.0 * grad.pow(2) + torch.sum(activation * grad.pow(3), dim=(1, 2), keepdim=True) + 1e-7)
+    weights = torch.sum(alpha * F.relu(grad), dim=(1, 2))
+    gradcam_pp = normalize(torch.sum(weights[:, None, None] * activation, dim=0))
+    return gradcam, gradcam_pp
+
+def test_batched_cams_match_per_image_baseline(model):
+    from image_utils import compute_gradcam_maps
+
+    torch.manual_seed(1)
+    batch = torch.randn(3, 3, 224, 224) * 3
+    gradcam, gradcam_pp = compute_gradcam_maps(model, batch)
+    assert gradcam.shape == gradcam_pp.shape == (3, 7, 7)
+    assert (gradcam.max(axis=(1, 2)) > 0.5).all()
+    assert not np.allclose(gradcam[0], gradcam[1], atol=1e-2)
+    for i in range(len(batch)):
+        expected_cam, expected_pp = per_image_cams(model, batch[i:i + 1])
+        np.testing.assert_allclose(gradcam[i], expected_cam, atol=CAM_ATOL)
+        np.testing.assert_allclose(gradcam_pp[i], expected_pp, atol=CAM_ATOL)
+
+def test_batched_cams_follow_requested_classes(model):
+    from model_utils import GradCAM
+
+    torch.manual_seed(2)
+    batch = torch.randn(2, 3, 224, 224) * 3
+    both = GradCAM(model)(batch, [0, 1])
+    np.testing.assert_allclose(both[0], GradCAM(model)(batch[:1], 0)[0], atol=CAM_ATOL)
+    np.testing.assert_allclose(both[1], GradCAM(model)(batch[1:], 1)[0], atol=CAM_ATOL)
+    assert not np.allclose(both[1], GradCAM(model)(batch[1:], 0)[0], atol=1e-2)
+
+def test_concurrent_cams_do_not_mix_requests(model):
+    from image_utils import compute_gradcam_maps
+    from memory import count_hooks
+
+    torch.manual_seed(3)
+    images = [torch.randn(1, 3, 224, 224) * 3 for _ in range(2)]
+    expected = [compute_gradcam_maps(model, image) for image in images]
+    start = threading.Barrier(len(images))
+    failures = []
+
+    def worker(i):
+        start.wait()
+        for _ in range(10):
+            try:
+                gradcam, gradcam_pp = compute_gradcam_maps(model, images[i])
+                np.testing.assert_allclose(gradcam, expected[i][0], atol=CAM_ATOL)
+                np.testing.assert_allclose(gradcam_pp, expected[i][1], atol=CAM_ATOL)
+            except Exception as e:  # erreur autograd ou carte d'une autre image
+                failures.append(e)
+
+    # Deux créneaux de calcul (INFERENCE_CONCURRENCY=2) sur le même modèle
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert failures == []
+    assert count_hooks(model) == 0
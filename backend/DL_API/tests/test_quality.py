@@ -0,0 +1,91 @@
+# backend/DL_API/tests/test_quality.py
+import io
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+import quality
+from quality import ImageRejected, check_quality, probe_image, reduced_flag
+
+def encode(img, fmt="PNG"):
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+def fundus(size=512, seed=0):
+    """Fond d'œil synthétique : disque orangé, papille claire, vaisseaux sombres."""
+    rng = np.random.default_rng(seed)
+    img = Image.new("RGB", (size, size), (0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((size * 0.04, size * 0.04, size * 0.96, size * 0.96), fill=(170, 80, 40))
+    draw.ellipse((size * 0.6, size * 0.45, size * 0.7, size * 0.55), fill=(240, 200, 150))
+    for _ in range(25):
+        points = [(size * 0.65, size * 0.5)]
+        angle = rng.uniform(0, 2 * np.pi)
+        for _ in range(12):
+            angle += rng.normal(0, 0.25)
+            x, y = points[-1]
+            points.append((x + np.cos(angle) * size / 30, y + np.sin(angle) * size / 30))
+        draw.line(points, fill=(110, 30, 20), width=int(rng.integers(2, 6)))
+    return img
+
+def bgr(img):
+    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+
+def rejection(fn, *args):
+    with pytest.raises(ImageRejected) as excinfo:
+        fn(*args)
+    return excinfo.value
+
+def test_probe_reads_header_dimensions():
+    assert probe_image(encode(Image.new("RGB", (640, 480)), "JPEG")) == (640, 480)
+
+def test_probe_rejects_undecodable_with_415():
+    error = rejection(probe_image, b"not an image at all")
+    assert (error.status_code, error.reason) == (415, "undecodable")
+
+def test_probe_rejects_too_many_pixels_with_413(monkeypatch):
+    monkeypatch.setattr(quality, "MAX_IMAGE_PIXELS", 100 * 100)
+    error = rejection(probe_image, encode(Image.new("RGB", (101, 100))))
+    assert (error.status_code, error.reason) == (413, "too_large")
+
+def test_small_images_pass_unless_the_gate_is_enabled(monkeypatch):
+    small = encode(Image.new("RGB", (100, 80)))
+    assert not quality.QUALITY_GATE  # désactivé par défaut
+    assert probe_image(small) == (100, 80)
+
+    monkeypatch.setattr(quality, "QUALITY_GATE", True)
+    error = rejection(probe_image, small)
+    assert (error.status_code, error.reason) == (422, "too_small")
+
+def test_reduced_flag_keeps_the_short_side_above_target():
+    assert reduced_flag(4000, 3000, 512) == cv2.IMREAD_REDUCED_COLOR_4
+    assert reduced_flag(1024, 1024, 512) == cv2.IMREAD_REDUCED_COLOR_2
+    assert reduced_flag(8192, 4096, 512) == cv2.IMREAD_REDUCED_COLOR_8
+    assert reduced_flag(600, 600, 512) == cv2.IMREAD_COLOR
+    assert reduced_flag(4000, 3000, 0) == cv2.IMREAD_COLOR
+
+def test_reduced_decode_matches_the_flag():
+    data = encode(fundus(1024), "JPEG")
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), reduced_flag(*probe_image(data), 512))
+    assert image.shape[:2] == (512, 512)
+
+def test_sharp_fundus_passes():
+    scores = check_quality(bgr(fundus()))
+    assert scores["sharpness"] > quality.QUALITY_MIN_SHARPNESS
+    assert quality.QUALITY_MIN_BRIGHTNESS < scores["brightness"] < quality.QUALITY_MAX_BRIGHTNESS
+
+@pytest.mark.parametrize("image, reason", [
+    (np.zeros((512, 512, 3), np.uint8), "no_field"),
+    (np.full((512, 512, 3), 12, np.uint8), "underexposed"),
+    (np.full((512, 512, 3), 250, np.uint8), "overexposed"),
+])
+def test_exposure_rejections(image, reason):
+    error = rejection(check_quality, image)
+    assert (error.status_code, error.reason) == (422, reason)
+
+def test_heavy_blur_is_rejected():
+    error = rejection(check_quality, bgr(fundus().filter(ImageFilter.GaussianBlur(8))))
+    assert error.reason == "blurry"
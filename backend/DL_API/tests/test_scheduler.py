@@ -0,0 +1,163 @@
+# backend/DL_API/tests/test_scheduler.py
+import asyncio
+import io
+import threading
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from scheduler import QueueFull, Scheduler
+
+WEIGHTS = {"interactive": 8, "background": 2, "bulk": 1}
+
+def saturated_order(scheduler, jobs_per_class):
+    """Ordre de passage quand toutes les classes attendent déjà : un créneau à la fois."""
+    order = []
+
+    async def job(name):
+        await scheduler.acquire(name)
+        order.append(name)
+        await asyncio.sleep(0)
+        scheduler.release(name)
+
+    async def scenario():
+        # Créneau occupé pendant la mise en file : aucune classe ne part avant les autres
+        await scheduler.acquire("interactive")
+        tasks = [asyncio.create_task(job(name)) for name in WEIGHTS for _ in range(jobs_per_class)]
+        await asyncio.sleep(0)
+        scheduler.release("interactive")
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    return order
+
+def test_slots_are_shared_by_weight():
+    order = saturated_order(Scheduler(1, WEIGHTS, {}, {}), 40)
+    first = order[:44]  # 4 tours complets de 8 + 2 + 1
+    assert (first.count("interactive"), first.count("background"), first.count("bulk")) == (32, 8, 4)
+    assert sorted(order) == sorted(name for name in WEIGHTS for _ in range(40))
+
+def test_idle_class_does_not_catch_up():
+    scheduler = Scheduler(1, WEIGHTS, {}, {})
+    saturated_order(scheduler, 4)  # bulk prend de l'avance, interactive du retard
+    order = saturated_order(scheduler, 8)
+    assert order[:8].count("interactive") >= 5
+
+def test_per_class_concurrency_cap():
+    scheduler = Scheduler(4, WEIGHTS, {"bulk": 1}, {})
+    peak = {"bulk": 0, "interactive": 0}
+    running = {"bulk": 0, "interactive": 0}
+
+    async def job(name, gate):
+        await scheduler.acquire(name)
+        running[name] += 1
+        peak[name] = max(peak[name], running[name])
+        await gate.wait()
+        running[name] -= 1
+        scheduler.release(name)
+
+    async def scenario():
+        gate = asyncio.Event()
+        bulk = [asyncio.create_task(job("bulk", gate)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert scheduler.classes["bulk"].running == 1 and scheduler.free == 3
+        # Les créneaux laissés libres par bulk servent le trafic interactif tout de suite
+        interactive = [asyncio.create_task(job("interactive", gate)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert running == {"bulk": 1, "interactive": 3}
+        gate.set()
+        await asyncio.gather(*bulk, *interactive)
+
+    asyncio.run(scenario())
+    assert peak == {"bulk": 1, "interactive": 3}
+
+def test_full_queue_raises_and_cancelled_waiter_frees_its_place():
+    scheduler = Scheduler(1, WEIGHTS, {}, {"bulk": 1})
+
+    async def scenario():
+        await scheduler.acquire("bulk")
+        waiter = asyncio.create_task(scheduler.acquire("bulk"))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull):
+            await scheduler.acquire("bulk")
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert not scheduler.classes["bulk"].waiting
+        # Place libérée : une nouvelle requête est acceptée
+        again = asyncio.create_task(scheduler.acquire("bulk"))
+        await asyncio.sleep(0)
+        scheduler.release("bulk")
+        assert await again == "bulk"
+
+    asyncio.run(scenario())
+
+def test_cancelled_caller_keeps_the_slot_until_the_thread_ends():
+    scheduler = Scheduler(1, WEIGHTS, {}, {})
+    finish = threading.Event()
+    started = threading.Event()
+
+    def compute():
+        started.set()
+        finish.wait(5)
+        return "done"
+
+    async def scenario():
+        caller = asyncio.create_task(scheduler.run_in_thread("interactive", compute))
+        await asyncio.to_thread(started.wait, 5)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        # Le thread tourne encore : le créneau n'est pas rendu
+        assert scheduler.free == 0
+        next_job = asyncio.create_task(scheduler.run_in_thread("interactive", lambda: "next"))
+        await asyncio.sleep(0.05)
+        assert not next_job.done()
+        finish.set()
+        assert await asyncio.wait_for(next_job, 5) == "next"
+        assert scheduler.free == 1
+
+    asyncio.run(scenario())
+
+def test_full_queue_returns_503(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+    from model_registry import ServedModel
+
+    buf = io.BytesIO()
+    Image.new("RGB", (256, 256), (120, 40, 20)).save(buf, format="PNG")
+    monkeypatch.setattr(main, "scheduler", Scheduler(1, WEIGHTS, {}, {"interactive": 1}))
+
+    with TestClient(main.app) as client:
+        monkeypatch.setattr(main.serving, "served", ServedModel(None, "test", "", {}))
+
+        async def fill():
+            # Un calcul en cours et un autre en attente : la file interactive est pleine
+            await main.scheduler.acquire("interactive")
+            asyncio.ensure_future(main.scheduler.acquire("interactive"))
+
+        client.portal.call(fill)
+        response = client.post("/predict/", files={"file": ("eye.png", buf.getvalue(), "image/png")})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert "interactive" in response.json()["detail"]
+
+def test_gradcam_runs_on_several_slots(model):
+    from image_utils import compute_gradcam_maps
+
+    torch.manual_seed(4)
+    images = [torch.randn(1, 3, 224, 224) * 3 for _ in range(3)]
+    expected = [compute_gradcam_maps(model, image)[0] for image in images]
+    scheduler = Scheduler(3, WEIGHTS, {"bulk": 1}, {})
+
+    async def scenario():
+        jobs = [scheduler.run_in_thread(name, compute_gradcam_maps, model, images[i])
+                for i, name in enumerate(("interactive", "interactive", "bulk")) for _ in range(4)]
+        return await asyncio.gather(*jobs)
+
+    results = asyncio.run(scenario())
+    for job, (gradcam, _) in enumerate(results):
+        np.testing.assert_allclose(gradcam, expected[job // 4], atol=1e-3)
+    assert scheduler.free == 3
@@ -0,0 +1,33 @@
+# backend/DL_API/tests/test_tracing.py
+import asyncio
+
+from tracing import TracingMiddleware, get_request_id
+
+def call(headers):
+    seen = {}
+
+    async def app(scope, receive, send):
+        seen["request_id"] = get_request_id()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/predict/", "headers": headers}
+    asyncio.run(TracingMiddleware(app)(scope, receive, send))
+    assert dict(messages[0]["headers"])[b"x-request-id"].decode() == seen["request_id"]
+    return seen["request_id"]
+
+def test_valid_request_id_is_propagated():
+    assert call([(b"x-request-id", b"5f0c2a9e-77")]) == "5f0c2a9e-77"
+
+def test_unsafe_request_id_is_regenerated():
+    for value in (b"../../tmp/x", b"DEADBEEF", b"a" * 65, b""):
+        request_id = call([(b"x-request-id", value)])
+        assert request_id != value.decode() and len(request_id) == 16
@@ -0,0 +1,60 @@
+import re
+import time
+import uuid
+import contextvars
+
+from metrics import in_flight, request_seconds
+
+REQUEST_ID_HEADER = "x-request-id"
+
+# Identifiant de la requête courante, transmis par l'orchestrateur (uploads)
+# ou généré ici ; copié automatiquement dans les threads via asyncio.to_thread
+request_id_var = contextvars.ContextVar("request_id", default="-")
+# Id repris seulement s'il a cette forme : il finit dans les logs et les noms de fichiers
+REQUEST_ID_PATTERN = re.compile(r"[0-9a-f-]{1,64}")
+
+def get_request_id():
+    return request_id_var.get()
+
+def valid_request_id(value: bytes) -> str:
+    """Id reçu s'il est sûr, sinon un nouvel id."""
+    request_id = value.decode("latin-1")
+    return request_id if REQUEST_ID_PATTERN.fullmatch(request_id) else uuid.uuid4().hex[:16]
+
+class TracingMiddleware:
+    """
+    Middleware ASGI : propage X-Request-ID (régénéré s'il est invalide), compte les requêtes en cours et
+    mesure leur durée par route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        request_id = valid_request_id(headers.get(REQUEST_ID_HEADER.encode(), b""))
+        token = request_id_var.set(request_id)
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(REQUEST_ID_HEADER.encode(), request_id.encode())]
+            await send(message)
+
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            in_flight.dec()
+            # Gabarit de route (ex. /heatmap/{image_id}) pour borner la cardinalité
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            request_seconds.observe(time.perf_counter() - start, path, str(status))
+            request_id_var.reset(token)
@@ -0,0 +1,146 @@
+# backend/benchmarks/calibrate_early_exit.py
+"""
+Calibration du mode adaptatif (sortie anticipée) sur un dossier annoté.
+
+    # un sous-dossier par classe : 0/ et 1/ (ou no_glaucoma/ et glaucoma_detected/)
+    python calibrate_early_exit.py /data/annote --size 128 --thresholds 0.9 0.95 0.98 0.99
+    python calibrate_early_exit.py /data/annote --target-agreement 0.995 --output early_exit.json
+
+Pour chaque seuil : part des images sorties au premier étage, accord avec le
+modèle complet, précision face aux annotations et débit mesuré face au
+chemin complet. Le plus petit seuil atteignant l'accord visé est recommandé
+(EARLY_EXIT_THRESHOLD).
+
+Seules les classes de --classes (défaut 0, sain, comme EARLY_EXIT_CLASSES)
+sortent tôt : le seuil n'est calibré que pour elles, les autres repassent
+toujours par le modèle complet.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DL_API_DIR = os.path.join(HERE, "..", "DL_API")
+sys.path.insert(0, DL_API_DIR)
+
+import torch  # noqa: E402
+import torch.nn.functional as F  # noqa: E402
+
+from bulk_screen import list_images  # noqa: E402
+from early_exit import adaptive_predict, first_stage  # noqa: E402
+from image_utils import preprocess_image_from_bytes, prepare_tensor  # noqa: E402
+from micro import load_model  # noqa: E402
+from model_utils import LABELS  # noqa: E402
+
+
+def class_of(dirname):
+    name = dirname.lower().replace("_", " ")
+    if name.isdigit():
+        return int(name)
+    for idx, label in LABELS.items():
+        if label.lower() == name:
+            return idx
+    return None
+
+
+def load_labeled(folder):
+    tensors, labels = [], []
+    for entry in sorted(os.listdir(folder)):
+        label = class_of(entry)
+        if label is None or not os.path.isdir(os.path.join(folder, entry)):
+            continue
+        for path in list_images([os.path.join(folder, entry)]):
+            with open(path, "rb") as f:
+                tensors.append(prepare_tensor(preprocess_image_from_bytes(f.read())))
+            labels.append(label)
+    if not tensors:
+        raise SystemExit(f"Aucune image annotée dans {folder} (sous-dossiers 0/, 1/ attendus)")
+    return tensors, torch.tensor(labels)
+
+
+def timed(fn, batches, repeats):
+    """Débit (images/s) du meilleur passage sur l'ensemble des lots."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for batch in batches:
+            fn(batch)
+        best = min(best, time.perf_counter() - start)
+    return sum(len(b) for b in batches) / best
+
+
+def full_predict(model, batch):
+    with torch.inference_mode():
+        return F.softmax(model(batch), dim=1).max(dim=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", help="dossier annoté (un sous-dossier par classe)")
+    parser.add_argument("--model", default=os.path.join(DL_API_DIR, "best_model.pth"))
+    parser.add_argument("--size", type=int, default=128, help="résolution du premier étage")
+    parser.add_argument("--classes", type=int, nargs="+", default=[0], help="classes autorisées à sortir tôt")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.8, 0.9, 0.95, 0.98, 0.99, 0.995])
+    parser.add_argument("--target-agreement", type=float, default=0.995)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="rapport JSON")
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    tensors, labels = load_labeled(args.folder)
+    batches = [torch.cat(tensors[i:i + args.batch_size]) for i in range(0, len(tensors), args.batch_size)]
+    images = torch.cat(batches)
+
+    full_prob, full_idx = full_predict(model, images)
+    stage_prob, stage_idx = first_stage(model, images, args.size).max(dim=1)
+    allowed = torch.zeros_like(stage_idx, dtype=torch.bool)
+    for c in args.classes:
+        allowed |= stage_idx == c
+
+    full_rate = timed(lambda b: full_predict(model, b), batches, args.repeats)
+    report = {
+        "images": len(images),
+        "size": args.size,
+        "full": {"accuracy": (full_idx == labels).float().mean().item(), "images_per_s": full_rate},
+        "thresholds": [],
+    }
+    print(f"{len(images)} images, modèle complet : {full_rate:.1f} img/s, "
+          f"précision {report['full']['accuracy']:.4f}")
+    print(f"{'seuil':>7} {'sorties':>8} {'accord':>8} {'précision':>10} {'img/s':>8} {'gain':>6}")
+
+    for threshold in args.thresholds:
+        exits = allowed & (stage_prob >= threshold)
+        adaptive_idx = torch.where(exits, stage_idx, full_idx)
+        rate = timed(lambda b: adaptive_predict(model, b, threshold, args.size, args.classes),
+                     batches, args.repeats)
+        row = {
+            "threshold": threshold,
+            "exit_rate": exits.float().mean().item(),
+            "agreement": (adaptive_idx == full_idx).float().mean().item(),
+            "accuracy": (adaptive_idx == labels).float().mean().item(),
+            "images_per_s": rate,
+            "speedup": rate / full_rate,
+        }
+        report["thresholds"].append(row)
+        print(f"{threshold:>7} {row['exit_rate']:>8.3f} {row['agreement']:>8.4f} {row['accuracy']:>10.4f} "
+              f"{rate:>8.1f} {row['speedup']:>5.2f}x")
+
+    eligible = [r for r in report["thresholds"] if r["agreement"] >= args.target_agreement]
+    report["recommended_threshold"] = min(r["threshold"] for r in eligible) if eligible else None
+    if eligible:
+        print(f"Seuil recommandé (accord ≥ {args.target_agreement}) : "
+              f"EARLY_EXIT_THRESHOLD={report['recommended_threshold']} EARLY_EXIT_SIZE={args.size}")
+    else:
+        print(f"Aucun seuil n'atteint un accord de {args.target_agreement} : garder le chemin complet")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
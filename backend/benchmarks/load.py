@@ -0,0 +1,135 @@
+# backend/benchmarks/load.py
+"""
+Tests de charge HTTP des deux services avec des images de fond d'œil synthétiques.
+
+    # services lancés (ports 8001 et 8000)
+    python load.py --scenarios analyze heatmap --concurrency 4 --requests 100
+    python load.py --scenarios uploadfile history --concurrency 8 --dl-pid 1234 --uploads-pid 5678
+    python load.py --baseline baselines/load.json
+    # isolation des priorités : p95 interactif pendant une charge de masse
+    python load.py --scenarios analyze --priority bulk --concurrency 8 --requests 2000 &
+    python load.py --scenarios predict --priority interactive --concurrency 2
+
+Les mesures RSS/CPU portent sur les processus serveurs si leurs PID sont fournis.
+"""
+import argparse
+import asyncio
+import contextlib
+import sys
+import time
+import uuid
+
+import httpx
+
+from report import ResourceSampler, add_report_arguments, finish, summarize
+from synthetic import fundus_bytes
+
+
+class Scenario:
+    def __init__(self, name, service, build_request):
+        self.name = name
+        self.service = service  # "dl" ou "uploads"
+        self.build_request = build_request
+
+
+async def setup_uploads_user(client, base_url):
+    email = f"bench_{uuid.uuid4().hex[:8]}@example.com"
+    password = "bench-password"
+    await client.post(f"{base_url}/signup", json={"email": email, "password": password})
+    r = await client.post(f"{base_url}/token", data={"username": email, "password": password})
+    r.raise_for_status()
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = await client.post(f"{base_url}/patients", headers=headers,
+                          json={"full_name": "Patient Benchmark", "age": 60, "gender": "F"})
+    r.raise_for_status()
+    return headers, r.json()["patient"]["id"]
+
+
+def build_scenarios(args, images, auth_headers=None, patient_id=None):
+    def image_file(i):
+        return {"file": (f"fundus_{i}.jpg", images[i % len(images)], "image/jpeg")}
+
+    dl, up = args.dl_url.rstrip("/"), args.uploads_url.rstrip("/")
+    return {
+        "predict": Scenario("predict", "dl", lambda i: ("POST", f"{dl}/predict/", {"files": image_file(i)})),
+        "ensemble": Scenario("ensemble", "dl", lambda i: ("POST", f"{dl}/predict/ensemble/", {"files": image_file(i)})),
+        "analyze": Scenario("analyze", "dl", lambda i: ("POST", f"{dl}/analyze/", {"files": image_file(i)})),
+        "heatmap": Scenario("heatmap", "dl", lambda i: ("POST", f"{dl}/heatmap/", {"files": image_file(i)})),
+        "uploadfile": Scenario("uploadfile", "uploads", lambda i: (
+            "POST", f"{up}/uploadfile/",
+            {"files": image_file(i), "data": {"patient_id": str(patient_id)}, "headers": auth_headers})),
+        "history": Scenario("history", "uploads", lambda i: ("GET", f"{up}/history", {"headers": auth_headers})),
+    }
+
+
+async def run_scenario(client, scenario, n_requests, concurrency):
+    latencies, errors = [], 0
+    counter = iter(range(n_requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, kwargs = scenario.build_request(i)
+            t0 = time.perf_counter()
+            try:
+                r = await client.request(method, url, **kwargs)
+                ok = r.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append((time.perf_counter() - t0) * 1000)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors, time.perf_counter() - start
+
+
+async def main_async(args):
+    images = [fundus_bytes(seed=i, size=args.image_size) for i in range(args.distinct_images)]
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    headers = {"X-Priority": args.priority}
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits, headers=headers) as client:
+        auth_headers, patient_id = None, None
+        if any(s in ("uploadfile", "history") for s in args.scenarios):
+            auth_headers, patient_id = await setup_uploads_user(client, args.uploads_url.rstrip("/"))
+        scenarios = build_scenarios(args, images, auth_headers, patient_id)
+
+        for name in args.scenarios:
+            scenario = scenarios[name]
+            # Échauffement (chargements paresseux, allocations)
+            await run_scenario(client, scenario, args.warmup, 1)
+            pid = args.dl_pid if scenario.service == "dl" else args.uploads_pid
+            sampler = ResourceSampler(pid) if pid else None
+            with sampler or contextlib.nullcontext():
+                latencies, errors, elapsed = await run_scenario(client, scenario, args.requests, args.concurrency)
+            key = f"{name}@c{args.concurrency}"
+            results[key] = {**summarize(latencies, elapsed, errors), **(sampler.summary() if sampler else {})}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dl-url", default="http://localhost:8001")
+    parser.add_argument("--uploads-url", default="http://localhost:8000")
+    parser.add_argument("--scenarios", nargs="+", default=["predict", "analyze", "heatmap", "uploadfile", "history"],
+                        choices=["predict", "ensemble", "analyze", "heatmap", "uploadfile", "history"])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100, help="requêtes par scénario")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--image-size", type=int, default=1024)
+    parser.add_argument("--distinct-images", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--priority", default="interactive", choices=["interactive", "background", "bulk"],
+                        help="classe de priorité envoyée au service IA (X-Priority)")
+    parser.add_argument("--dl-pid", type=int, help="PID du service IA (RSS/CPU)")
+    parser.add_argument("--uploads-pid", type=int, help="PID de l'orchestrateur (RSS/CPU)")
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    return finish(asyncio.run(main_async(args)), args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
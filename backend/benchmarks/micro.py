@@ -0,0 +1,98 @@
+# backend/benchmarks/micro.py
+"""
+Microbenchmarks des étapes du service IA, sans HTTP.
+
+    cd backend/benchmarks
+    python micro.py --iterations 30 --save-baseline baselines/micro.json
+    python micro.py --iterations 30 --baseline baselines/micro.json
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DL_API_DIR = os.path.join(HERE, "..", "DL_API")
+sys.path.insert(0, DL_API_DIR)
+
+import torch  # noqa: E402
+
+from ensemble import TTA_VIEWS, ensemble_predict  # noqa: E402
+from image_utils import compute_gradcam_maps, preprocess_image_from_bytes, prepare_tensor, render_gradcam_figure  # noqa: E402
+from model_utils import GradCAM, GradCAMPlusPlus, build_mobilenetv3_model, load_model_weights  # noqa: E402
+from report import ResourceSampler, add_report_arguments, finish, summarize  # noqa: E402
+from synthetic import fundus_bytes  # noqa: E402
+
+
+def load_model(path):
+    if os.path.exists(path):
+        return load_model_weights(path)
+    print(f"{path} introuvable : poids aléatoires pour la tête (latences représentatives)")
+    return build_mobilenetv3_model(num_classes=2).eval()
+
+
+def build_cases(model, image_size):
+    data = fundus_bytes(seed=0, size=image_size)
+    pil_image = preprocess_image_from_bytes(data)
+    tensor = prepare_tensor(pil_image)
+    gradcam_map = GradCAM(model)(tensor)
+    gradcam_pp_map = GradCAMPlusPlus(model)(tensor)
+
+    def forward():
+        with torch.inference_mode():
+            model(tensor)
+
+    return {
+        "preprocess_image_from_bytes": lambda: preprocess_image_from_bytes(data),
+        "prepare_tensor": lambda: prepare_tensor(pil_image),
+        "model_forward": forward,
+        # Coût du mode TTA (toutes les vues, un modèle) face à model_forward
+        "ensemble_tta": lambda: ensemble_predict({"model": model}, tensor, list(TTA_VIEWS)),
+        "gradcam": lambda: GradCAM(model)(tensor),
+        "gradcam_pp": lambda: GradCAMPlusPlus(model)(tensor),
+        # Les deux cartes pour 8 images en une passe avant/arrière, face à 8 × (gradcam + gradcam_pp)
+        "gradcam_maps_batch8": lambda: compute_gradcam_maps(model, tensor.repeat(8, 1, 1, 1)),
+        "heatmap_render": lambda: render_gradcam_figure(tensor, gradcam_map, gradcam_pp_map),
+    }
+
+
+def run_case(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    with ResourceSampler() as sampler:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            fn()
+            latencies.append((time.perf_counter() - t0) * 1000)
+        elapsed = time.perf_counter() - start
+    return {**summarize(latencies, elapsed), **sampler.summary()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(DL_API_DIR, "best_model.pth"))
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--image-size", type=int, default=1024, help="côté de l'image synthétique (px)")
+    parser.add_argument("--threads", type=int, help="torch.set_num_threads")
+    parser.add_argument("--only", nargs="+", help="sous-ensemble de cas")
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = load_model(args.model)
+    cases = build_cases(model, args.image_size)
+
+    results = {}
+    for name, fn in cases.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = run_case(fn, args.iterations, args.warmup)
+    return finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
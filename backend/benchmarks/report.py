@@ -0,0 +1,146 @@
+# backend/benchmarks/report.py
+"""Statistiques, mesure RSS/CPU et comparaison à une baseline enregistrée."""
+import json
+import os
+import platform
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # psutil est optionnel : RSS/CPU non mesurés
+    psutil = None
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(latencies_ms, elapsed_s, errors=0):
+    return {
+        "count": len(latencies_ms),
+        "errors": errors,
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "mean_ms": sum(latencies_ms) / len(latencies_ms) if latencies_ms else None,
+        "throughput_per_s": len(latencies_ms) / elapsed_s if elapsed_s > 0 else None,
+    }
+
+
+class ResourceSampler:
+    """Échantillonne RSS et CPU d'un processus (par défaut le processus courant)."""
+
+    def __init__(self, pid=None, interval=0.2):
+        self.interval = interval
+        self.process = psutil.Process(pid or os.getpid()) if psutil else None
+        self.rss_mb = []
+        self.cpu_percent = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.process is not None:
+            self.process.cpu_percent(None)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.rss_mb.append(self.process.memory_info().rss / 2**20)
+                self.cpu_percent.append(self.process.cpu_percent(None))
+            except psutil.Error:
+                break
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def summary(self):
+        if not self.rss_mb:
+            return {}
+        return {
+            "rss_peak_mb": max(self.rss_mb),
+            "rss_end_mb": self.rss_mb[-1],
+            "cpu_mean_percent": sum(self.cpu_percent) / len(self.cpu_percent),
+        }
+
+
+def environment():
+    info = {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def print_table(results):
+    print(f"{'cas':<28}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'débit/s':>10}{'RSS max':>10}{'CPU %':>8}")
+    for name, r in results.items():
+        fmt = lambda v, spec=".1f": format(v, spec) if v is not None else "-"
+        print(f"{name:<28}{r['count']:>6}{fmt(r['p50_ms']):>10}{fmt(r['p95_ms']):>10}{fmt(r['p99_ms']):>10}"
+              f"{fmt(r['throughput_per_s']):>10}{fmt(r.get('rss_peak_mb')):>10}{fmt(r.get('cpu_mean_percent')):>8}")
+
+
+def save_results(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(),
+                   "results": results}, f, indent=2)
+
+
+def compare_to_baseline(results, baseline_path, tolerance=0.15):
+    """
+    Retourne la liste des régressions : p95 plus lent ou débit plus faible
+    que la baseline au-delà de la tolérance (15 % par défaut).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    for name, current in results.items():
+        ref = baseline.get(name)
+        if ref is None:
+            continue
+        if ref.get("p95_ms") and current.get("p95_ms") and current["p95_ms"] > ref["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {ref['p95_ms']:.1f} -> {current['p95_ms']:.1f} ms")
+        if (ref.get("throughput_per_s") and current.get("throughput_per_s")
+                and current["throughput_per_s"] < ref["throughput_per_s"] * (1 - tolerance)):
+            regressions.append(f"{name}: débit {ref['throughput_per_s']:.1f} -> {current['throughput_per_s']:.1f} /s")
+    return regressions
+
+
+def finish(results, args):
+    """Affiche, enregistre et compare ; retourne le code de sortie."""
+    print_table(results)
+    if args.output:
+        save_results(args.output, results)
+    if args.save_baseline:
+        save_results(args.save_baseline, results)
+        print(f"Baseline enregistrée : {args.save_baseline}")
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"RÉGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"Aucune régression par rapport à {args.baseline} (tolérance {args.tolerance:.0%})")
+    return 0
+
+
+def add_report_arguments(parser):
+    parser.add_argument("--output", help="fichier JSON des résultats")
+    parser.add_argument("--save-baseline", help="enregistre les résultats comme nouvelle baseline")
+    parser.add_argument("--baseline", help="baseline à comparer (code de sortie 1 si régression)")
+    parser.add_argument("--tolerance", type=float, default=0.15)
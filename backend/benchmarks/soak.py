@@ -0,0 +1,116 @@
+# backend/benchmarks/soak.py
+"""
+Test d'endurance mémoire du service IA : RSS relevé sur /metrics au fil des requêtes.
+
+    # service lancé (port 8001), sans MAX_RSS_MB pour observer la dérive brute
+    python soak.py --requests 10000 --path "/analyze/"
+    python soak.py --requests 10000 --path "/heatmap/" --max-growth-mb 30 --output soak.json
+
+Après l'échauffement (allocations paresseuses de torch/matplotlib), le RSS doit
+rester plat : code de sortie 1 si la croissance dépasse --max-growth-mb.
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+
+import httpx
+
+from synthetic import fundus_bytes
+
+RSS_PATTERN = re.compile(r"^dl_process_rss_bytes (\S+)$", re.MULTILINE)
+
+
+async def read_rss_mb(client, base_url):
+    r = await client.get(f"{base_url}/metrics")
+    r.raise_for_status()
+    return float(RSS_PATTERN.search(r.text).group(1)) / 2**20
+
+
+def slope_per_1k(points):
+    """Pente (Mo pour 1000 requêtes) par moindres carrés."""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x * 1000
+
+
+async def main_async(args):
+    base_url = args.dl_url.rstrip("/")
+    images = [fundus_bytes(seed=i, size=args.image_size) for i in range(args.distinct_images)]
+    samples, errors = [], 0
+    counter = iter(range(args.requests))
+    done = 0
+    start = time.perf_counter()
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        samples.append((0, await read_rss_mb(client, base_url)))
+
+        async def worker():
+            nonlocal errors, done
+            for i in counter:
+                files = {"file": (f"fundus_{i}.jpg", images[i % len(images)], "image/jpeg")}
+                try:
+                    r = await client.post(f"{base_url}{args.path}", files=files)
+                    errors += r.status_code >= 400
+                except httpx.HTTPError:
+                    errors += 1
+                done += 1
+                if done % args.sample_every == 0:
+                    rss = await read_rss_mb(client, base_url)
+                    samples.append((done, rss))
+                    print(f"{done:>6} requêtes  RSS {rss:8.1f} Mo  ({done / (time.perf_counter() - start):.1f} req/s)")
+
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        samples.append((done, await read_rss_mb(client, base_url)))
+
+    warm = [(x, y) for x, y in samples if x >= args.warmup] or samples
+    growth = warm[-1][1] - warm[0][1] if len(warm) > 1 else 0.0
+    return {
+        "path": args.path,
+        "requests": done,
+        "errors": errors,
+        "rss_start_mb": samples[0][1],
+        "rss_warm_mb": warm[0][1],
+        "rss_end_mb": samples[-1][1],
+        "growth_after_warmup_mb": growth,
+        "slope_mb_per_1k": slope_per_1k(warm) if len(warm) > 1 else 0.0,
+        "samples": samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dl-url", default="http://localhost:8001")
+    parser.add_argument("--path", default="/analyze/", help="route testée (/analyze/, /heatmap/, /predict/)")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--warmup", type=int, default=200, help="requêtes ignorées dans le calcul de croissance")
+    parser.add_argument("--sample-every", type=int, default=100)
+    parser.add_argument("--image-size", type=int, default=1024)
+    parser.add_argument("--distinct-images", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--max-growth-mb", type=float, default=50)
+    parser.add_argument("--output", help="rapport JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    print(f"RSS : {result['rss_warm_mb']:.1f} Mo après échauffement -> {result['rss_end_mb']:.1f} Mo "
+          f"(+{result['growth_after_warmup_mb']:.1f} Mo, pente {result['slope_mb_per_1k']:.2f} Mo/1000 req), "
+          f"{result['errors']} erreurs")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if result["growth_after_warmup_mb"] > args.max_growth_mb:
+        print(f"ÉCHEC : croissance supérieure à {args.max_growth_mb} Mo")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
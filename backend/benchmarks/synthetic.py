@@ -0,0 +1,46 @@
+# backend/benchmarks/synthetic.py
+"""Images de fond d'œil synthétiques, reproductibles (même graine -> mêmes octets)."""
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def make_fundus_image(seed: int = 0, size: int = 1024) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    img = Image.new("RGB", (size, size), (0, 0, 0))
+    draw = ImageDraw.Draw(img)
+
+    # Rétine : disque orangé
+    margin = size // 16
+    base = (int(rng.integers(150, 200)), int(rng.integers(60, 90)), int(rng.integers(20, 40)))
+    draw.ellipse((margin, margin, size - margin, size - margin), fill=base)
+
+    # Vaisseaux : courbes sombres partant du disque optique
+    cx = int(size * rng.uniform(0.35, 0.45))
+    cy = int(size * rng.uniform(0.45, 0.55))
+    for _ in range(10):
+        angle = rng.uniform(0, 2 * np.pi)
+        points = [(cx, cy)]
+        for step in range(1, 8):
+            angle += rng.normal(0, 0.25)
+            r = step * size / 18
+            points.append((cx + r * np.cos(angle), cy + r * np.sin(angle)))
+        draw.line(points, fill=(110, 30, 20), width=max(2, size // 200))
+
+    # Disque optique clair et excavation (ratio cup/disc aléatoire)
+    disc = size // 12
+    cup = int(disc * rng.uniform(0.3, 0.8))
+    draw.ellipse((cx - disc, cy - disc, cx + disc, cy + disc), fill=(240, 200, 120))
+    draw.ellipse((cx - cup, cy - cup, cx + cup, cy + cup), fill=(255, 235, 180))
+
+    img = img.filter(ImageFilter.GaussianBlur(radius=size / 400))
+    noise = rng.normal(0, 6, (size, size, 3))
+    arr = np.clip(np.asarray(img, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(arr)
+
+
+def fundus_bytes(seed: int = 0, size: int = 1024, fmt: str = "JPEG") -> bytes:
+    buf = io.BytesIO()
+    make_fundus_image(seed, size).save(buf, format=fmt, quality=92)
+    return buf.getvalue()
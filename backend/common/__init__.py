@@ -0,0 +1,2 @@
+# backend/common/__init__.py
+# Modules partagés par les services uploads et DL_API
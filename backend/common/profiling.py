@@ -0,0 +1,155 @@
+# backend/common/profiling.py
+import os
+import re
+import sys
+import time
+import secrets
+import threading
+import contextvars
+from collections import Counter
+
+# --- Configuration ---
+# Désactivé par défaut : le middleware n'est alors même pas installé
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# Une requête sur N est profilée (0 = uniquement sur en-tête X-Profile: 1 + X-Admin-Token)
+PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "100"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_MAX_MB = float(os.getenv("PROFILE_MAX_MB", "200"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_HEADER = b"x-profile"
+# X-Profile n'est pris en compte qu'accompagné de ce jeton (en-tête X-Admin-Token) ; vide = ignoré
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+ADMIN_TOKEN_HEADER = b"x-admin-token"
+
+# Nom de base des fichiers de la requête profilée en cours (None sinon)
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+class StackSampler:
+    """
+    Profileur par échantillonnage : relève la pile de tous les threads à
+    intervalle fixe et produit un fichier "collapsed" (une pile par ligne,
+    cadres séparés par ';', suivie du nombre d'échantillons), lisible par
+    flamegraph.pl ou speedscope.
+    """
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profile-sampler")
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def rotate_profiles(directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES, max_mb=PROFILE_MAX_MB):
+    """Supprime les plus anciens profils au-delà du nombre ou de la taille maximale."""
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    while entries and (len(entries) > max_files or total > max_mb * 2**20):
+        _, size, path = entries.pop(0)
+        total -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def profile_torch(fn, *args):
+    """
+    Exécute `fn` sous torch.profiler si la requête courante est profilée
+    (à appeler dans le thread de calcul : le contexte y est copié).
+    """
+    base = current_profile.get()
+    if base is None:
+        return fn(*args)
+
+    from torch.profiler import ProfilerActivity, profile
+    with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+        result = fn(*args)
+    prof.export_chrome_trace(f"{base}.torch.json")
+    return result
+
+
+def profile_name(path, request_id):
+    """Nom de fichier sûr : la route est réduite à [A-Za-z0-9_-] et tronquée."""
+    route = re.sub(r"[^A-Za-z0-9_-]+", "_", path).strip("_")[:64] or "root"
+    return f"{time.strftime('%Y%m%d_%H%M%S')}_{route}_{request_id}"
+
+
+def is_admin(headers):
+    token = headers.get(ADMIN_TOKEN_HEADER, b"").decode("latin-1")
+    return bool(ADMIN_TOKEN) and secrets.compare_digest(token, ADMIN_TOKEN)
+
+
+class ProfilingMiddleware:
+    """
+    Profile une requête sur N, ou celles portant l'en-tête X-Profile: 1 avec
+    le jeton administrateur. À installer sous le middleware qui pose l'id de
+    requête (déjà validé), lu par `get_request_id`.
+    """
+
+    def __init__(self, app, get_request_id):
+        self.app = app
+        self.get_request_id = get_request_id
+        self.counter = 0
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    def _should_profile(self, scope):
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER) == b"1" and is_admin(headers):
+            return True
+        if PROFILE_SAMPLE_RATE <= 0:
+            return False
+        self.counter += 1
+        return self.counter % PROFILE_SAMPLE_RATE == 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        base = os.path.join(PROFILE_DIR, profile_name(scope["path"], self.get_request_id() or "-"))
+        token = current_profile.set(base)
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_profile.reset(token)
+            sampler.stop()
+            sampler.write(f"{base}.collapsed")
+            rotate_profiles()
@@ -0,0 +1,156 @@
+# backend/uploads/chat_cache.py
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+logger = logging.getLogger("ChatCache")
+
+# --- Configuration ---
+GUIDE_CACHE_MAX_ENTRIES = int(os.getenv("GUIDE_CACHE_MAX_ENTRIES", "2000"))
+GUIDE_CACHE_TTL_SECONDS = int(os.getenv("GUIDE_CACHE_TTL_SECONDS", "86400"))
+# Niveau sémantique (optionnel) : une requête d'embedding, bien moins chère que gpt-4o
+GUIDE_CACHE_SEMANTIC = os.getenv("GUIDE_CACHE_SEMANTIC", "0") == "1"
+GUIDE_CACHE_SIMILARITY = float(os.getenv("GUIDE_CACHE_SIMILARITY", "0.92"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+REPLAY_CHUNK_CHARS = 24
+
+
+def normalize_question(text: str) -> str:
+    """Minuscules, sans accents ni ponctuation, espaces compactés."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def history_digest(history: list) -> str:
+    normalized = [
+        (m.get("role"), normalize_question(str(m.get("content", "")))) if isinstance(m, dict) else str(m)
+        for m in history
+    ]
+    return hashlib.sha1(json.dumps(normalized).encode("utf-8")).hexdigest()[:16]
+
+
+class CacheEntry:
+    __slots__ = ("answer", "created_at", "embedding")
+
+    def __init__(self, answer, embedding=None):
+        self.answer = answer
+        self.created_at = time.monotonic()
+        self.embedding = embedding
+
+
+class ResponseCache:
+    """
+    Cache des réponses du guide, LRU + TTL.
+
+    Clé exacte : (langue, historique tronqué, question normalisée). Le niveau
+    sémantique compare l'embedding de la question aux entrées de la même
+    partition (langue + historique) et accepte au-delà du seuil de similarité.
+    """
+
+    def __init__(self, max_entries=GUIDE_CACHE_MAX_ENTRIES, ttl_seconds=GUIDE_CACHE_TTL_SECONDS,
+                 similarity=GUIDE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        # Index local par partition : (clés, matrice des embeddings normalisés)
+        self._index = {}
+        self.stats = defaultdict(int)
+
+    @staticmethod
+    def make_key(lang: str, question: str, history: list):
+        return (lang, history_digest(history), normalize_question(question))
+
+    def _expired(self, entry):
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.embedding is not None:
+            self._index.pop(key[:2], None)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.answer
+
+    def get_similar(self, key, embedding):
+        partition = key[:2]
+        if partition not in self._index:
+            keys = [k for k, e in self._entries.items() if k[:2] == partition and e.embedding is not None]
+            if not keys:
+                return None
+            self._index[partition] = (keys, np.stack([self._entries[k].embedding for k in keys]))
+        keys, matrix = self._index[partition]
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        answer = self.get(keys[best])
+        if answer is not None:
+            logger.info(f"Cache sémantique : '{key[2]}' ~ '{keys[best][2]}' ({scores[best]:.3f})")
+        return answer
+
+    def put(self, key, answer, embedding=None):
+        self._drop(key)
+        self._entries[key] = CacheEntry(answer, embedding)
+        if embedding is not None:
+            self._index.pop(key[:2], None)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def snapshot(self):
+        return {"entries": len(self._entries), **self.stats}
+
+
+async def embed_question(client, question: str):
+    response = await client.embeddings.create(model=EMBEDDING_MODEL, input=normalize_question(question))
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) + 1e-12)
+
+
+async def lookup_guide_answer(client, key, question: str):
+    """Retourne (réponse en cache ou None, embedding calculé ou None)."""
+    answer = guide_cache.get(key)
+    if answer is not None:
+        guide_cache.stats["exact_hits"] += 1
+        return answer, None
+
+    embedding = None
+    if GUIDE_CACHE_SEMANTIC:
+        try:
+            embedding = await embed_question(client, question)
+            answer = guide_cache.get_similar(key, embedding)
+        except Exception as e:
+            logger.error(f"Embedding indisponible : {e}")
+        if answer is not None:
+            guide_cache.stats["semantic_hits"] += 1
+            return answer, embedding
+
+    guide_cache.stats["misses"] += 1
+    return None, embedding
+
+
+async def replay_answer(answer: str):
+    # Rejoue une réponse en cache sous forme de flux, comme une réponse OpenAI
+    for i in range(0, len(answer), REPLAY_CHUNK_CHARS):
+        yield answer[i:i + REPLAY_CHUNK_CHARS]
+        await asyncio.sleep(0)
+
+
+guide_cache = ResponseCache()
@@ -0,0 +1,152 @@
+# backend/uploads/chat_stream.py
+import os
+import time
+import asyncio
+import logging
+from collections import defaultdict, deque
+
+import httpx
+from openai import AsyncOpenAI
+
+logger = logging.getLogger("Chat")
+
+# --- Configuration ---
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+# Permet de pointer vers un serveur compatible OpenAI (ex. tests/fake_openai_server.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o")
+CHAT_MAX_STREAMS_PER_USER = int(os.getenv("CHAT_MAX_STREAMS_PER_USER", "2"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+openai_client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10.0),
+)
+
+
+class ChatLimiter:
+    """Nombre maximal de flux de chat simultanés par utilisateur."""
+
+    def __init__(self, max_per_user: int):
+        self.max_per_user = max_per_user
+        self._active = defaultdict(int)
+
+    def try_acquire(self, key: str):
+        if self._active[key] >= self.max_per_user:
+            return None
+        self._active[key] += 1
+        return ChatLease(self, key)
+
+    def _release(self, key: str):
+        self._active[key] -= 1
+        if self._active[key] <= 0:
+            del self._active[key]
+
+
+class ChatLease:
+    # release() est idempotent : appelé en fin de flux ET en tâche de fond de
+    # la réponse (cas où le client part avant le premier octet)
+    def __init__(self, limiter: ChatLimiter, key: str):
+        self._limiter = limiter
+        self._key = key
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limiter._release(self._key)
+
+
+class ChatMetrics:
+    """Temps jusqu'au premier token et débit (tokens/s) sur les derniers flux."""
+
+    def __init__(self, window: int = 500):
+        self.ttft_ms = deque(maxlen=window)
+        self.tokens_per_second = deque(maxlen=window)
+        self.counters = defaultdict(int)
+
+    def record(self, outcome: str, ttft_ms=None, tokens_per_second=None):
+        self.counters[outcome] += 1
+        if ttft_ms is not None:
+            self.ttft_ms.append(ttft_ms)
+        if tokens_per_second is not None:
+            self.tokens_per_second.append(tokens_per_second)
+
+    def snapshot(self):
+        def pct(values, p):
+            if not values:
+                return None
+            ordered = sorted(values)
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 1)
+
+        return {
+            "streams": dict(self.counters),
+            "ttft_ms": {"p50": pct(self.ttft_ms, 50), "p95": pct(self.ttft_ms, 95)},
+            "tokens_per_second": {"p50": pct(self.tokens_per_second, 50), "p5": pct(self.tokens_per_second, 5)},
+        }
+
+
+chat_limiter = ChatLimiter(CHAT_MAX_STREAMS_PER_USER)
+chat_metrics = ChatMetrics()
+
+
+async def stream_chat_completion(request, messages, lease=None, on_complete=None):
+    """
+    Relaie le flux OpenAI token par token sans bloquer la boucle d'événements.
+
+    Contre-pression : le chunk suivant n'est lu chez OpenAI qu'une fois le
+    précédent envoyé au client. Si le client se déconnecte, le flux amont est
+    fermé immédiatement. `on_complete(texte)` reçoit la réponse complète si le
+    flux est allé à son terme.
+    """
+    start = time.perf_counter()
+    first_token_at = None
+    tokens = 0
+    usage_tokens = None
+    parts = []
+    outcome = "completed"
+    stream = None
+    try:
+        stream = await openai_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage_tokens = chunk.usage.completion_tokens
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if await request.is_disconnected():
+                outcome = "cancelled"
+                break
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            tokens += 1
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        outcome = "error"
+        logger.error(f"Erreur flux OpenAI : {e}")
+        yield f"Error: {str(e)}"
+    finally:
+        if stream is not None:
+            await stream.close()
+        if lease is not None:
+            lease.release()
+
+        ttft_ms = tps = None
+        if first_token_at is not None:
+            ttft_ms = (first_token_at - start) * 1000
+            duration = time.perf_counter() - first_token_at
+            if duration > 0:
+                tps = (usage_tokens or tokens) / duration
+        chat_metrics.record(outcome, ttft_ms, tps)
+
+    if outcome == "completed" and on_complete is not None:
+        on_complete("".join(parts))
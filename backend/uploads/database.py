@@ -0,0 +1,87 @@
+# backend/uploads/database.py
+import os
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+
+logger = logging.getLogger("Database")
+
+# --- Configuration ---
+# En local : SQLite (aiosqlite). En production : une base serveur poolée, ex.
+# DATABASE_URL=postgresql://user:pass@db:5432/glaucoma
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./auth.db")
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Pilotes asynchrones utilisés quand l'URL n'en précise pas
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+# Réglages SQLite : WAL pour lire pendant une écriture, fsync allégé,
+# attente sur verrou au lieu d'un "database is locked" immédiat.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -64000,  # ~64 Mo
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,  # 256 Mo
+}
+
+
+def to_async_url(url: str) -> str:
+    """Ajoute le pilote asynchrone à une URL 'sqlite:///' ou 'postgresql://'."""
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme or not sep:
+        return url
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+IS_SQLITE = ASYNC_DATABASE_URL.startswith("sqlite")
+
+
+def build_engine(url: str = ASYNC_DATABASE_URL):
+    if url.startswith("sqlite"):
+        engine = create_async_engine(url, echo=DB_ECHO, connect_args={"timeout": 30})
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+        return engine
+
+    return create_async_engine(
+        url,
+        echo=DB_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+engine = build_engine()
+# expire_on_commit=False : les objets restent lisibles après commit sans
+# rechargement implicite (interdit en mode async)
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+Base = declarative_base()
+
+
+# --- Dependency pour la DB ---
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
@@ -0,0 +1,161 @@
+# backend/uploads/export.py
+import io
+import os
+import csv
+import json
+import asyncio
+import zipfile
+from datetime import datetime
+
+from heatmaps import render_overlay
+
+# --- Configuration ---
+# Lignes lues par aller-retour avec la base (curseur côté serveur)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Taille visée des morceaux envoyés au client
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+PATIENT_COLUMNS = ("patient_id", "full_name", "age", "gender", "phone")
+ANALYSIS_COLUMNS = ("analysis_id", "filename", "has_glaucoma", "confidence", "timestamp", "image_sha256", "has_cams")
+EXPORT_COLUMNS = PATIENT_COLUMNS + ANALYSIS_COLUMNS
+
+
+async def stream_rows(session_factory, *statements):
+    """
+    Lignes des requêtes, l'une après l'autre, lues par paquets de
+    EXPORT_BATCH_SIZE : la mémoire ne dépend pas du nombre de lignes.
+    La session est propre au flux, celle de la requête HTTP étant fermée
+    avant l'envoi de la réponse.
+    """
+    async with session_factory() as db:
+        for statement in statements:
+            result = await db.stream(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for row in result:
+                yield row
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_record(row) -> dict:
+    """Ligne plate -> {"patient": {...} | None, "analysis": {...} | None}"""
+    values = row._mapping
+    return {
+        "patient": ({name: _value(values[name]) for name in PATIENT_COLUMNS}
+                    if values["patient_id"] is not None else None),
+        "analysis": ({name: _value(values[name]) for name in ANALYSIS_COLUMNS}
+                     if values["analysis_id"] is not None else None),
+    }
+
+
+async def ndjson_lines(rows):
+    async for row in rows:
+        yield json.dumps(export_record(row), ensure_ascii=False) + "\n"
+
+
+async def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    async for row in rows:
+        values = row._mapping
+        writer.writerow([_value(values[name]) for name in EXPORT_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def encode_records(rows, fmt: str):
+    return ndjson_lines(rows) if fmt == "ndjson" else csv_lines(rows)
+
+
+async def chunked(lines):
+    """Regroupe les lignes en morceaux d'environ EXPORT_CHUNK_SIZE octets."""
+    parts, size = [], 0
+    async for line in lines:
+        data = line.encode()
+        parts.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield b"".join(parts)
+            parts, size = [], 0
+    if parts:
+        yield b"".join(parts)
+
+
+def _read_file(path: str):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None  # Original expiré entre-temps
+
+
+async def export_files(rows, directory: str, images: bool, heatmaps: bool):
+    """
+    (nom dans l'archive, contenu) des originaux encore présents et des
+    heatmaps : rendues depuis les cartes enregistrées, ou ancien PNG sur disque.
+    """
+    async for row in rows:
+        values = row._mapping
+        if images:
+            contents = await asyncio.to_thread(_read_file, os.path.join(directory, values["filename"]))
+            if contents is not None:
+                yield f"images/{values['filename']}", contents
+        if heatmaps:
+            if values["cam_maps"] is not None:
+                png_bytes = await asyncio.to_thread(render_overlay, values["cam_maps"], values["cam_thumbnail"])
+            elif values["gradcam_filename"]:
+                png_bytes = await asyncio.to_thread(_read_file, os.path.join(directory, values["gradcam_filename"]))
+            else:
+                png_bytes = None
+            if png_bytes is not None:
+                yield f"heatmaps/{values['analysis_id']}.png", png_bytes
+
+
+class _ZipSink:
+    """Destination sans seek pour zipfile : l'archive est envoyée au fil de l'écriture."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts, self.size = [], 0
+        return data
+
+
+async def zip_chunks(lines, records_name: str, files):
+    """
+    Archive zip produite en flux, sans fichier temporaire : d'abord les
+    enregistrements (compressés), puis les images (stockées telles quelles,
+    déjà compressées).
+    """
+    sink = _ZipSink()
+    now = datetime.now().timetuple()[:6]
+    with zipfile.ZipFile(sink, "w") as archive:
+        info = zipfile.ZipInfo(records_name, date_time=now)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(info, "w", force_zip64=True) as entry:
+            async for line in lines:
+                entry.write(line.encode())
+                if sink.size >= EXPORT_CHUNK_SIZE:
+                    yield sink.drain()
+
+        async for name, contents in files:
+            archive.writestr(zipfile.ZipInfo(name, date_time=now), contents, compress_type=zipfile.ZIP_STORED)
+            if sink.size >= EXPORT_CHUNK_SIZE:
+                yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,166 @@
+# backend/uploads/heatmaps.py
+import io
+import os
+import asyncio
+import base64
+import hashlib
+import logging
+import mimetypes
+import struct
+from collections import OrderedDict
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from tracing import trace_headers
+
+logger = logging.getLogger("Heatmaps")
+
+# --- Configuration ---
+DL_CAMS_URL = os.getenv(
+    "DL_CAMS_URL",
+    os.getenv("DL_SERVICE_URL", "http://localhost:8001/analyze/").replace("/analyze/", "/cams/"),
+)
+# Pré-calcul en tâche de fond des cartes jamais ouvertes (0 pour désactiver)
+HEATMAP_PRERENDER = os.getenv("HEATMAP_PRERENDER", "1") == "1"
+# Pause entre deux pré-calculs, en plus de la priorité "background" côté service DL
+HEATMAP_WORKER_DELAY = float(os.getenv("HEATMAP_WORKER_DELAY", "2"))
+# Rendus PNG gardés en mémoire (clé : analyse + paramètres d'affichage)
+HEATMAP_RENDER_CACHE_SIZE = int(os.getenv("HEATMAP_RENDER_CACHE_SIZE", "256"))
+
+VARIANTS = ("gradcam", "gradcam_pp")
+COLORMAPS = {
+    "jet": lambda x: np.stack([1.5 - np.abs(4 * x - 3), 1.5 - np.abs(4 * x - 2), 1.5 - np.abs(4 * x - 1)], axis=-1),
+    "hot": lambda x: np.stack([3 * x, 3 * x - 1, 3 * x - 2], axis=-1),
+    "gray": lambda x: np.stack([x, x, x], axis=-1),
+}
+
+
+def pack_cams(payload: dict) -> bytes:
+    """Réponse de /cams/ -> blob compact : hauteur, largeur puis les deux cartes uint8."""
+    height, width = payload["shape"]
+    return struct.pack(">HH", height, width) + b"".join(base64.b64decode(payload[v]) for v in VARIANTS)
+
+
+def unpack_cams(blob: bytes) -> dict:
+    height, width = struct.unpack_from(">HH", blob)
+    size = height * width
+    return {
+        variant: np.frombuffer(blob, np.uint8, size, 4 + i * size).reshape(height, width)
+        for i, variant in enumerate(VARIANTS)
+    }
+
+
+def render_overlay(cam_maps: bytes, thumbnail: bytes, variant: str = "both", colormap: str = "jet",
+                   alpha: float = 0.5, size: int = 224) -> bytes:
+    """Superpose une carte (ou les deux, côte à côte) sur la vignette et retourne un PNG."""
+    base = Image.open(io.BytesIO(thumbnail)).convert("RGB").resize((size, size), Image.BILINEAR)
+    cams = unpack_cams(cam_maps)
+    panels = []
+    for name in (VARIANTS if variant == "both" else (variant,)):
+        cam = np.asarray(Image.fromarray(cams[name]).resize((size, size), Image.BILINEAR), dtype=np.float32) / 255
+        colored = (np.clip(COLORMAPS[colormap](cam), 0, 1) * 255).astype(np.uint8)
+        panels.append(Image.blend(base, Image.fromarray(colored), alpha))
+
+    gap = 8
+    composite = Image.new("RGB", (len(panels) * size + (len(panels) - 1) * gap, size), (255, 255, 255))
+    for i, panel in enumerate(panels):
+        composite.paste(panel, (i * (size + gap), 0))
+    buf = io.BytesIO()
+    composite.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class HeatmapRenderer:
+    """
+    Explications GradCAM différées et compactes.
+
+    L'upload n'attend pas le GradCAM : les cartes brutes (quelques dizaines
+    d'octets) et une vignette JPEG sont demandées au service DL à la première
+    ouverture ou par le worker de fond, puis enregistrées avec l'analyse via
+    `store`. Le PNG affiché est composé à la demande (variante, palette,
+    transparence) et gardé en cache mémoire. Les demandes simultanées pour
+    la même analyse partagent un seul calcul, sauf une ouverture qui trouve
+    un pré-calcul de fond en cours : elle lance sa propre demande interactive.
+    """
+
+    def __init__(self, directory: str, store):
+        self.directory = directory
+        self.store = store  # coroutine (analysis_id, cam_maps, thumbnail)
+        self.queue = asyncio.Queue()
+        self._scheduled = set()
+        self._inflight = {}
+        self._rendered = OrderedDict()
+
+    async def ensure(self, analysis_id: int, filename: str, priority: str = "interactive"):
+        """Retourne (cartes, vignette) de l'analyse, calculées puis enregistrées."""
+        entry = self._inflight.get(analysis_id)
+        if entry is None or (priority == "interactive" and entry[0] != "interactive"):
+            # Un pré-calcul en cours attend derrière le trafic interactif côté DL : un médecin
+            # qui ouvre la carte lance sa propre demande, le pré-calcul se termine de son côté
+            task = asyncio.create_task(self._fetch_and_store(analysis_id, filename, priority))
+            entry = (priority, task)
+            self._inflight[analysis_id] = entry
+            task.add_done_callback(lambda _, entry=entry: self._forget(analysis_id, entry))
+        # shield : un client qui abandonne n'annule pas le calcul partagé
+        return await asyncio.shield(entry[1])
+
+    def _forget(self, analysis_id: int, entry):
+        if self._inflight.get(analysis_id) is entry:
+            del self._inflight[analysis_id]
+
+    async def _fetch_and_store(self, analysis_id: int, filename: str, priority: str):
+        cam_maps, thumbnail = await self._fetch(filename, priority)
+        await self.store(analysis_id, cam_maps, thumbnail)
+        self._scheduled.discard(analysis_id)
+        return cam_maps, thumbnail
+
+    async def _fetch(self, filename: str, priority: str):
+        source_path = os.path.join(self.directory, filename)
+        with open(source_path, "rb") as f:
+            contents = f.read()
+        image_id = hashlib.sha256(contents).hexdigest()
+        content_type = mimetypes.guess_type(filename)[0] or "image/png"
+
+        async with httpx.AsyncClient(timeout=120.0, headers=trace_headers(priority)) as client:
+            # Le service DL garde les tenseurs récents : pas besoin de renvoyer l'image
+            response = await client.get(f"{DL_CAMS_URL.rstrip('/')}/{image_id}")
+            if response.status_code in (404, 405):
+                response = await client.post(DL_CAMS_URL, files={"file": (filename, contents, content_type)})
+        response.raise_for_status()
+        payload = response.json()
+        return pack_cams(payload), base64.b64decode(payload["thumbnail"])
+
+    async def render(self, analysis_id: int, cam_maps: bytes, thumbnail: bytes, **options) -> bytes:
+        key = (analysis_id, *sorted(options.items()))
+        png_bytes = self._rendered.get(key)
+        if png_bytes is not None:
+            self._rendered.move_to_end(key)
+            return png_bytes
+        png_bytes = await asyncio.to_thread(render_overlay, cam_maps, thumbnail, **options)
+        self._rendered[key] = png_bytes
+        if len(self._rendered) > HEATMAP_RENDER_CACHE_SIZE:
+            self._rendered.popitem(last=False)
+        return png_bytes
+
+    def schedule(self, analysis_id: int, filename: str):
+        if HEATMAP_PRERENDER:
+            self._scheduled.add(analysis_id)
+            self.queue.put_nowait((analysis_id, filename))
+
+    async def run_worker(self):
+        logger.info("Worker de pré-calcul des heatmaps démarré")
+        while True:
+            analysis_id, filename = await self.queue.get()
+            try:
+                # Déjà calculée à l'ouverture, ou image expirée entre-temps
+                if analysis_id in self._scheduled and os.path.exists(os.path.join(self.directory, filename)):
+                    # Priorité basse : le service DL fait passer les médecins d'abord
+                    await self.ensure(analysis_id, filename, priority="background")
+            except Exception as e:
+                logger.error(f"Pré-calcul heatmap échoué (analyse {analysis_id}) : {e}")
+            finally:
+                self._scheduled.discard(analysis_id)
+                self.queue.task_done()
+            await asyncio.sleep(HEATMAP_WORKER_DELAY)
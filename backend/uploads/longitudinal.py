@@ -0,0 +1,210 @@
+# backend/uploads/longitudinal.py
+import os
+import math
+import asyncio
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from heatmaps import unpack_cams
+
+# --- Configuration ---
+# Résumés gardés en mémoire (le résumé enregistré en base reste la référence)
+TREND_CACHE_SIZE = int(os.getenv("TREND_CACHE_SIZE", "512"))
+DAYS_PER_YEAR = 365.25
+
+
+def glaucoma_probability(has_glaucoma: bool, confidence: Optional[float]) -> Optional[float]:
+    """Probabilité de glaucome, que la classe prédite soit positive ou non."""
+    if confidence is None:
+        return None
+    return confidence if has_glaucoma else 1 - confidence
+
+
+def cam_stats(cam_maps: Optional[bytes]):
+    """[activation moyenne, barycentre x, barycentre y] de la carte GradCAM (coordonnées 0-1)."""
+    if cam_maps is None:
+        return None
+    cam = unpack_cams(cam_maps)["gradcam"].astype(np.float32) / 255
+    total = float(cam.sum())
+    if total == 0:
+        return [0.0, 0.5, 0.5]
+    height, width = cam.shape
+    ys, xs = np.indices(cam.shape)
+    cx = float((xs * cam).sum()) / total / max(width - 1, 1)
+    cy = float((ys * cam).sum()) / total / max(height - 1, 1)
+    return [round(float(cam.mean()), 4), round(cx, 4), round(cy, 4)]
+
+
+def exam_point(analysis_id: int, timestamp: datetime, has_glaucoma: bool, confidence: Optional[float],
+               cam_maps: Optional[bytes]) -> dict:
+    probability = glaucoma_probability(has_glaucoma, confidence)
+    return {
+        "id": analysis_id,
+        "t": timestamp.isoformat(),
+        "p": round(probability, 4) if probability is not None else None,
+        "label": int(bool(has_glaucoma)),
+        "cam": cam_stats(cam_maps),
+    }
+
+
+def empty_summary() -> dict:
+    # sums : n, Σt, Σp, Σt², Σtp (t en jours) pour la pente sans relire la série
+    return {"points": [], "sums": [0, 0.0, 0.0, 0.0, 0.0]}
+
+
+def _days(point) -> float:
+    return datetime.fromisoformat(point["t"]).timestamp() / 86400
+
+
+def _account(summary, point, sign):
+    if point["p"] is None:
+        return
+    t, p = _days(point), point["p"]
+    for i, value in enumerate((1, t, p, t * t, t * p)):
+        summary["sums"][i] += sign * value
+
+
+def _link(points, i):
+    """Écarts entre l'examen i et le précédent : probabilité, jours, déplacement de la zone CAM."""
+    if not 0 <= i < len(points):
+        return
+    point = points[i]
+    previous = points[i - 1] if i > 0 else None
+    if previous is None:
+        point.update(dp=None, days=None, cam_shift=None)
+        return
+    point["dp"] = round(point["p"] - previous["p"], 4) if None not in (point["p"], previous["p"]) else None
+    point["days"] = round(_days(point) - _days(previous), 2)
+    if point["cam"] and previous["cam"]:
+        point["cam_shift"] = round(math.dist(point["cam"][1:], previous["cam"][1:]), 4)
+    else:
+        point["cam_shift"] = None
+
+
+def remove_exam(summary: dict, analysis_id: int) -> dict:
+    """Retire un examen ; l'examen suivant est relié à celui d'avant."""
+    points = summary["points"]
+    for i, existing in enumerate(points):
+        if existing["id"] == analysis_id:
+            _account(summary, points.pop(i), -1)
+            _link(points, i)
+            break
+    return summary
+
+
+def add_exam(summary: dict, point: dict) -> dict:
+    """Insère (ou remplace) un examen à sa place chronologique ; seuls ses voisins sont recalculés."""
+    remove_exam(summary, point["id"])
+    points = summary["points"]
+    i = bisect_right([p["t"] for p in points], point["t"])
+    points.insert(i, point)
+    _account(summary, point, 1)
+    _link(points, i)
+    _link(points, i + 1)
+    return summary
+
+
+def update_cams(summary: dict, analysis_id: int, cam_maps: bytes) -> dict:
+    """Statistiques CAM arrivées après l'examen (calcul différé des heatmaps)."""
+    points = summary["points"]
+    for i, point in enumerate(points):
+        if point["id"] == analysis_id:
+            point["cam"] = cam_stats(cam_maps)
+            _link(points, i)
+            _link(points, i + 1)
+            break
+    return summary
+
+
+def build_summary(rows) -> dict:
+    """Résumé complet depuis les analyses (id, timestamp, has_glaucoma, confidence, cam_maps)."""
+    summary = empty_summary()
+    for row in rows:
+        add_exam(summary, exam_point(row.id, row.timestamp, row.has_glaucoma, row.confidence, row.cam_maps))
+    return summary
+
+
+def _slope_per_year(sums) -> Optional[float]:
+    n, st, sp, stt, stp = sums
+    denominator = n * stt - st * st
+    if n < 2 or abs(denominator) < 1e-9:
+        return None
+    return round((n * stp - st * sp) / denominator * DAYS_PER_YEAR, 4)
+
+
+def render_trend(summary: dict, limit: Optional[int] = None, now: Optional[datetime] = None) -> dict:
+    """Vue compacte : indicateurs puis séries en colonnes (les `limit` derniers examens)."""
+    points = summary["points"]
+    shown = points[-limit:] if limit else points
+    last = points[-1] if points else None
+    now = now or datetime.utcnow()
+    return {
+        "exam_count": len(points),
+        "first_exam": points[0]["t"] if points else None,
+        "last_exam": last["t"] if last else None,
+        "days_since_last_exam": round((now - datetime.fromisoformat(last["t"])).total_seconds() / 86400, 1)
+        if last else None,
+        "latest_probability": last["p"] if last else None,
+        "slope_per_year": _slope_per_year(summary["sums"]),
+        "series": {
+            "id": [p["id"] for p in shown],
+            "t": [p["t"] for p in shown],
+            "p": [p["p"] for p in shown],
+            "label": [p["label"] for p in shown],
+            "dp": [p["dp"] for p in shown],
+            "days": [p["days"] for p in shown],
+            "cam_mean": [p["cam"][0] if p["cam"] else None for p in shown],
+            "cam_shift": [p["cam_shift"] for p in shown],
+        },
+    }
+
+
+class TrendCache:
+    """
+    Résumés longitudinaux par patient, en LRU, chacun associé à la date de
+    mise à jour de la ligne `patient_trends` dont il provient : une écriture
+    d'un autre worker change cette date et rend l'entrée obsolète.
+
+    Un verrou par patient sérialise les mises à jour incrémentales d'un même
+    processus ; il n'existe que tant qu'une écriture le tient ou l'attend.
+    Entre workers, c'est l'écriture conditionnelle en base qui protège le
+    résumé (voir update_patient_trend dans main.py).
+    """
+
+    def __init__(self, size: int = TREND_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.locks = {}  # patient_id -> [verrou, nombre d'utilisateurs]
+
+    def get(self, patient_id: int, version):
+        entry = self.entries.get(patient_id)
+        if entry is None or entry[0] != version:
+            return None
+        self.entries.move_to_end(patient_id)
+        return entry[1]
+
+    def put(self, patient_id: int, version, summary: dict):
+        self.entries[patient_id] = (version, summary)
+        self.entries.move_to_end(patient_id)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, patient_id: int):
+        self.entries.pop(patient_id, None)
+
+    @asynccontextmanager
+    async def lock(self, patient_id: int):
+        entry = self.locks.setdefault(patient_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[patient_id]
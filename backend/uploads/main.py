@@ -1,47 +1,59 @@
 # backend/uploads/main.py
-import base64
+import hashlib
 import os
-import shutil
+import sys
 import asyncio
 import json
+import logging
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import Optional, List
 
 import httpx
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Form, Header, Request
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Form, Header, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, ForeignKey, create_engine, select, desc
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, ForeignKey, LargeBinary, Text, select, desc, func, update, and_, or_, null, type_coerce
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship, Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import deferred, relationship, undefer
 
 # ✅ IMPORT DU NETTOYEUR
 from cleanup import start_cleanup_loop
-from openai import OpenAI
+from database import Base, SessionLocal, engine, get_db
+from migrations import run_migrations
+from heatmaps import COLORMAPS, VARIANTS, HeatmapRenderer
+from export import EXPORT_FORMATS, PATIENT_COLUMNS, chunked, encode_records, export_files, stream_rows, zip_chunks
+from tracing import RequestIdMiddleware, get_request_id, trace_headers
+from responses import CompressionMiddleware, CorsHeadersMiddleware, FastJSONResponse
+from longitudinal import TrendCache, add_exam, build_summary, exam_point, render_trend, update_cams
+# backend/ : modules communs aux deux services (l'image Docker les copie dans /app/common)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import PROFILING_ENABLED, ProfilingMiddleware
+from chat_stream import chat_limiter, chat_metrics, openai_client, stream_chat_completion
+from chat_cache import guide_cache, lookup_guide_answer, replay_answer
 
 # --- Configuration ---
 SECRET_KEY = os.getenv("JWT_SECRET", "CHANGE_THIS_TO_A_STRONG_SECRET")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# Durée de validité des URL GradCAM signées (utilisées dans des <img>, sans en-tête Authorization)
+GRADCAM_URL_TTL_MINUTES = int(os.getenv("GRADCAM_URL_TTL_MINUTES", "60"))
+GRADCAM_TOKEN_SCOPE = "gradcam"
+# Image du fond d'œil d'un patient : ni cache partagé, ni copie sur disque côté navigateur
+PRIVATE_IMAGE_HEADERS = {"Cache-Control": "private, no-store"}
 TTL_MINUTES = 4320
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
-DATABASE_URL = "sqlite:///./auth.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 # --- SYSTÈME DE TRADUCTION BACKEND ---
 MESSAGES = {
@@ -55,9 +67,11 @@ MESSAGES = {
         "file_invalid": "Fichier invalide (image requise)",
         "save_error": "Erreur sauvegarde",
         "dl_error": "Service DL injoignable",
+        "image_rejected": "Image inutilisable pour l'analyse",
         "analysis_done": "Analyse terminée",
         "glaucoma_high": "GLAUCOME DÉTECTÉ (Risque Élevé)",
         "glaucoma_low": "AUCUNE ANOMALIE DÉTECTÉE (Sain)",
+        "chat_busy": "Trop de conversations en cours, réessayez dans un instant",
         "lang_name": "Français"
     },
     "en": {
@@ -70,9 +84,11 @@ MESSAGES = {
         "file_invalid": "Invalid file (image required)",
         "save_error": "Save error",
         "dl_error": "DL Service unreachable",
+        "image_rejected": "Image unusable for analysis",
         "analysis_done": "Analysis complete",
         "glaucoma_high": "GLAUCOMA DETECTED (High Risk)",
         "glaucoma_low": "NO ANOMALY DETECTED (Healthy)",
+        "chat_busy": "Too many chats in progress, please retry shortly",
         "lang_name": "English"
     },
     "es": {
@@ -85,9 +101,11 @@ MESSAGES = {
         "file_invalid": "Archivo inválido (se requiere imagen)",
         "save_error": "Error al guardar",
         "dl_error": "Servicio DL inalcanzable",
+        "image_rejected": "Imagen no utilizable para el análisis",
         "analysis_done": "Análisis completado",
         "glaucoma_high": "GLAUCOMA DETECTADO (Alto Riesgo)",
         "glaucoma_low": "NINGUNA ANOMALÍA DETECTADA (Sano)",
+        "chat_busy": "Demasiadas conversaciones en curso, inténtelo de nuevo en un momento",
         "lang_name": "Spanish"
     },
     "ar": {
@@ -100,9 +118,11 @@ MESSAGES = {
         "file_invalid": "ملف غير صالح (مطلوب صورة)",
         "save_error": "خطأ في الحفظ",
         "dl_error": "خدمة التحليل غير متاحة",
+        "image_rejected": "الصورة غير صالحة للتحليل",
         "analysis_done": "اكتمل التحليل",
         "glaucoma_high": "تم اكتشاف جلوكوما (خطر مرتفع)",
         "glaucoma_low": "لم يتم اكتشاف أي تشوهات (سليم)",
+        "chat_busy": "عدد كبير من المحادثات الجارية، أعد المحاولة بعد قليل",
         "lang_name": "Arabic"
     }
 }
@@ -115,15 +135,6 @@ def get_language_name(accept_language: str = Header("fr")):
     lang_code = accept_language.split(",")[0].split("-")[0]
     return MESSAGES.get(lang_code, MESSAGES["fr"])["lang_name"]
 
-
-# --- Dependency pour la DB ---
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # --- Models Base de Données ---
 class User(Base):
     __tablename__ = "users"
@@ -151,6 +162,9 @@ class Analysis(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, index=True)
     gradcam_filename = Column(String, nullable=True) # ✅ Colonne ajoutée pour stocker le nom du fichier GradCAM
+    image_sha256 = Column(String(64), nullable=True, index=True) # Empreinte du contenu, pour réutiliser l'analyse
+    cam_maps = Column(LargeBinary, nullable=True) # Cartes GradCAM/GradCAM++ brutes (uint8, ~100 octets)
+    cam_thumbnail = deferred(Column(LargeBinary, nullable=True)) # Vignette JPEG 224x224, lue au rendu seulement
     has_glaucoma = Column(Boolean)
     confidence = Column(Float)
     timestamp = Column(DateTime, default=datetime.utcnow)
@@ -159,7 +173,21 @@ class Analysis(Base):
     owner = relationship("User", back_populates="analyses")
     patient = relationship("Patient", back_populates="analyses")
 
-Base.metadata.create_all(bind=engine)
+class PatientTrend(Base):
+    # Résumé longitudinal du patient (JSON, voir longitudinal.py), tenu à jour à chaque examen
+    __tablename__ = "patient_trends"
+    patient_id = Column(Integer, ForeignKey("patients.id"), primary_key=True)
+    summary = Column(Text, nullable=False)
+    # Examens couverts par le résumé ; NULL = à reconstruire (mise à jour incrémentale manquée)
+    exam_count = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Colonnes des listes (sans les blobs) : lignes légères, sans objets ORM
+PATIENT_LIST_COLUMNS = (Patient.id, Patient.full_name, Patient.age, Patient.gender, Patient.phone,
+                        Patient.created_at, Patient.doctor_id)
+HAS_CAMS = type_coerce(Analysis.cam_maps.isnot(None), Boolean).label("has_cams")
+ANALYSIS_LIST_COLUMNS = (Analysis.id, Analysis.filename, Analysis.gradcam_filename, Analysis.has_glaucoma,
+                         Analysis.confidence, Analysis.timestamp, HAS_CAMS)
 
 # --- SCHEMAS PYDANTIC ---
 class UserCreate(BaseModel):
@@ -211,16 +239,33 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_user_by_email(db: Session, email: str):
-    return db.execute(select(User).where(User.email == email)).scalar_one_or_none()
+def create_gradcam_token(analysis_id: int, user_id: int) -> str:
+    # Pas de "sub" : ce jeton ne peut pas servir de jeton d'accès à l'API
+    expire = datetime.utcnow() + timedelta(minutes=GRADCAM_URL_TTL_MINUTES)
+    return jwt.encode({"scope": GRADCAM_TOKEN_SCOPE, "aid": analysis_id, "uid": user_id, "exp": expire},
+                      SECRET_KEY, algorithm=ALGORITHM)
+
+def read_gradcam_token(token: str, analysis_id: int) -> Optional[int]:
+    """Utilisateur pour qui l'URL a été signée, si le jeton est valide pour cette analyse."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("scope") != GRADCAM_TOKEN_SCOPE or payload.get("aid") != analysis_id:
+        return None
+    return payload.get("uid")
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return (await db.execute(select(User).where(User.email == email))).scalar_one_or_none()
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = get_user_by_email(db, email)
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await get_user_by_email(db, email)
+    # bcrypt est coûteux en CPU : hors de la boucle d'événements
+    if not user or not await asyncio.to_thread(verify_password, password, user.hashed_password):
         return None
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not authenticate",
@@ -235,44 +280,237 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
 
-    user = get_user_by_email(db, token_data.email)
+    user = await get_user_by_email(db, token_data.email)
     if user is None:
         raise credentials_exception
     return user
 
+async def get_optional_user(token: Optional[str] = Depends(oauth2_optional), db: AsyncSession = Depends(get_db)):
+    """Comme get_current_user, mais None sans en-tête Authorization."""
+    if token is None:
+        return None
+    return await get_current_user(token, db)
+
+async def can_view_analysis(db: AsyncSession, ana, user_id: int) -> bool:
+    # Auteur de l'analyse, ou médecin du patient
+    if ana.user_id == user_id:
+        return True
+    if ana.patient_id is None:
+        return False
+    doctor_id = (await db.execute(select(Patient.doctor_id).where(Patient.id == ana.patient_id))).scalar()
+    return doctor_id == user_id
+
+def get_token_subject(request: Request) -> Optional[str]:
+    # Les routes de chat sont publiques : le token est facultatif
+    auth = request.headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        try:
+            return jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+        except JWTError:
+            pass
+    return None
+
+def get_chat_user_key(request: Request) -> str:
+    # Utilisateur identifié par son token s'il est fourni, sinon par son IP
+    subject = get_token_subject(request)
+    if subject:
+        return f"user:{subject}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def open_chat_stream(request: Request, gpt_messages: list, msgs: dict, on_complete=None):
+    lease = chat_limiter.try_acquire(get_chat_user_key(request))
+    if lease is None:
+        raise HTTPException(status_code=429, detail=msgs["chat_busy"])
+    return StreamingResponse(
+        stream_chat_completion(request, gpt_messages, lease=lease, on_complete=on_complete),
+        media_type="text/plain",
+        background=BackgroundTask(lease.release),
+    )
+
 # --- Config Dossiers ---
 UPLOAD_DIRECTORY = "uploaded_images"
 DL_SERVICE_URL = os.getenv("DL_SERVICE_URL", "http://localhost:8001/analyze/")
+# Prédiction seule (sans GradCAM) : uploads et contexte du chat
+DL_PREDICT_URL = os.getenv("DL_PREDICT_URL", DL_SERVICE_URL.replace("/analyze/", "/predict/"))
+CHAT_PREDICTION_CACHE_SIZE = 256
 os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 
+logger = logging.getLogger("Uploads")
+trend_cache = TrendCache()
+
+async def rebuild_patient_trend(db: AsyncSession, patient_id: int) -> dict:
+    rows = (await db.execute(
+        select(Analysis.id, Analysis.timestamp, Analysis.has_glaucoma, Analysis.confidence, Analysis.cam_maps)
+        .where(Analysis.patient_id == patient_id)
+        .order_by(Analysis.timestamp)
+    )).all()
+    return build_summary(rows)
+
+def trend_values(summary: dict) -> dict:
+    return {"summary": json.dumps(summary), "exam_count": len(summary["points"]), "updated_at": datetime.utcnow()}
+
+async def mark_trend_stale(db: AsyncSession, patient_id: int):
+    # exam_count NULL : la prochaine lecture reconstruit le résumé depuis les analyses
+    await db.execute(update(PatientTrend).where(PatientTrend.patient_id == patient_id).values(exam_count=None))
+    await db.commit()
+
+async def update_patient_trend(db: AsyncSession, patient_id: int, change):
+    """
+    Mise à jour incrémentale du résumé enregistré (`change(summary)`), puis
+    invalidation du cache. Le verrou du cache ne sérialise que ce processus :
+    l'écriture est conditionnelle (résumé et nombre d'examens inchangés
+    depuis la lecture). Si un autre worker a écrit entre-temps, ou en cas
+    d'échec, le résumé est marqué à reconstruire (exam_count NULL) pour la
+    prochaine lecture, sans interrompre l'écriture principale.
+    """
+    try:
+        async with trend_cache.lock(patient_id):
+            row = (await db.execute(
+                select(PatientTrend.summary, PatientTrend.exam_count).where(PatientTrend.patient_id == patient_id)
+            )).first()
+            if row is None:
+                # Premier examen suivi : reconstruction (inclut déjà l'écriture en cours)
+                db.add(PatientTrend(patient_id=patient_id, **trend_values(await rebuild_patient_trend(db, patient_id))))
+                await db.commit()
+                return
+            if row.exam_count is None:
+                summary, same_count = await rebuild_patient_trend(db, patient_id), PatientTrend.exam_count.is_(None)
+            else:
+                summary, same_count = change(json.loads(row.summary)), PatientTrend.exam_count == row.exam_count
+            result = await db.execute(
+                update(PatientTrend)
+                .where(PatientTrend.patient_id == patient_id, same_count, PatientTrend.summary == row.summary)
+                .values(**trend_values(summary))
+            )
+            if result.rowcount == 1:
+                await db.commit()
+                return
+            await db.rollback()
+        logger.info(f"Résumé longitudinal du patient {patient_id} modifié par un autre worker : à reconstruire")
+        await mark_trend_stale(db, patient_id)
+    except Exception as e:
+        await db.rollback()
+        logger.warning(f"Résumé longitudinal du patient {patient_id} non mis à jour : {e}")
+        try:
+            await mark_trend_stale(db, patient_id)
+        except Exception:
+            await db.rollback()
+    finally:
+        trend_cache.invalidate(patient_id)
+
+async def load_patient_trend(db: AsyncSession, patient_id: int) -> dict:
+    # Lecture par clé primaire : la date de mise à jour valide l'entrée du cache
+    row = (await db.execute(
+        select(PatientTrend.summary, PatientTrend.exam_count, PatientTrend.updated_at)
+        .where(PatientTrend.patient_id == patient_id)
+    )).first()
+    if row is not None and row.exam_count is not None:
+        summary = trend_cache.get(patient_id, row.updated_at)
+        if summary is not None:
+            return summary
+
+    async with trend_cache.lock(patient_id):
+        row = (await db.execute(
+            select(PatientTrend.summary, PatientTrend.exam_count, PatientTrend.updated_at)
+            .where(PatientTrend.patient_id == patient_id)
+        )).first()
+        if row is not None and row.exam_count is not None:
+            summary = json.loads(row.summary)
+            trend_cache.put(patient_id, row.updated_at, summary)
+            return summary
+
+        summary = await rebuild_patient_trend(db, patient_id)
+        values = trend_values(summary)
+        try:
+            if row is None:
+                db.add(PatientTrend(patient_id=patient_id, **values))
+            else:
+                # Seulement si personne n'a écrit depuis : une mise à jour concurrente a priorité
+                result = await db.execute(
+                    update(PatientTrend)
+                    .where(PatientTrend.patient_id == patient_id, PatientTrend.exam_count.is_(None))
+                    .values(**values)
+                )
+                if result.rowcount == 0:
+                    await db.rollback()
+                    return summary
+            await db.commit()
+        except IntegrityError:
+            # Créé entre-temps par un autre worker : le résumé calculé reste valable
+            await db.rollback()
+            return summary
+    trend_cache.put(patient_id, values["updated_at"], summary)
+    return summary
+
+async def store_cams(analysis_id: int, cam_maps: bytes, thumbnail: bytes):
+    async with SessionLocal() as db:
+        await db.execute(
+            update(Analysis).where(Analysis.id == analysis_id).values(cam_maps=cam_maps, cam_thumbnail=thumbnail)
+        )
+        await db.commit()
+        patient_id = (await db.execute(select(Analysis.patient_id).where(Analysis.id == analysis_id))).scalar()
+        if patient_id is not None:
+            await update_patient_trend(db, patient_id, lambda summary: update_cams(summary, analysis_id, cam_maps))
+
+heatmap_renderer = HeatmapRenderer(UPLOAD_DIRECTORY, store_cams)
+
+def legacy_gradcam_path(ana) -> Optional[str]:
+    # Anciennes analyses : composite PNG complet enregistré sur disque
+    if ana.gradcam_filename:
+        path = os.path.join(UPLOAD_DIRECTORY, ana.gradcam_filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+def signed_gradcam_url(base_url: str, analysis_id: int, user_id: int) -> str:
+    return f"{base_url}/analyses/{analysis_id}/gradcam?token={create_gradcam_token(analysis_id, user_id)}"
+
+def build_gradcam_url(base_url: str, ana, image_exists: bool, user_id: int) -> Optional[str]:
+    # Cartes déjà enregistrées, ou calculables à la demande tant que l'original existe
+    if ana.has_cams or image_exists or legacy_gradcam_path(ana):
+        return signed_gradcam_url(base_url, ana.id, user_id)
+    return None
+
+def analysis_item(base_url: str, ana, patient_name: Optional[str], user_id: int) -> dict:
+    """Ligne de ANALYSIS_LIST_COLUMNS -> élément au format AnalysisResponse."""
+    exists = os.path.exists(os.path.join(UPLOAD_DIRECTORY, ana.filename))
+    return {
+        "id": ana.id,
+        "filename": ana.filename,
+        "has_glaucoma": ana.has_glaucoma,
+        "confidence": ana.confidence,
+        "timestamp": ana.timestamp,
+        "image_url": f"{base_url}/images/{ana.filename}" if exists else None,
+        "gradcam_url": build_gradcam_url(base_url, ana, exists, user_id), # ✅ URL GradCAM signée
+        "is_expired": not exists,
+        "patient_name": patient_name
+    }
+
 # --- Lifespan ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await run_migrations(Base.metadata)
     print("🚀 Démarrage du nettoyeur...")
     cleaner_task = asyncio.create_task(
         start_cleanup_loop(UPLOAD_DIRECTORY, TTL_MINUTES)
     )
+    heatmap_task = asyncio.create_task(heatmap_renderer.run_worker())
     yield
     print("🛑 Arrêt du nettoyeur...")
-    cleaner_task.cancel()
-    try:
-        await cleaner_task
-    except asyncio.CancelledError:
-        pass
+    for task in (cleaner_task, heatmap_task):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await engine.dispose()
 
 # --- APP ---
-app = FastAPI(lifespan=lifespan)
-
-# Middleware pour CORS
-class ForceCorsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        response = await call_next(request)
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "*"
-        response.headers["Access-Control-Allow-Headers"] = "*"
-        return response
+# orjson pour toutes les réponses JSON ; les listes la renvoient directement (sans revalidation)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
-app.add_middleware(ForceCorsMiddleware)
+# Middleware pour CORS (ASGI pur : ne tamponne pas les réponses en flux)
+app.add_middleware(CorsHeadersMiddleware)
 
 origins = ["http://localhost:5173", "http://localhost:3000"]
 app.add_middleware(
@@ -282,40 +520,48 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# gzip / brotli des réponses complètes au-delà de COMPRESSION_MIN_SIZE
+app.add_middleware(CompressionMiddleware)
+
+if PROFILING_ENABLED:
+    # Interne à RequestIdMiddleware : l'id de requête nomme les fichiers de profil
+    app.add_middleware(ProfilingMiddleware, get_request_id=get_request_id)
+
+# Ajouté en dernier = le plus externe : l'id couvre toute la requête
+app.add_middleware(RequestIdMiddleware)
 
 app.mount("/images", StaticFiles(directory=UPLOAD_DIRECTORY), name="images")
 
 # --- Routes Auth ---
 @app.post("/signup", status_code=201)
-def signup(
+async def signup(
         user_in: UserCreate,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         accept_language: str = Header("fr")
 ):
     msgs = get_messages(accept_language)
     try:
-        existing_user = get_user_by_email(db, user_in.email)
+        existing_user = await get_user_by_email(db, user_in.email)
         if existing_user:
             raise HTTPException(status_code=400, detail=msgs["email_taken"])
 
-        hashed_password = get_password_hash(user_in.password)
+        hashed_password = await asyncio.to_thread(get_password_hash, user_in.password)
         new_user = User(email=user_in.email, hashed_password=hashed_password)
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
         return {"msg": "Utilisateur créé", "email": new_user.email}
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=msgs["db_error"])
 
 @app.post("/token", response_model=Token)
-def login_for_access_token(
+async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         accept_language: str = Header("fr")
 ):
     msgs = get_messages(accept_language)
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=msgs["login_fail"])
     access_token = create_access_token(data={"sub": user.email})
@@ -323,12 +569,57 @@ def login_for_access_token(
 
 
 # --- Route Chat ---
+# Prédictions récentes des pièces jointes du chat, par empreinte du contenu
+chat_predictions = OrderedDict()
+
+async def predict_chat_image(contents: bytes, image_sha256: str, file: UploadFile, db: AsyncSession, user_email: Optional[str]):
+    """
+    Retourne (has_glaucoma, probabilité) pour une image jointe au chat.
+
+    Ordre : cache mémoire, analyse déjà stockée pour la même image (même
+    médecin), puis appel au endpoint DL de prédiction seule. Rien n'est écrit
+    sur disque.
+    """
+    if image_sha256 in chat_predictions:
+        chat_predictions.move_to_end(image_sha256)
+        return chat_predictions[image_sha256]
+
+    prediction = None
+    if user_email:
+        stored = (await db.execute(
+            select(Analysis)
+            .join(User, Analysis.user_id == User.id)
+            .where(Analysis.image_sha256 == image_sha256, User.email == user_email)
+            .order_by(desc(Analysis.timestamp))
+            .limit(1)
+        )).scalars().first()
+        if stored is not None:
+            prediction = (stored.has_glaucoma, stored.confidence)
+
+    if prediction is None:
+        files = {'file': (file.filename, contents, file.content_type)}
+        async with httpx.AsyncClient(timeout=60.0, headers=trace_headers()) as client:
+            response = await client.post(DL_PREDICT_URL, files=files)
+            if response.status_code in (404, 405):
+                # Ancien service DL sans /predict/
+                response = await client.post(DL_SERVICE_URL, files=files)
+        response.raise_for_status()
+        result = response.json()
+        prediction = (result['prediction_class'] == 1, result['probability'])
+
+    chat_predictions[image_sha256] = prediction
+    if len(chat_predictions) > CHAT_PREDICTION_CACHE_SIZE:
+        chat_predictions.popitem(last=False)
+    return prediction
+
 @app.post("/chat")
 async def chat_with_doctor(
+        request: Request,
         message: str = Form(...),
         file: UploadFile = File(None),
         history: str = Form("[]"),
         analysis_context: str = Form(None),
+        db: AsyncSession = Depends(get_db),
         accept_language: str = Header("fr")
 ):
     msgs = get_messages(accept_language)
@@ -346,21 +637,15 @@ async def chat_with_doctor(
 
     current_image_context = ""
     if file:
-        file_location = os.path.join(UPLOAD_DIRECTORY, f"chat_{file.filename}")
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
+        contents = await file.read()
+        image_sha256 = hashlib.sha256(contents).hexdigest()
         try:
-            async with httpx.AsyncClient() as client:
-                with open(file_location, "rb") as f:
-                    files = {'file': (file.filename, f, file.content_type)}
-                    response = await client.post(DL_SERVICE_URL, files=files)
-
-            if response.status_code == 200:
-                result = response.json()
-                status_txt = msgs["glaucoma_high"] if result['prediction_class'] == 1 else msgs["glaucoma_low"]
-                confiance = f"{result['probability']*100:.1f}%"
-                current_image_context = f"[IMAGE CONTEXT]\nStatus: {status_txt}\nConfidence: {confiance}\n"
+            has_glaucoma, probability = await predict_chat_image(
+                contents, image_sha256, file, db, get_token_subject(request)
+            )
+            status_txt = msgs["glaucoma_high"] if has_glaucoma else msgs["glaucoma_low"]
+            confiance = f"{probability*100:.1f}%"
+            current_image_context = f"[IMAGE CONTEXT]\nStatus: {status_txt}\nConfidence: {confiance}\n"
         except Exception as e:
             current_image_context = f"[ERROR] Image analysis failed: {str(e)}"
 
@@ -378,91 +663,84 @@ async def chat_with_doctor(
     final_user_content = f"{final_context_str}\n\nQuestion: {message}" if final_context_str else message
     gpt_messages.append({"role": "user", "content": final_user_content})
 
-    async def generate_response():
-        try:
-            stream = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=gpt_messages,
-                stream=True,
-            )
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
-        except Exception as e:
-            yield f"Error: {str(e)}"
+    return open_chat_stream(request, gpt_messages, msgs)
 
-    return StreamingResponse(generate_response(), media_type="text/plain")
+@app.get("/chat/metrics")
+async def get_chat_metrics():
+    return {**chat_metrics.snapshot(), "guide_cache": guide_cache.snapshot()}
 
 
 # --- Routes Patients ---
 
 @app.get("/patients")
-def get_my_patients(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    patients = db.query(Patient).filter(Patient.doctor_id == current_user.id).all()
-    return patients
+async def get_my_patients(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    patients = (await db.execute(
+        select(*PATIENT_LIST_COLUMNS).where(Patient.doctor_id == current_user.id)
+    )).all()
+    return FastJSONResponse([row._asdict() for row in patients])
 
 @app.get("/patients/{patient_id}", response_model=PatientDetail)
-def get_patient_details(
+async def get_patient_details(
         patient_id: int,
         request: Request,
         current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         accept_language: str = Header("fr")
 ):
     msgs = get_messages(accept_language)
-    patient = db.query(Patient).filter(
+    patient = (await db.execute(select(Patient).where(
         Patient.id == patient_id,
         Patient.doctor_id == current_user.id
-    ).first()
+    ))).scalars().first()
 
     if not patient:
         raise HTTPException(status_code=404, detail=msgs["patient_404"])
 
-    analyses_formatted = []
-    sorted_analyses = sorted(patient.analyses, key=lambda x: x.timestamp, reverse=True)
-
-    for ana in sorted_analyses:
-        file_path = os.path.join(UPLOAD_DIRECTORY, ana.filename)
-        exists = os.path.exists(file_path)
-        
-        # URL de base pour les images
-        base_url = str(request.base_url).rstrip("/")
-        image_url = f"{base_url}/images/{ana.filename}" if exists else None
-        
-        # ✅ Construction URL GradCAM
-        gradcam_url = None
-        if ana.gradcam_filename:
-             gradcam_path = os.path.join(UPLOAD_DIRECTORY, ana.gradcam_filename)
-             if os.path.exists(gradcam_path):
-                gradcam_url = f"{base_url}/images/{ana.gradcam_filename}"
-
-        analyses_formatted.append({
-            "id": ana.id,
-            "filename": ana.filename,
-            "has_glaucoma": ana.has_glaucoma,
-            "confidence": ana.confidence,
-            "timestamp": ana.timestamp,
-            "image_url": image_url,
-            "gradcam_url": gradcam_url, # ✅ Ajouté
-            "is_expired": not exists,
-            "patient_name": patient.full_name
-        })
+    # Tri délégué à la base (index patient_id, timestamp)
+    sorted_analyses = (await db.execute(
+        select(*ANALYSIS_LIST_COLUMNS)
+        .where(Analysis.patient_id == patient.id)
+        .order_by(desc(Analysis.timestamp))
+    )).all()
 
-    response = {
+    # URL de base pour les images
+    base_url = str(request.base_url).rstrip("/")
+    analyses_formatted = [analysis_item(base_url, ana, patient.full_name, current_user.id) for ana in sorted_analyses]
+
+    # Déjà au format PatientDetail : pas de revalidation
+    return FastJSONResponse({
         "id": patient.id,
         "full_name": patient.full_name,
         "age": patient.age,
         "gender": patient.gender,
         "phone": patient.phone,
         "analyses": analyses_formatted
-    }
-    return response
+    })
+
+@app.get("/patients/{patient_id}/trend")
+async def get_patient_trend(
+        patient_id: int,
+        limit: Optional[int] = Query(None, ge=1, description="derniers examens renvoyés dans les séries"),
+        current_user: User = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db),
+        accept_language: str = Header("fr")
+):
+    """Suivi longitudinal : probabilité de glaucome dans le temps, écarts entre examens, pente annuelle."""
+    msgs = get_messages(accept_language)
+    owned = (await db.execute(select(Patient.id).where(
+        Patient.id == patient_id,
+        Patient.doctor_id == current_user.id
+    ))).scalar()
+    if owned is None:
+        raise HTTPException(status_code=404, detail=msgs["patient_404"])
+    summary = await load_patient_trend(db, patient_id)
+    return FastJSONResponse({"patient_id": patient_id, **render_trend(summary, limit)})
 
 @app.post("/patients", status_code=201)
-def create_patient(
+async def create_patient(
         patient: PatientCreate,
         current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         accept_language: str = Header("fr")
 ):
     msgs = get_messages(accept_language)
@@ -474,11 +752,80 @@ def create_patient(
         doctor_id=current_user.id
     )
     db.add(new_patient)
-    db.commit()
-    db.refresh(new_patient)
+    await db.commit()
     return {"message": msgs["patient_created"], "patient": new_patient}
 
 
+# --- Route Export ---
+
+def export_statements(doctor_id: int):
+    """Patients du médecin (avec ou sans analyse) puis analyses sans patient, en colonnes plates."""
+    analysis_columns = (
+        Analysis.id.label("analysis_id"),
+        Analysis.filename,
+        Analysis.has_glaucoma,
+        Analysis.confidence,
+        Analysis.timestamp,
+        Analysis.image_sha256,
+        HAS_CAMS,
+    )
+    with_patients = (
+        select(Patient.id.label("patient_id"), Patient.full_name, Patient.age, Patient.gender, Patient.phone,
+               *analysis_columns)
+        .outerjoin(Analysis, Analysis.patient_id == Patient.id)
+        .where(Patient.doctor_id == doctor_id)
+        .order_by(Patient.id, Analysis.timestamp)
+    )
+    without_patient = (
+        select(*(null().label(name) for name in PATIENT_COLUMNS), *analysis_columns)
+        .where(Analysis.user_id == doctor_id, Analysis.patient_id.is_(None))
+        .order_by(Analysis.timestamp)
+    )
+    return with_patients, without_patient
+
+def export_files_statement(doctor_id: int, heatmaps: bool):
+    columns = [Analysis.id.label("analysis_id"), Analysis.filename]
+    if heatmaps:
+        columns += [Analysis.gradcam_filename, Analysis.cam_maps, Analysis.cam_thumbnail]
+    return (
+        select(*columns)
+        .where(or_(
+            Analysis.patient_id.in_(select(Patient.id).where(Patient.doctor_id == doctor_id)),
+            and_(Analysis.user_id == doctor_id, Analysis.patient_id.is_(None)),
+        ))
+        .order_by(Analysis.id)
+    )
+
+@app.get("/export")
+async def export_records(
+    export_format: str = Query("ndjson", alias="format", description="ndjson ou csv"),
+    images: bool = Query(False, description="joindre les originaux encore présents (archive zip)"),
+    heatmaps: bool = Query(False, description="joindre les heatmaps (archive zip)"),
+    current_user: User = Depends(get_current_user)
+):
+    # Flux de bout en bout : curseur côté serveur -> encodage -> réponse, sans liste en mémoire
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format: {', '.join(EXPORT_FORMATS)}")
+    name = f"export_{datetime.utcnow():%Y%m%d_%H%M%S}"
+    lines = encode_records(stream_rows(SessionLocal, *export_statements(current_user.id)), export_format)
+
+    if not (images or heatmaps):
+        return StreamingResponse(
+            chunked(lines),
+            media_type=EXPORT_FORMATS[export_format],
+            headers={"Content-Disposition": f'attachment; filename="{name}.{export_format}"'},
+        )
+
+    files = export_files(
+        stream_rows(SessionLocal, export_files_statement(current_user.id, heatmaps)),
+        UPLOAD_DIRECTORY, images, heatmaps
+    )
+    return StreamingResponse(
+        zip_chunks(lines, f"analyses.{export_format}", files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{name}.zip"'},
+    )
+
 # --- Routes Upload & History ---
 
 @app.post("/uploadfile/")
@@ -487,7 +834,7 @@ async def create_upload_file(
         file: UploadFile = File(...),
         patient_id: int = Form(...),
         current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         accept_language: str = Header("fr")
 ):
     msgs = get_messages(accept_language)
@@ -510,7 +857,9 @@ async def create_upload_file(
     file_location = os.path.join(UPLOAD_DIRECTORY, clean_filename)
 
     # Vérification patient
-    patient = db.query(Patient).filter(Patient.id == patient_id, Patient.doctor_id == current_user.id).first()
+    patient = (await db.execute(
+        select(Patient).where(Patient.id == patient_id, Patient.doctor_id == current_user.id)
+    )).scalars().first()
     if not patient:
         raise HTTPException(status_code=404, detail=msgs["patient_404"])
 
@@ -549,39 +898,19 @@ async def create_upload_file(
     gradcam_url = None # Variable pour stocker l'URL
 
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
+        async with httpx.AsyncClient(timeout=60.0, headers=trace_headers()) as client:
             with open(file_location, "rb") as f:
-                files = {'file': (clean_filename, f, file.content_type)}
-                response = await client.post(DL_SERVICE_URL, files=files)
+                # Prédiction seule : la heatmap est générée plus tard, à la demande
+                files = {'file': (clean_filename, f, "image/png" if is_dicom else file.content_type)}
+                response = await client.post(DL_PREDICT_URL, files=files)
 
             if response.status_code == 200:
                 analysis_result = response.json()
-                
-                # 1. Gestion du GradCAM (Extraction & Sauvegarde)
-                gradcam_fname = None
-                if analysis_result.get("gradcam_image"):
-                    try:
-                        img_b64 = analysis_result["gradcam_image"]
-                        if "," in img_b64:
-                            img_b64 = img_b64.split(",", 1)[1]
-                        
-                        gradcam_fname = f"gradcam_{clean_filename}"
-                        gradcam_path = os.path.join(UPLOAD_DIRECTORY, gradcam_fname)
-                        
-                        with open(gradcam_path, "wb") as gf:
-                            gf.write(base64.b64decode(img_b64))
-                        
-                        # 2. CONSTRUCTION DE L'URL IMMÉDIATE
-                        base_url = str(request.base_url).rstrip("/")
-                        gradcam_url = f"{base_url}/images/{gradcam_fname}"
-
-                    except Exception as e:
-                        print(f"Erreur sauvegarde GradCAM: {e}")
-
-                # 3. Enregistrement Base de Données
+
+                # 1. Enregistrement Base de Données (cartes GradCAM calculées plus tard)
                 new_analysis = Analysis(
                     filename=clean_filename,
-                    gradcam_filename=gradcam_fname, 
+                    image_sha256=hashlib.sha256(content).hexdigest(),
                     has_glaucoma=bool(analysis_result.get("prediction_class") == 1),
                     confidence=float(analysis_result.get("probability", 0)),
                     user_id=current_user.id,
@@ -589,9 +918,21 @@ async def create_upload_file(
                     timestamp=datetime.utcnow()
                 )
                 db.add(new_analysis)
-                db.commit()
-                db.refresh(new_analysis)
-
+                await db.commit()
+                await update_patient_trend(db, patient.id, lambda summary: add_exam(summary, exam_point(
+                    new_analysis.id, new_analysis.timestamp, new_analysis.has_glaucoma, new_analysis.confidence, None
+                )))
+
+                # 2. URL immédiate : la heatmap sera produite à la première ouverture
+                base_url = str(request.base_url).rstrip("/")
+                gradcam_url = signed_gradcam_url(base_url, new_analysis.id, current_user.id)
+                heatmap_renderer.schedule(new_analysis.id, clean_filename)
+
+            elif response.status_code in (413, 415, 422):
+                # Refus du contrôle qualité du service IA (floue, surexposée, trop petite...)
+                rejection = response.json()
+                analysis_result = {"error": msgs["image_rejected"], "reason": rejection.get("reason"),
+                                   "details": rejection.get("detail")}
             else:
                 analysis_result = {"error": "Erreur DL", "details": response.text}
     except httpx.RequestError:
@@ -608,74 +949,99 @@ async def create_upload_file(
         }
     }
 
+@app.get("/analyses/{analysis_id}/gradcam")
+async def get_analysis_gradcam(
+    analysis_id: int,
+    variant: str = Query("both", description="gradcam, gradcam_pp ou both (côte à côte)"),
+    colormap: str = Query("jet"),
+    alpha: float = Query(0.5, ge=0, le=1),
+    size: int = Query(224, ge=64, le=1024),
+    token: Optional[str] = Query(None, description="jeton signé de gradcam_url (balises <img>)"),
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Jeton d'accès (Authorization) ou URL signée de courte durée : la route est utilisée dans des <img>
+    user_id = current_user.id if current_user is not None else None
+    if user_id is None and token:
+        user_id = read_gradcam_token(token, analysis_id)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Could not authenticate", headers={"WWW-Authenticate": "Bearer"})
+    if variant not in (*VARIANTS, "both") or colormap not in COLORMAPS:
+        raise HTTPException(status_code=400, detail=f"variant: {', '.join(VARIANTS)}, both ; colormap: {', '.join(COLORMAPS)}")
+    ana = await db.get(Analysis, analysis_id, options=[undefer(Analysis.cam_thumbnail)])
+    # Analyse d'un autre médecin : même réponse qu'une analyse inexistante
+    if ana is None or not await can_view_analysis(db, ana, user_id):
+        raise HTTPException(status_code=404, detail="GradCAM introuvable")
+
+    cam_maps, thumbnail = ana.cam_maps, ana.cam_thumbnail
+    if cam_maps is None:
+        legacy_path = legacy_gradcam_path(ana)
+        if legacy_path:
+            return FileResponse(legacy_path, media_type="image/png", headers=PRIVATE_IMAGE_HEADERS)
+        if not os.path.exists(os.path.join(UPLOAD_DIRECTORY, ana.filename)):
+            raise HTTPException(status_code=404, detail="Image expirée")
+        try:
+            cam_maps, thumbnail = await heatmap_renderer.ensure(ana.id, ana.filename)
+        except (httpx.HTTPError, OSError) as e:
+            raise HTTPException(status_code=502, detail=f"GradCAM indisponible : {e}")
+
+    png_bytes = await heatmap_renderer.render(
+        ana.id, cam_maps, thumbnail, variant=variant, colormap=colormap, alpha=alpha, size=size
+    )
+    return Response(content=png_bytes, media_type="image/png", headers=PRIVATE_IMAGE_HEADERS)
+
 @app.get("/history", response_model=List[AnalysisResponse])
-def get_user_history(
+async def get_user_history(
     request: Request,
     current_user: User = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    analyses = db.execute(
-        select(Analysis)
+    analyses = (await db.execute(
+        select(*ANALYSIS_LIST_COLUMNS, Patient.full_name.label("patient_name"))
+        .outerjoin(Patient, Analysis.patient_id == Patient.id)
         .where(Analysis.user_id == current_user.id)
         .order_by(desc(Analysis.timestamp))
-    ).scalars().all()
+    )).all()
 
-    history_data = []
     base_url = str(request.base_url).rstrip("/")
-
-    for ana in analyses:
-        file_path = os.path.join(UPLOAD_DIRECTORY, ana.filename)
-        exists = os.path.exists(file_path)
-        image_url = f"{base_url}/images/{ana.filename}" if exists else None
-        
-        # ✅ Construction URL GradCAM
-        gradcam_url = None
-        if ana.gradcam_filename:
-             gradcam_path = os.path.join(UPLOAD_DIRECTORY, ana.gradcam_filename)
-             if os.path.exists(gradcam_path):
-                gradcam_url = f"{base_url}/images/{ana.gradcam_filename}"
-
-        pat_name = ana.patient.full_name if ana.patient else "Inconnu"
-
-        history_data.append({
-            "id": ana.id,
-            "filename": ana.filename,
-            "has_glaucoma": ana.has_glaucoma,
-            "confidence": ana.confidence,
-            "timestamp": ana.timestamp,
-            "image_url": image_url,
-            "gradcam_url": gradcam_url, # ✅ Ajouté
-            "is_expired": not exists,
-            "patient_name": pat_name
-        })
-
-    return history_data
+    # Déjà au format AnalysisResponse : pas de revalidation
+    return FastJSONResponse([analysis_item(base_url, ana, ana.patient_name or "Inconnu", current_user.id) for ana in analyses])
 
 @app.get("/dashboard/stats")
-def get_dashboard_stats(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    total_patients = db.query(Patient).filter(Patient.doctor_id == current_user.id).count()
-    total_analyses = db.query(Analysis).filter(Analysis.user_id == current_user.id).count()
-    total_glaucoma = db.query(Analysis).filter(
-        Analysis.user_id == current_user.id,
-        Analysis.has_glaucoma == True
-    ).count()
-
-    recent_patients = db.query(Patient).filter(Patient.doctor_id == current_user.id) \
-        .order_by(desc(Patient.created_at)).limit(5).all()
-
-    return {
+async def get_dashboard_stats(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    total_patients = (await db.execute(
+        select(func.count(Patient.id)).where(Patient.doctor_id == current_user.id)
+    )).scalar()
+    total_analyses = (await db.execute(
+        select(func.count(Analysis.id)).where(Analysis.user_id == current_user.id)
+    )).scalar()
+    total_glaucoma = (await db.execute(
+        select(func.count(Analysis.id)).where(
+            Analysis.user_id == current_user.id,
+            Analysis.has_glaucoma == True
+        )
+    )).scalar()
+
+    recent_patients = (await db.execute(
+        select(*PATIENT_LIST_COLUMNS).where(Patient.doctor_id == current_user.id)
+        .order_by(desc(Patient.created_at)).limit(5)
+    )).all()
+
+    return FastJSONResponse({
         "total_patients": total_patients,
         "total_analyses": total_analyses,
         "total_glaucoma": total_glaucoma,
-        "recent_patients": recent_patients
-    }
+        "recent_patients": [row._asdict() for row in recent_patients]
+    })
 
 @app.post("/chat/guide")
 async def chat_guide(
+        request: Request,
         message: str = Form(...),
         history: str = Form("[]"),
         accept_language: str = Header("fr")
 ):
+    msgs = get_messages(accept_language)
     lang_name = get_language_name(accept_language)
 
     app_manual = """
@@ -707,17 +1073,14 @@ async def chat_guide(
         gpt_messages.append(msg)
     gpt_messages.append({"role": "user", "content": message})
 
-    async def generate_response():
-        try:
-            stream = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=gpt_messages,
-                stream=True,
-            )
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
-        except Exception as e:
-            yield f"Error: {str(e)}"
+    # Questions répétitives : on rejoue la réponse en cache sans appeler gpt-4o
+    cache_key = guide_cache.make_key(lang_name, message, messages_history[-3:])
+    cached_answer, embedding = await lookup_guide_answer(openai_client, cache_key, message)
+    if cached_answer is not None:
+        return StreamingResponse(replay_answer(cached_answer), media_type="text/plain", headers={"X-Cache": "HIT"})
+
+    def store_answer(answer: str):
+        if answer and not answer.startswith("Error:"):
+            guide_cache.put(cache_key, answer, embedding)
 
-    return StreamingResponse(generate_response(), media_type="text/plain")
\ No newline at end of file
+    return open_chat_stream(request, gpt_messages, msgs, on_complete=store_answer)
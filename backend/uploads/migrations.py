@@ -0,0 +1,169 @@
+# backend/uploads/migrations.py
+"""
+Migrations de schéma minimalistes, appliquées au démarrage.
+
+Chaque étape est une fonction synchrone (exécutée via `run_sync`) qui reçoit
+la connexion et les métadonnées. La version courante est stockée dans la
+table `schema_version` (une seule ligne) ; seules les étapes plus récentes
+sont rejouées, dans une transaction verrouillée : un seul worker migre.
+"""
+import logging
+
+from sqlalchemy import (Boolean, CheckConstraint, Column, DateTime, Float, ForeignKey, Index, Integer, MetaData,
+                        String, Table, inspect, select, text)
+
+from database import engine
+
+logger = logging.getLogger("Migrations")
+# Clé du verrou consultatif PostgreSQL des migrations
+MIGRATION_LOCK_KEY = 4242001
+
+_version_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _version_metadata,
+    # Ligne unique (id = 1) : deux workers ne peuvent pas insérer chacun la leur
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("version", Integer, nullable=False),
+    CheckConstraint("id = 1", name="ck_schema_version_single_row"),
+)
+
+# Schéma historique figé (ancien Base.metadata.create_all) : les colonnes ajoutées
+# depuis aux modèles arrivent par les étapes suivantes, jamais par celle-ci
+_baseline_metadata = MetaData()
+Table(
+    "users", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("email", String, unique=True, index=True, nullable=False),
+    Column("hashed_password", String(255), nullable=False),
+    Column("created_at", DateTime),
+)
+Table(
+    "patients", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("full_name", String, index=True),
+    Column("age", Integer),
+    Column("gender", String),
+    Column("phone", String, nullable=True),
+    Column("created_at", DateTime),
+    Column("doctor_id", Integer, ForeignKey("users.id")),
+)
+Table(
+    "analyses", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("filename", String, index=True),
+    Column("gradcam_filename", String, nullable=True),
+    Column("has_glaucoma", Boolean),
+    Column("confidence", Float),
+    Column("timestamp", DateTime),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("patient_id", Integer, ForeignKey("patients.id"), nullable=True),
+)
+
+
+def _create_base_schema(conn, metadata):
+    _baseline_metadata.create_all(conn, checkfirst=True)
+
+
+def _add_hot_query_indexes(conn, metadata):
+    # /history : WHERE user_id = ? ORDER BY timestamp DESC
+    # /patients/{id} : WHERE patient_id = ? ORDER BY timestamp DESC
+    # /dashboard/stats : WHERE doctor_id = ? ORDER BY created_at DESC
+    analyses = metadata.tables["analyses"]
+    patients = metadata.tables["patients"]
+    indexes = [
+        Index("ix_analyses_user_id_timestamp", analyses.c.user_id, analyses.c.timestamp),
+        Index("ix_analyses_patient_id_timestamp", analyses.c.patient_id, analyses.c.timestamp),
+        Index("ix_patients_doctor_id_created_at", patients.c.doctor_id, patients.c.created_at),
+    ]
+    existing = {ix["name"] for name in ("analyses", "patients") for ix in inspect(conn).get_indexes(name)}
+    for index in indexes:
+        if index.name not in existing:
+            index.create(conn)
+
+
+def _add_column(conn, table, column):
+    if column.name in {c["name"] for c in inspect(conn).get_columns(table.name)}:
+        return
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+
+
+def _add_image_sha256(conn, metadata):
+    # Permet de retrouver l'analyse d'une image déjà envoyée (chat)
+    analyses = metadata.tables["analyses"]
+    _add_column(conn, analyses, analyses.c.image_sha256)
+    existing = {ix["name"] for ix in inspect(conn).get_indexes("analyses")}
+    for index in analyses.indexes:
+        if index.name == "ix_analyses_image_sha256" and index.name not in existing:
+            index.create(conn)
+
+
+def _add_raw_cams(conn, metadata):
+    # Cartes GradCAM brutes et vignette à la place du PNG composite sur disque
+    analyses = metadata.tables["analyses"]
+    _add_column(conn, analyses, analyses.c.cam_maps)
+    _add_column(conn, analyses, analyses.c.cam_thumbnail)
+
+
+def _create_patient_trends(conn, metadata):
+    # Rempli à la demande : la première lecture reconstruit le résumé depuis les analyses
+    metadata.tables["patient_trends"].create(conn, checkfirst=True)
+
+
+def _add_trend_exam_count(conn, metadata):
+    # Lignes existantes à NULL : reconstruites à la première lecture
+    trends = metadata.tables["patient_trends"]
+    _add_column(conn, trends, trends.c.exam_count)
+
+
+MIGRATIONS = [
+    (1, "schéma de base", _create_base_schema),
+    (2, "index des requêtes fréquentes", _add_hot_query_indexes),
+    (3, "empreinte SHA-256 des images analysées", _add_image_sha256),
+    (4, "cartes GradCAM brutes et vignette", _add_raw_cams),
+    (5, "résumés longitudinaux des patients", _create_patient_trends),
+    (6, "nombre d'examens des résumés longitudinaux", _add_trend_exam_count),
+]
+
+
+def _lock(conn):
+    """Verrou exclusif jusqu'à la fin de la transaction : les autres workers attendent puis ne rejouent rien."""
+    if conn.dialect.name == "sqlite":
+        # Verrou d'écriture pris dès le début (et non au premier INSERT)
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+
+def _current_version(conn) -> int:
+    columns = {c["name"] for c in inspect(conn).get_columns("schema_version")} \
+        if inspect(conn).has_table("schema_version") else set()
+    if columns and "id" not in columns:
+        # Ancienne table sans clé primaire : recréée avec sa version (la plus haute si plusieurs lignes)
+        version = conn.exec_driver_sql("SELECT MAX(version) FROM schema_version").scalar() or 0
+        conn.exec_driver_sql("DROP TABLE schema_version")
+        _version_metadata.create_all(conn)
+        conn.execute(schema_version.insert().values(id=1, version=version))
+        return version
+    _version_metadata.create_all(conn, checkfirst=True)
+    version = conn.execute(select(schema_version.c.version).where(schema_version.c.id == 1)).scalar()
+    if version is None:
+        conn.execute(schema_version.insert().values(id=1, version=0))
+        return 0
+    return version
+
+
+def apply_migrations(conn, metadata):
+    _lock(conn)
+    version = _current_version(conn)
+    for target, description, step in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info(f"Migration {target} : {description}")
+        step(conn, metadata)
+        conn.execute(schema_version.update().where(schema_version.c.id == 1).values(version=target))
+
+
+async def run_migrations(metadata):
+    async with engine.begin() as conn:
+        await conn.run_sync(apply_migrations, metadata)
@@ -0,0 +1,186 @@
+# backend/uploads/responses.py
+import os
+import gzip
+import json
+import zlib
+from datetime import date, datetime
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Repli sur json de la bibliothèque standard
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # gzip seulement
+
+# --- Configuration ---
+# Réponses plus petites envoyées telles quelles : la compression coûte plus qu'elle ne rapporte
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Niveaux rapides : les listes JSON se compressent déjà très bien
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/", "image/svg+xml")
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} non sérialisable en JSON")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON encodé par orjson (datetime natifs, pas d'espaces). Renvoyée
+    directement par une route, elle évite aussi la validation du
+    response_model et jsonable_encoder : la route construit déjà des
+    dictionnaires au bon format.
+    """
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _accepted_encoding(scope):
+    """brotli, sinon gzip, s'ils sont acceptés (q > 0, ou via `*`) ; None pour identity."""
+    accepted = {}
+    for item in Headers(scope=scope).get("accept-encoding", "").split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class _StreamCompressor:
+    """Compression d'un corps en plusieurs messages : chaque morceau est vidé (sync flush) et part aussitôt."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits 16 + MAX_WBITS : en-tête et somme de contrôle gzip
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        if not data:
+            return b""
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.finish() if self.encoding == "br" else self.compressor.flush()
+
+
+class CompressionMiddleware:
+    """
+    Middleware ASGI : brotli ou gzip pour les réponses de type texte/JSON.
+    Une réponse complète (un seul message de corps) est compressée si elle
+    dépasse COMPRESSION_MIN_SIZE. Une réponse en flux (chat, export) est
+    compressée morceau par morceau avec un vidage synchrone : chaque
+    morceau reste décodable dès sa réception, sans attendre la fin.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = _accepted_encoding(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        stream = None
+        decided = False
+
+        async def send_compressed(message):
+            nonlocal start, stream, decided
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is not None:
+                data = stream.chunk(body) + (b"" if more_body else stream.finish())
+                return await send({**message, "body": data})
+            if decided:
+                return await send(message)
+
+            decided = True
+            headers = MutableHeaders(raw=list(start.get("headers", [])))
+            compressible = headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            if (not compressible or "content-encoding" in headers
+                    or (not more_body and len(body) < self.minimum_size)):
+                await send(start)
+                return await send(message)
+
+            headers["content-encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                # Longueur finale inconnue : transfert par morceaux
+                del headers["content-length"]
+                stream = _StreamCompressor(encoding)
+                body = stream.chunk(body)
+            else:
+                body = _compress(body, encoding)
+                headers["content-length"] = str(len(body))
+            await send({**start, "headers": headers.raw})
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class CorsHeadersMiddleware:
+    """Middleware ASGI : en-têtes CORS permissifs sur toutes les réponses, sans tamponner le corps."""
+
+    HEADERS = {
+        "access-control-allow-origin": "*",
+        "access-control-allow-methods": "*",
+        "access-control-allow-headers": "*",
+    }
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=list(message.get("headers", [])))
+                for name, value in self.HEADERS.items():
+                    headers[name] = value
+                message = {**message, "headers": headers.raw}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
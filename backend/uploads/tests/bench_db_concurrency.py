@@ -0,0 +1,135 @@
+# backend/uploads/tests/bench_db_concurrency.py
+"""
+Benchmark de concurrence de la couche base de données.
+
+Compare l'ancien mode (Session synchrone appelée depuis des coroutines) et le
+mode AsyncSession sur la même charge : N clients qui insèrent une analyse puis
+relisent leur historique. Mesure le débit, la latence et le retard de la boucle
+d'événements (ce que subissent les autres requêtes pendant ce temps).
+
+    python tests/bench_db_concurrency.py --clients 50 --iterations 40
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_db_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}")
+
+from sqlalchemy import create_engine, desc, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from database import DATABASE_URL, IS_SQLITE, SessionLocal, engine  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from main import Analysis, Base, Patient, User  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+async def seed(n_clients):
+    async with SessionLocal() as db:
+        users = [User(email=f"bench{i}@example.com", hashed_password="x") for i in range(n_clients)]
+        db.add_all(users)
+        await db.flush()
+        patients = [Patient(full_name=f"Patient {u.id}", age=60, gender="F", doctor_id=u.id) for u in users]
+        db.add_all(patients)
+        await db.commit()
+        return [(u.id, p.id) for u, p in zip(users, patients)]
+
+
+async def heartbeat(stop, lags, interval=0.01):
+    # Retard observé par une tâche qui voudrait tourner toutes les 10 ms
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def async_client(user_id, patient_id, iterations, latencies):
+    for _ in range(iterations):
+        start = time.perf_counter()
+        async with SessionLocal() as db:
+            db.add(Analysis(filename="bench.png", has_glaucoma=False, confidence=0.9,
+                            user_id=user_id, patient_id=patient_id, timestamp=datetime.utcnow()))
+            await db.commit()
+            await db.execute(
+                select(Analysis).where(Analysis.user_id == user_id)
+                .order_by(desc(Analysis.timestamp)).limit(50)
+            )
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def sync_client(SyncSession, user_id, patient_id, iterations, latencies):
+    # Reproduit l'ancien code : Session bloquante dans un handler async
+    for _ in range(iterations):
+        start = time.perf_counter()
+        db = SyncSession()
+        try:
+            db.add(Analysis(filename="bench.png", has_glaucoma=False, confidence=0.9,
+                            user_id=user_id, patient_id=patient_id, timestamp=datetime.utcnow()))
+            db.commit()
+            db.execute(
+                select(Analysis).where(Analysis.user_id == user_id)
+                .order_by(desc(Analysis.timestamp)).limit(50)
+            ).all()
+        finally:
+            db.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0)
+
+
+async def run_mode(mode, pairs, iterations):
+    latencies, lags = [], []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(stop, lags))
+
+    if mode == "sync":
+        sync_url = DATABASE_URL.replace("+aiosqlite", "")
+        connect_args = {"check_same_thread": False} if IS_SQLITE else {}
+        sync_engine = create_engine(sync_url, connect_args=connect_args)
+        SyncSession = sessionmaker(bind=sync_engine, autoflush=False)
+        clients = [sync_client(SyncSession, u, p, iterations, latencies) for u, p in pairs]
+    else:
+        clients = [async_client(u, p, iterations, latencies) for u, p in pairs]
+
+    start = time.perf_counter()
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+
+    ops = len(latencies)
+    print(f"[{mode:5}] {ops} ops en {elapsed:.2f}s -> {ops / elapsed:.1f} ops/s | "
+          f"latence p50={percentile(latencies, 50):.1f}ms p95={percentile(latencies, 95):.1f}ms | "
+          f"retard boucle p95={percentile(lags, 95):.1f}ms max={max(lags, default=0):.1f}ms "
+          f"(moy {statistics.mean(lags) if lags else 0:.1f}ms)")
+
+
+async def main(args):
+    await run_migrations(Base.metadata)
+    pairs = await seed(args.clients)
+    print(f"Base : {DATABASE_URL} | {args.clients} clients x {args.iterations} itérations")
+    for mode in args.modes:
+        await run_mode(mode, pairs, args.iterations)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=40)
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,80 @@
+# backend/uploads/tests/bench_export.py
+"""
+Benchmark de l'export en flux (/export) sans HTTP.
+
+Crée un médecin avec --patients patients et --analyses analyses, puis mesure
+la durée de l'export NDJSON et CSV ainsi que le pic mémoire Python
+(tracemalloc), qui doit rester à peu près constant quand --analyses grandit.
+
+    python tests/bench_export.py --analyses 100000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_export_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}")
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from database import DATABASE_URL, SessionLocal, engine  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from export import chunked, encode_records, stream_rows  # noqa: E402
+from main import Analysis, Base, Patient, User, export_statements  # noqa: E402
+
+
+async def seed(n_patients, n_analyses):
+    async with SessionLocal() as db:
+        doctor = User(email="export@example.com", hashed_password="x")
+        db.add(doctor)
+        await db.flush()
+        await db.execute(insert(Patient), [
+            {"full_name": f"Patient {i}", "age": 40 + i % 50, "gender": "F", "doctor_id": doctor.id}
+            for i in range(n_patients)
+        ])
+        first_patient = (await db.execute(select(func.min(Patient.id)))).scalar()
+        start = datetime.utcnow()
+        for offset in range(0, n_analyses, 10000):
+            await db.execute(insert(Analysis), [
+                {"filename": f"img_{i}.png", "has_glaucoma": i % 3 == 0, "confidence": 0.9,
+                 "user_id": doctor.id, "patient_id": first_patient + i % n_patients,
+                 "timestamp": start + timedelta(seconds=i)}
+                for i in range(offset, min(offset + 10000, n_analyses))
+            ])
+        await db.commit()
+        return doctor.id
+
+
+async def run_export(doctor_id, fmt):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = 0
+    async for chunk in chunked(encode_records(stream_rows(SessionLocal, *export_statements(doctor_id)), fmt)):
+        size += len(chunk)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"[{fmt:6}] {size / 2**20:.1f} Mo en {elapsed:.2f}s | pic mémoire Python {peak / 2**20:.1f} Mo")
+
+
+async def main(args):
+    await run_migrations(Base.metadata)
+    doctor_id = await seed(args.patients, args.analyses)
+    print(f"Base : {DATABASE_URL} | {args.patients} patients, {args.analyses} analyses")
+    for fmt in ("ndjson", "csv"):
+        await run_export(doctor_id, fmt)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--analyses", type=int, default=100000)
+    asyncio.run(main(parser.parse_args()))
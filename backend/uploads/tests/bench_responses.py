@@ -0,0 +1,127 @@
+# backend/uploads/tests/bench_responses.py
+"""
+Benchmark du pipeline de réponse des listes (/history, /patients/{id}).
+
+1. Encodage seul, sur une liste d'analyses au format AnalysisResponse :
+   ancien chemin (validation Pydantic + jsonable_encoder + json) contre
+   FastJSONResponse (orjson direct), avec la taille gzip / brotli.
+2. De bout en bout, sans réseau (httpx + ASGI) : débit de GET /history et
+   GET /patients/{id} avec la pile de middlewares réelle, avec et sans
+   Accept-Encoding.
+
+    python tests/bench_responses.py --analyses 500 --requests 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_responses_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}")
+
+import httpx  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from database import SessionLocal, engine  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from responses import FastJSONResponse, _compress, brotli  # noqa: E402
+from main import Analysis, AnalysisResponse, Base, Patient, User, app, create_access_token  # noqa: E402
+
+
+def sample_items(n):
+    start = datetime.utcnow()
+    return [{
+        "id": i, "filename": f"img_{i}.png", "has_glaucoma": i % 3 == 0, "confidence": 0.9123,
+        "timestamp": start + timedelta(minutes=i), "image_url": f"http://localhost:8000/images/img_{i}.png",
+        "gradcam_url": f"http://localhost:8000/analyses/{i}/gradcam", "is_expired": False,
+        "patient_name": "Patient Test",
+    } for i in range(n)]
+
+
+def old_pipeline(items):
+    validated = [AnalysisResponse(**item) for item in items]
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def new_pipeline(items):
+    return FastJSONResponse(items).body
+
+
+def time_it(fn, items, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = fn(items)
+    return (time.perf_counter() - start) / repeat * 1000, body
+
+
+def bench_encoding(n, repeat):
+    items = sample_items(n)
+    old_ms, old_body = time_it(old_pipeline, items, repeat)
+    new_ms, new_body = time_it(new_pipeline, items, repeat)
+    print(f"Encodage de {n} analyses : ancien {old_ms:.2f} ms, nouveau {new_ms:.2f} ms (x{old_ms / new_ms:.1f})")
+    sizes = f"JSON {len(new_body) / 1024:.1f} Ko, gzip {len(_compress(new_body, 'gzip')) / 1024:.1f} Ko"
+    if brotli is not None:
+        sizes += f", brotli {len(_compress(new_body, 'br')) / 1024:.1f} Ko"
+    print(sizes)
+
+
+async def seed(n):
+    async with SessionLocal() as db:
+        doctor = User(email="responses@example.com", hashed_password="x")
+        db.add(doctor)
+        await db.flush()
+        patient = Patient(full_name="Patient Test", age=60, gender="F", doctor_id=doctor.id)
+        db.add(patient)
+        await db.flush()
+        start = datetime.utcnow()
+        await db.execute(insert(Analysis), [
+            {"filename": f"img_{i}.png", "has_glaucoma": i % 3 == 0, "confidence": 0.9, "user_id": doctor.id,
+             "patient_id": patient.id, "timestamp": start + timedelta(minutes=i)}
+            for i in range(n)
+        ])
+        await db.commit()
+        return doctor.email, patient.id
+
+
+async def bench_http(n, requests, concurrency):
+    await run_migrations(Base.metadata)
+    email, patient_id = await seed(n)
+    token = create_access_token({"sub": email})
+    transport = httpx.ASGITransport(app=app)
+    for path in ("/history", f"/patients/{patient_id}"):
+        for encoding in ("identity", "gzip", "br"):
+            headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": encoding}
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+                counter = iter(range(requests))
+                sizes = []
+
+                async def worker():
+                    for _ in counter:
+                        r = await client.get(path)
+                        r.raise_for_status()
+                        sizes.append(int(r.headers.get("content-length", len(r.content))))
+
+                start = time.perf_counter()
+                await asyncio.gather(*[worker() for _ in range(concurrency)])
+                elapsed = time.perf_counter() - start
+            print(f"GET {path:<14} {encoding:<8} {requests / elapsed:7.1f} req/s, "
+                  f"{sizes[-1] / 1024:.1f} Ko par réponse")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--analyses", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    bench_encoding(args.analyses, args.repeat)
+    asyncio.run(bench_http(args.analyses, args.requests, args.concurrency))
@@ -0,0 +1,71 @@
+# backend/uploads/tests/chat_stream_client.py
+"""
+Ouvre plusieurs flux /chat/guide en parallèle et vérifie que la boucle
+d'événements du backend reste disponible (ping /chat/metrics pendant les flux).
+
+    python tests/chat_stream_client.py --streams 20
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+BASE_URL = "http://localhost:8000"
+
+
+async def open_stream(client, i, results, cancel_after=None):
+    start = time.perf_counter()
+    first = None
+    chunks = 0
+    async with client.stream("POST", f"{BASE_URL}/chat/guide",
+                             data={"message": f"Comment importer une image ? ({i})"},
+                             headers={"X-Forwarded-For": f"10.0.0.{i}"}) as r:
+        if r.status_code != 200:
+            results.append((r.status_code, None, 0))
+            return
+        async for _ in r.aiter_text():
+            if first is None:
+                first = time.perf_counter()
+            chunks += 1
+            if cancel_after is not None and chunks >= cancel_after:
+                break
+    results.append((200, (first - start) * 1000 if first else None, chunks))
+
+
+async def ping_loop(client, stop, lags):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(f"{BASE_URL}/chat/metrics")
+        lags.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.05)
+
+
+async def main(args):
+    results, lags = [], []
+    stop = asyncio.Event()
+    async with httpx.AsyncClient(timeout=60) as client:
+        pinger = asyncio.create_task(ping_loop(client, stop, lags))
+        await asyncio.gather(*[
+            open_stream(client, i, results, cancel_after=args.cancel_after if i % 2 else None)
+            for i in range(args.streams)
+        ])
+        stop.set()
+        await pinger
+        metrics = (await client.get(f"{BASE_URL}/chat/metrics")).json()
+
+    ok = [r for r in results if r[0] == 200]
+    ttfts = sorted(r[1] for r in ok if r[1] is not None)
+    print(f"{len(ok)}/{len(results)} flux OK, refusés (429) : {sum(r[0] == 429 for r in results)}")
+    if ttfts:
+        print(f"TTFT client p50={ttfts[len(ttfts) // 2]:.0f}ms max={ttfts[-1]:.0f}ms")
+    if lags:
+        print(f"Latence /chat/metrics pendant les flux : max={max(lags):.0f}ms")
+    print(f"Métriques serveur : {metrics}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--cancel-after", type=int, default=5, help="un flux sur deux est coupé après N chunks")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,61 @@
+# backend/uploads/tests/conftest.py
+import base64
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+# backend/ : package common (comme main.py)
+sys.path.append(os.path.dirname(SERVICE_DIR))
+
+# Avant tout import de main : base SQLite jetable, pas de clé OpenAI réelle, pas de worker de fond
+_tmpdir = tempfile.mkdtemp(prefix="uploads_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'test.db')}")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("HEATMAP_PRERENDER", "0")
+
+
+@pytest.fixture(scope="session")
+def client():
+    """
+    Application complète (lifespan : migrations, workers) dans une boucle
+    dédiée, partagée par tous les tests : les files et le pool de connexions
+    sont liés à cette boucle.
+    """
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def signup_and_login(client, email, password="secret123"):
+    """En-tête Authorization d'un nouveau médecin."""
+    client.post("/signup", json={"email": email, "password": password})
+    token = client.post("/token", data={"username": email, "password": password}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def create_patient(client, headers, name="Patient Test"):
+    response = client.post("/patients", json={"full_name": name, "age": 60, "gender": "F"}, headers=headers)
+    response.raise_for_status()
+    return response.json()["patient"]["id"]
+
+
+def cams_payload():
+    """Réponse type de /cams/ : deux cartes 7x7 et une vignette JPEG."""
+    gradcam = np.arange(49, dtype=np.uint8).reshape(7, 7) * 5
+    buf = io.BytesIO()
+    Image.new("RGB", (224, 224), (120, 40, 20)).save(buf, format="JPEG")
+    return {
+        "shape": [7, 7],
+        "gradcam": base64.b64encode(gradcam.tobytes()).decode(),
+        "gradcam_pp": base64.b64encode(gradcam[::-1].tobytes()).decode(),
+        "thumbnail": base64.b64encode(buf.getvalue()).decode(),
+    }
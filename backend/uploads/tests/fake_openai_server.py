@@ -0,0 +1,71 @@
+# backend/uploads/tests/fake_openai_server.py
+"""
+Faux serveur compatible OpenAI (endpoint /v1/chat/completions en streaming SSE).
+
+Permet de tester /chat et /chat/guide sans clé ni réseau :
+
+    uvicorn tests.fake_openai_server:app --port 9999
+    OPENAI_BASE_URL=http://localhost:9999/v1 uvicorn main:app --port 8000
+
+Délais réglables via FAKE_FIRST_TOKEN_MS, FAKE_TOKEN_MS et FAKE_TOKENS.
+"""
+import asyncio
+import json
+import os
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+FIRST_TOKEN_MS = float(os.getenv("FAKE_FIRST_TOKEN_MS", "300"))
+TOKEN_MS = float(os.getenv("FAKE_TOKEN_MS", "20"))
+TOKENS = int(os.getenv("FAKE_TOKENS", "50"))
+
+app = FastAPI(title="Fake OpenAI")
+stats = {"requests": 0, "aborted": 0}
+
+
+def _chunk(model, content=None, usage=None):
+    choices = [] if content is None else [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+    payload = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": choices,
+    }
+    if usage is not None:
+        payload["usage"] = usage
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    question = body["messages"][-1]["content"]
+    stats["requests"] += 1
+
+    async def events():
+        sent = 0
+        try:
+            await asyncio.sleep(FIRST_TOKEN_MS / 1000)
+            words = (f"Réponse simulée à : {question} " * TOKENS).split()[:TOKENS]
+            for word in words:
+                yield _chunk(model, word + " ")
+                sent += 1
+                await asyncio.sleep(TOKEN_MS / 1000)
+            if body.get("stream_options", {}).get("include_usage"):
+                yield _chunk(model, usage={"prompt_tokens": 10, "completion_tokens": sent, "total_tokens": 10 + sent})
+            yield "data: [DONE]\n\n"
+        except asyncio.CancelledError:
+            # Le backend a fermé le flux (client déconnecté)
+            stats["aborted"] += 1
+            raise
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
@@ -0,0 +1,44 @@
+# backend/uploads/tests/test_chat_cache.py
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_cache import ResponseCache, normalize_question  # noqa: E402
+
+
+def test_normalized_questions_share_a_key():
+    assert normalize_question("  Comment IMPORTER une image ?") == "comment importer une image"
+    key_a = ResponseCache.make_key("Français", "Comment importer une image ?", [])
+    key_b = ResponseCache.make_key("Français", "comment importer une image", [])
+    assert key_a == key_b
+    assert key_a != ResponseCache.make_key("English", "comment importer une image", [])
+
+
+def test_lru_eviction_and_ttl():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    keys = [ResponseCache.make_key("fr", q, []) for q in ("a", "b", "c")]
+    cache.put(keys[0], "A")
+    cache.put(keys[1], "B")
+    assert cache.get(keys[0]) == "A"  # a devient le plus récent
+    cache.put(keys[2], "C")
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "A"
+
+    cache.ttl_seconds = -1
+    assert cache.get(keys[2]) is None
+
+
+def test_semantic_tier_respects_threshold():
+    cache = ResponseCache(similarity=0.9)
+    stored = ResponseCache.make_key("fr", "comment importer une image", [])
+    cache.put(stored, "Glissez l'image.", embedding=np.array([1.0, 0.0], dtype=np.float32))
+
+    query = ResponseCache.make_key("fr", "comment charger une image", [])
+    assert cache.get_similar(query, np.array([0.99, 0.141], dtype=np.float32)) == "Glissez l'image."
+    assert cache.get_similar(query, np.array([0.0, 1.0], dtype=np.float32)) is None
+
+    other_history = ResponseCache.make_key("fr", "comment charger une image", [{"role": "user", "content": "x"}])
+    assert cache.get_similar(other_history, np.array([1.0, 0.0], dtype=np.float32)) is None
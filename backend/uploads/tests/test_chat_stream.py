@@ -0,0 +1,147 @@
+# backend/uploads/tests/test_chat_stream.py
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+from openai import AsyncOpenAI
+
+import chat_stream
+import fake_openai_server
+from chat_stream import ChatLimiter, chat_limiter, chat_metrics, stream_chat_completion
+from conftest import signup_and_login
+
+MESSAGES = [{"role": "user", "content": "Bonjour"}]
+
+
+class FakeRequest:
+    """Requête Starlette réduite à is_disconnected : le client part après `disconnect_after` tokens."""
+
+    def __init__(self, disconnect_after=None):
+        self.disconnect_after = disconnect_after
+        self.checks = 0
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.disconnect_after is not None and self.checks > self.disconnect_after
+
+
+@pytest.fixture(scope="module")
+def fake_openai_url():
+    """tests/fake_openai_server.py servi par uvicorn sur un port libre : vrai flux HTTP, vraie déconnexion."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(fake_openai_server.app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{sock.getsockname()[1]}/v1"
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def fake_openai(fake_openai_url, monkeypatch):
+    monkeypatch.setattr(fake_openai_server, "FIRST_TOKEN_MS", 0)
+    monkeypatch.setattr(fake_openai_server, "TOKEN_MS", 2)
+    monkeypatch.setattr(fake_openai_server, "TOKENS", 20)
+    # Client neuf par test : son pool de connexions est lié à la boucle qui l'utilise
+    monkeypatch.setattr(chat_stream, "openai_client",
+                        AsyncOpenAI(api_key="test", base_url=fake_openai_url, max_retries=0))
+    return fake_openai_server.stats
+
+
+def collect(request, lease=None, on_complete=None):
+    async def run():
+        return [token async for token in stream_chat_completion(request, MESSAGES, lease, on_complete)]
+    return asyncio.run(run())
+
+
+def test_limiter_caps_streams_per_user():
+    limiter = ChatLimiter(2)
+    first, second = limiter.try_acquire("user:a"), limiter.try_acquire("user:a")
+    assert limiter.try_acquire("user:a") is None
+    assert limiter.try_acquire("user:b") is not None  # quota par utilisateur
+
+    first.release()
+    first.release()  # idempotent : ne libère pas un second créneau
+    assert limiter.try_acquire("user:a") is not None
+    assert limiter.try_acquire("user:a") is None
+    second.release()
+    assert limiter._active["user:a"] == 1
+
+
+def test_completed_stream_reports_answer_and_releases_lease(fake_openai):
+    limiter = ChatLimiter(1)
+    lease = limiter.try_acquire("user:a")
+    answers = []
+    completed = chat_metrics.counters["completed"]
+
+    tokens = collect(FakeRequest(), lease, answers.append)
+    assert len(tokens) == 20
+    assert answers == ["".join(tokens)]
+    assert answers[0].startswith("Réponse simulée à : Bonjour")
+    assert chat_metrics.counters["completed"] == completed + 1
+    assert limiter._active == {}
+
+
+def test_client_disconnect_closes_upstream_stream(fake_openai, monkeypatch):
+    limiter = ChatLimiter(1)
+    lease = limiter.try_acquire("user:a")
+    answers = []
+    cancelled = chat_metrics.counters["cancelled"]
+    aborted = fake_openai["aborted"]
+    monkeypatch.setattr(fake_openai_server, "TOKEN_MS", 50)  # le flux amont est encore ouvert quand le client part
+
+    tokens = collect(FakeRequest(disconnect_after=3), lease, answers.append)
+    assert len(tokens) == 3
+    assert answers == []  # réponse partielle : ni cache ni historique
+    assert chat_metrics.counters["cancelled"] == cancelled + 1
+    assert limiter._active == {}
+
+    deadline = time.monotonic() + 2
+    while fake_openai["aborted"] == aborted and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert fake_openai["aborted"] == aborted + 1
+
+
+def test_upstream_error_is_reported_without_completion(monkeypatch):
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()  # port fermé : connexion refusée
+    monkeypatch.setattr(chat_stream, "openai_client",
+                        AsyncOpenAI(api_key="test", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0))
+    limiter = ChatLimiter(1)
+    answers = []
+    errors = chat_metrics.counters["error"]
+
+    tokens = collect(FakeRequest(), limiter.try_acquire("user:a"), answers.append)
+    assert len(tokens) == 1 and tokens[0].startswith("Error:")
+    assert answers == []
+    assert chat_metrics.counters["error"] == errors + 1
+    assert limiter._active == {}
+
+
+def test_chat_route_returns_429_beyond_the_per_user_limit(client, fake_openai):
+    email = "chat@example.com"
+    headers = signup_and_login(client, email)
+    held = [chat_limiter.try_acquire(f"user:{email}") for _ in range(chat_limiter.max_per_user)]
+    try:
+        response = client.post("/chat", data={"message": "Bonjour"}, headers=headers)
+        assert response.status_code == 429
+        assert response.json()["detail"] == "Trop de conversations en cours, réessayez dans un instant"
+
+        held.pop().release()
+        response = client.post("/chat", data={"message": "Bonjour"}, headers=headers)
+        assert response.status_code == 200
+        assert "Réponse simulée" in response.text
+        # Le créneau du flux terminé est rendu ; seuls ceux tenus par le test restent
+        assert chat_limiter._active[f"user:{email}"] == len(held)
+    finally:
+        for lease in held:
+            lease.release()
+    assert f"user:{email}" not in chat_limiter._active
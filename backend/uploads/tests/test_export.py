@@ -0,0 +1,125 @@
+# backend/uploads/tests/test_export.py
+import asyncio
+import base64
+import csv
+import io
+import json
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+from PIL import Image
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from conftest import cams_payload, signup_and_login
+from export import EXPORT_COLUMNS, chunked, encode_records, export_files, stream_rows, zip_chunks
+
+START = datetime(2024, 3, 1, 9, 30)
+
+
+async def seed(directory):
+    """Base SQLite en mémoire : deux patients, une analyse sans patient, une analyse d'un autre médecin."""
+    from heatmaps import pack_cams
+    from main import Analysis, Base, Patient, User
+
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+    payload = cams_payload()
+    async with factory() as db:
+        doctor = User(email="export@example.com", hashed_password="x")
+        other = User(email="other-export@example.com", hashed_password="x")
+        db.add_all([doctor, other])
+        await db.flush()
+        suivi = Patient(full_name="Léa Suivi, \"fille\"", age=61, gender="F", doctor_id=doctor.id)
+        sans_examen = Patient(full_name="Sans Examen", age=40, gender="M", doctor_id=doctor.id)
+        db.add_all([suivi, sans_examen])
+        await db.flush()
+        db.add_all([
+            Analysis(filename="b.png", has_glaucoma=False, confidence=0.8, user_id=doctor.id, patient_id=suivi.id,
+                     timestamp=START + timedelta(days=30)),
+            Analysis(filename="a.png", has_glaucoma=True, confidence=0.9, user_id=doctor.id, patient_id=suivi.id,
+                     timestamp=START, image_sha256="f" * 64, cam_maps=pack_cams(payload),
+                     cam_thumbnail=base64.b64decode(payload["thumbnail"])),
+            Analysis(filename="libre.png", has_glaucoma=False, confidence=0.7, user_id=doctor.id, timestamp=START),
+            Analysis(filename="autre.png", has_glaucoma=True, confidence=0.6, user_id=other.id, timestamp=START),
+        ])
+        await db.commit()
+        doctor_id = doctor.id
+    Image.new("RGB", (32, 32), (200, 10, 10)).save(directory / "a.png")
+    return engine, factory, doctor_id
+
+
+async def collect(chunks):
+    return b"".join([chunk async for chunk in chunks])
+
+
+def export(tmp_path, fmt, images=False, heatmaps=False):
+    from main import export_files_statement, export_statements
+
+    async def run():
+        engine, factory, doctor_id = await seed(tmp_path)
+        try:
+            lines = encode_records(stream_rows(factory, *export_statements(doctor_id)), fmt)
+            if not (images or heatmaps):
+                return await collect(chunked(lines))
+            files = export_files(stream_rows(factory, export_files_statement(doctor_id, heatmaps)),
+                                 str(tmp_path), images, heatmaps)
+            return await collect(zip_chunks(lines, f"analyses.{fmt}", files))
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_ndjson_rows(tmp_path):
+    records = [json.loads(line) for line in export(tmp_path, "ndjson").decode().splitlines()]
+    assert [(r["patient"] or {}).get("full_name") for r in records] == [
+        'Léa Suivi, "fille"', 'Léa Suivi, "fille"', "Sans Examen", None]
+    # Analyses du patient par date, patient sans examen, puis analyse sans patient ; jamais celles d'un autre médecin
+    assert [(r["analysis"] or {}).get("filename") for r in records] == ["a.png", "b.png", None, "libre.png"]
+    first = records[0]["analysis"]
+    assert first == {"analysis_id": first["analysis_id"], "filename": "a.png", "has_glaucoma": True,
+                     "confidence": 0.9, "timestamp": START.isoformat(), "image_sha256": "f" * 64, "has_cams": True}
+    assert records[1]["analysis"]["has_cams"] is False
+    assert records[0]["patient"] == {"patient_id": records[0]["patient"]["patient_id"],
+                                     "full_name": 'Léa Suivi, "fille"', "age": 61, "gender": "F", "phone": None}
+
+
+def test_csv_rows(tmp_path):
+    rows = list(csv.reader(io.StringIO(export(tmp_path, "csv").decode())))
+    assert rows[0] == list(EXPORT_COLUMNS)
+    records = [dict(zip(rows[0], row)) for row in rows[1:]]
+    assert len(records) == 4
+    assert records[0]["full_name"] == 'Léa Suivi, "fille"'  # guillemets et virgule échappés
+    assert (records[0]["filename"], records[0]["timestamp"], records[0]["has_glaucoma"]) == \
+        ("a.png", START.isoformat(), "True")
+    assert records[2]["full_name"] == "Sans Examen" and records[2]["analysis_id"] == ""
+    assert records[3]["patient_id"] == "" and records[3]["filename"] == "libre.png"
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_zip_is_valid_and_complete(tmp_path, fmt):
+    data = export(tmp_path, fmt, images=True, heatmaps=True)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        names = archive.namelist()
+        assert names[0] == f"analyses.{fmt}"
+        # Seul l'original encore présent est joint ; seule l'analyse avec cartes a sa heatmap
+        assert sorted(names[1:]) == sorted(["images/a.png", next(n for n in names if n.startswith("heatmaps/"))])
+        assert archive.read("images/a.png") == (tmp_path / "a.png").read_bytes()
+        heatmap = Image.open(io.BytesIO(archive.read(next(n for n in names if n.startswith("heatmaps/")))))
+        assert heatmap.format == "PNG"
+        records = archive.read(f"analyses.{fmt}").decode()
+    assert records.count("libre.png") == 1
+
+
+def test_export_route_format_alias(client):
+    headers = signup_and_login(client, "export-route@example.com")
+    response = client.get("/export?format=csv", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines() == [",".join(EXPORT_COLUMNS)]
+    assert client.get("/export?format=xml", headers=headers).status_code == 400
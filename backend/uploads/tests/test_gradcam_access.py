@@ -0,0 +1,102 @@
+# backend/uploads/tests/test_gradcam_access.py
+import base64
+import io
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import pytest
+from PIL import Image
+
+from conftest import cams_payload, create_patient, signup_and_login
+
+
+@pytest.fixture(scope="module")
+def setup(client):
+    from heatmaps import pack_cams
+    from main import Analysis, SessionLocal
+
+    owner = signup_and_login(client, "owner@example.com")
+    other = signup_and_login(client, "other@example.com")
+    patient_id = create_patient(client, owner)
+    owner_id = client.get("/patients", headers=owner).json()[0]["doctor_id"]
+    payload = cams_payload()
+
+    async def seed():
+        async with SessionLocal() as db:
+            ana = Analysis(filename="absent.png", has_glaucoma=True, confidence=0.9, user_id=owner_id,
+                           patient_id=patient_id, timestamp=datetime.utcnow(),
+                           cam_maps=pack_cams(payload), cam_thumbnail=base64.b64decode(payload["thumbnail"]))
+            db.add(ana)
+            await db.commit()
+            return ana.id
+
+    analysis_id = client.portal.call(seed)
+    return {"owner": owner, "other": other, "owner_id": owner_id, "analysis_id": analysis_id}
+
+
+def gradcam_path(url):
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}"
+
+
+def test_anonymous_request_is_rejected(client, setup):
+    assert client.get(f"/analyses/{setup['analysis_id']}/gradcam").status_code == 401
+
+
+def test_owner_renders_stored_cams(client, setup):
+    response = client.get(f"/analyses/{setup['analysis_id']}/gradcam?variant=gradcam&size=64",
+                          headers=setup["owner"])
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert Image.open(io.BytesIO(response.content)).size == (64, 64)
+    assert response.headers["cache-control"] == "private, no-store"
+
+
+def test_stored_cams_side_by_side_through_signed_url(client, setup):
+    history = client.get("/history", headers=setup["owner"]).json()
+    url = next(item["gradcam_url"] for item in history if item["id"] == setup["analysis_id"])
+    response = client.get(f"{url}&variant=both&size=64")
+    assert response.status_code == 200
+    width, height = Image.open(io.BytesIO(response.content)).size
+    assert height == 64 and width >= 128
+
+
+def test_other_doctor_gets_404(client, setup):
+    response = client.get(f"/analyses/{setup['analysis_id']}/gradcam", headers=setup["other"])
+    assert response.status_code == 404
+
+
+def test_signed_url_from_history_works_without_header(client, setup):
+    history = client.get("/history", headers=setup["owner"]).json()
+    url = next(item["gradcam_url"] for item in history if item["id"] == setup["analysis_id"])
+    assert "token=" in url
+    assert client.get(gradcam_path(url)).status_code == 200
+
+
+def test_signed_token_is_bound_to_analysis_and_scope(client, setup):
+    from main import create_access_token, create_gradcam_token
+
+    analysis_id = setup["analysis_id"]
+    other_analysis = create_gradcam_token(analysis_id + 1, setup["owner_id"])
+    assert client.get(f"/analyses/{analysis_id}/gradcam?token={other_analysis}").status_code == 401
+    # Un jeton d'accès n'est pas une URL signée, et inversement
+    access = create_access_token({"sub": "owner@example.com"})
+    assert client.get(f"/analyses/{analysis_id}/gradcam?token={access}").status_code == 401
+    signed = create_gradcam_token(analysis_id, setup["owner_id"])
+    assert client.get("/history", headers={"Authorization": f"Bearer {signed}"}).status_code == 401
+
+
+def test_expired_signed_token_is_rejected(client, setup, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "GRADCAM_URL_TTL_MINUTES", -1)
+    expired = main.create_gradcam_token(setup["analysis_id"], setup["owner_id"])
+    assert client.get(f"/analyses/{setup['analysis_id']}/gradcam?token={expired}").status_code == 401
+
+
+def test_signed_token_for_another_user_gets_404(client, setup):
+    from main import create_gradcam_token
+
+    # Jeton valide mais émis pour un médecin qui n'a pas accès à l'analyse
+    token = create_gradcam_token(setup["analysis_id"], setup["owner_id"] + 1000)
+    assert client.get(f"/analyses/{setup['analysis_id']}/gradcam?token={token}").status_code == 404
@@ -0,0 +1,84 @@
+# backend/uploads/tests/test_heatmaps.py
+import asyncio
+
+from heatmaps import HeatmapRenderer
+
+
+class FakeRenderer(HeatmapRenderer):
+    """_fetch bloqué jusqu'à `release[priorité]` ; les appels sont journalisés."""
+
+    def __init__(self):
+        super().__init__("unused", self.store)
+        self.calls = []
+        self.stored = []
+        self.release = {"interactive": asyncio.Event(), "background": asyncio.Event()}
+
+    async def _fetch(self, filename, priority):
+        self.calls.append(priority)
+        await self.release[priority].wait()
+        return f"cams-{priority}".encode(), b"thumb"
+
+    async def store(self, analysis_id, cam_maps, thumbnail):
+        self.stored.append((analysis_id, cam_maps))
+
+
+def test_concurrent_interactive_requests_share_one_fetch():
+    async def scenario():
+        renderer = FakeRenderer()
+        first = asyncio.create_task(renderer.ensure(1, "a.png"))
+        second = asyncio.create_task(renderer.ensure(1, "a.png"))
+        await asyncio.sleep(0)
+        renderer.release["interactive"].set()
+        assert await first == await second == (b"cams-interactive", b"thumb")
+        assert renderer.calls == ["interactive"]
+        assert renderer._inflight == {}
+
+    asyncio.run(scenario())
+
+
+def test_interactive_request_does_not_wait_for_background_fetch():
+    async def scenario():
+        renderer = FakeRenderer()
+        background = asyncio.create_task(renderer.ensure(1, "a.png", priority="background"))
+        await asyncio.sleep(0)
+        # Le pré-calcul reste bloqué (file basse côté DL) : l'ouverture passe devant
+        renderer.release["interactive"].set()
+        result = await asyncio.wait_for(renderer.ensure(1, "a.png"), timeout=1)
+        assert result == (b"cams-interactive", b"thumb")
+        assert renderer.calls == ["background", "interactive"]
+        assert not background.done()
+
+        renderer.release["background"].set()
+        await background
+        assert renderer._inflight == {}
+
+    asyncio.run(scenario())
+
+
+def test_background_request_joins_interactive_fetch():
+    async def scenario():
+        renderer = FakeRenderer()
+        interactive = asyncio.create_task(renderer.ensure(1, "a.png"))
+        await asyncio.sleep(0)
+        background = asyncio.create_task(renderer.ensure(1, "a.png", priority="background"))
+        await asyncio.sleep(0)
+        renderer.release["interactive"].set()
+        assert await background == await interactive
+        assert renderer.calls == ["interactive"]
+
+    asyncio.run(scenario())
+
+
+def test_abandoned_request_does_not_cancel_the_shared_fetch():
+    async def scenario():
+        renderer = FakeRenderer()
+        waiter = asyncio.create_task(renderer.ensure(1, "a.png"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        renderer.release["interactive"].set()
+        assert await renderer.ensure(1, "a.png") == (b"cams-interactive", b"thumb")
+        assert renderer.calls == ["interactive"]
+        assert renderer.stored == [(1, b"cams-interactive")]
+
+    asyncio.run(scenario())
@@ -0,0 +1,229 @@
+# backend/uploads/tests/test_longitudinal.py
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import create_patient, signup_and_login
+from longitudinal import TrendCache, add_exam, empty_summary, exam_point, remove_exam, render_trend
+
+START = datetime(2024, 1, 1)
+
+
+def point(analysis_id, days, probability):
+    return exam_point(analysis_id, START + timedelta(days=days), True, probability, None)
+
+
+def summary_of(*points):
+    summary = empty_summary()
+    for p in points:
+        add_exam(summary, p)
+    return summary
+
+
+def test_out_of_order_insertion_matches_chronological_order():
+    in_order = summary_of(point(1, 0, 0.2), point(2, 30, 0.3), point(3, 90, 0.6))
+    shuffled = summary_of(point(3, 90, 0.6), point(1, 0, 0.2), point(2, 30, 0.3))
+    assert shuffled == in_order
+    assert [p["id"] for p in shuffled["points"]] == [1, 2, 3]
+    assert [p["days"] for p in shuffled["points"]] == [None, 30.0, 60.0]
+    assert [p["dp"] for p in shuffled["points"]] == [None, 0.1, 0.3]
+
+
+def test_reinserting_an_exam_replaces_it():
+    summary = summary_of(point(1, 0, 0.2), point(2, 30, 0.3))
+    add_exam(summary, point(2, 10, 0.5))
+    assert [p["id"] for p in summary["points"]] == [1, 2]
+    assert summary["points"][1]["days"] == 10.0
+    assert summary["sums"][0] == 2
+
+
+def test_removal_relinks_neighbours_and_sums():
+    summary = summary_of(point(1, 0, 0.2), point(2, 30, 0.3), point(3, 90, 0.6))
+    remove_exam(summary, 2)
+    assert summary == summary_of(point(1, 0, 0.2), point(3, 90, 0.6))
+    assert summary["points"][1]["days"] == 90.0
+    assert summary["points"][1]["dp"] == 0.4
+
+    remove_exam(summary, 42)  # examen inconnu : sans effet
+    assert len(summary["points"]) == 2
+
+
+def test_slope_per_year():
+    summary = summary_of(point(1, 0, 0.2), point(2, 365.25, 0.4), point(3, 730.5, 0.6))
+    assert render_trend(summary)["slope_per_year"] == pytest.approx(0.2)
+
+    # Un seul examen, ou deux le même jour : pente indéfinie
+    assert render_trend(summary_of(point(1, 0, 0.2)))["slope_per_year"] is None
+    assert render_trend(summary_of(point(1, 0, 0.2), point(2, 0, 0.5)))["slope_per_year"] is None
+
+
+def test_slope_ignores_exams_without_probability():
+    summary = summary_of(point(1, 0, 0.2), point(2, 100, None), point(3, 365.25, 0.4))
+    assert summary["sums"][0] == 2
+    assert render_trend(summary)["slope_per_year"] == pytest.approx(0.2)
+    remove_exam(summary, 2)
+    assert render_trend(summary)["slope_per_year"] == pytest.approx(0.2)
+
+
+def test_cache_entries_are_bound_to_their_version():
+    cache = TrendCache(size=1)
+    cache.put(1, "v1", {"points": []})
+    assert cache.get(1, "v1") == {"points": []}
+    assert cache.get(1, "v2") is None
+    cache.put(2, "v1", {"points": []})
+    assert cache.get(1, "v1") is None
+
+
+def test_locks_are_per_patient_and_dropped_when_unused():
+    cache = TrendCache()
+    order = []
+
+    async def write(patient_id, label, delay):
+        async with cache.lock(patient_id):
+            order.append(f"{label}+")
+            await asyncio.sleep(delay)
+            order.append(f"{label}-")
+
+    async def scenario():
+        await asyncio.gather(write(1, "a", 0.02), write(1, "b", 0), write(2, "c", 0))
+
+    asyncio.run(scenario())
+    # Patient 2 n'attend pas le patient 1 ; deux écritures du patient 1 ne se chevauchent pas
+    assert order.index("c-") < order.index("a-")
+    assert order.index("a-") < order.index("b+")
+    assert cache.locks == {}
+
+
+def test_trend_endpoint_stores_count_and_rebuilds_stale_rows(client):
+    from sqlalchemy import update
+    from main import Analysis, PatientTrend, SessionLocal
+
+    headers = signup_and_login(client, "trend@example.com")
+    patient_id = create_patient(client, headers, "Patient Suivi")
+    doctor_id = client.get("/patients", headers=headers).json()[0]["doctor_id"]
+
+    async def add_analyses(*days):
+        async with SessionLocal() as db:
+            db.add_all([Analysis(filename=f"trend_{d}.png", has_glaucoma=True, confidence=0.5 + d / 1000,
+                                 user_id=doctor_id, patient_id=patient_id, timestamp=START + timedelta(days=d))
+                        for d in days])
+            await db.commit()
+
+    async def stored_count():
+        async with SessionLocal() as db:
+            return (await db.get(PatientTrend, patient_id)).exam_count
+
+    async def mark_stale():
+        async with SessionLocal() as db:
+            await db.execute(update(PatientTrend).where(PatientTrend.patient_id == patient_id)
+                             .values(exam_count=None, updated_at=datetime.utcnow()))
+            await db.commit()
+
+    client.portal.call(add_analyses, 0, 100)
+    trend = client.get(f"/patients/{patient_id}/trend", headers=headers).json()
+    assert trend["exam_count"] == 2
+    assert client.portal.call(stored_count) == 2
+
+    # Examen ajouté sans mise à jour du résumé, puis résumé marqué à reconstruire
+    client.portal.call(add_analyses, 50)
+    client.portal.call(mark_stale)
+    trend = client.get(f"/patients/{patient_id}/trend", headers=headers).json()
+    assert trend["exam_count"] == 3
+    assert trend["series"]["days"] == [None, 50.0, 50.0]
+    assert client.portal.call(stored_count) == 3
+
+
+class InterleavedSession:
+    """Session d'un premier worker : après sa n-ième requête, un second worker s'exécute en entier."""
+
+    def __init__(self, db, pause_after, other_worker):
+        self.db = db
+        self.pause_after = pause_after
+        self.other_worker = other_worker
+        self.calls = 0
+
+    async def execute(self, *args, **kwargs):
+        result = await self.db.execute(*args, **kwargs)
+        self.calls += 1
+        if self.calls == self.pause_after:
+            await self.other_worker()
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+@pytest.fixture
+def two_workers(client, monkeypatch, request):
+    """Patient suivi, et verrou par patient neutralisé : chaque session joue un worker distinct."""
+    import main
+
+    @asynccontextmanager
+    async def no_lock(patient_id):
+        yield
+
+    monkeypatch.setattr(main.trend_cache, "lock", no_lock)
+    headers = signup_and_login(client, f"{request.node.name}@example.com")
+    patient_id = create_patient(client, headers, "Patient Concurrent")
+    doctor_id = client.get("/patients", headers=headers).json()[0]["doctor_id"]
+    return main, headers, patient_id, doctor_id
+
+
+def add_analysis(main, db, doctor_id, patient_id, days):
+    analysis = main.Analysis(filename=f"worker_{patient_id}_{days}.png", has_glaucoma=True, confidence=0.6,
+                             user_id=doctor_id, patient_id=patient_id, timestamp=START + timedelta(days=days))
+    db.add(analysis)
+    return analysis
+
+
+def test_concurrent_incremental_updates_do_not_lose_an_exam(client, two_workers):
+    main, headers, patient_id, doctor_id = two_workers
+
+    async def scenario():
+        async with main.SessionLocal() as db:
+            add_analysis(main, db, doctor_id, patient_id, 0)
+            await db.commit()
+            await main.load_patient_trend(db, patient_id)  # résumé enregistré : 1 examen
+
+        async def add_exam_in(db, days):
+            analysis = add_analysis(main, db, doctor_id, patient_id, days)
+            await db.commit()
+            await main.update_patient_trend(db, patient_id, lambda summary: add_exam(summary, exam_point(
+                analysis.id, analysis.timestamp, True, 0.6, None)))
+
+        async with main.SessionLocal() as db_a, main.SessionLocal() as db_b:
+            # Le worker B écrit entre la lecture et l'écriture du worker A : tous deux lisent 1 examen
+            await add_exam_in(InterleavedSession(db_a, 1, lambda: add_exam_in(db_b, 20)), 10)
+            return (await db_a.get(main.PatientTrend, patient_id, populate_existing=True)).exam_count
+
+    # L'écriture de A est refusée : résumé marqué à reconstruire plutôt que 2 examens sur 3
+    assert client.portal.call(scenario) is None
+    trend = client.get(f"/patients/{patient_id}/trend", headers=headers).json()
+    assert trend["exam_count"] == 3
+
+
+def test_stale_rebuild_does_not_overwrite_a_concurrent_update(client, two_workers):
+    main, headers, patient_id, doctor_id = two_workers
+
+    async def scenario():
+        async with main.SessionLocal() as db:
+            add_analysis(main, db, doctor_id, patient_id, 0)
+            await db.commit()
+            await main.load_patient_trend(db, patient_id)
+            await main.mark_trend_stale(db, patient_id)
+
+        async def new_exam(db):
+            add_analysis(main, db, doctor_id, patient_id, 30)
+            await db.commit()
+            await main.update_patient_trend(db, patient_id, lambda summary: summary)  # reconstruit (NULL)
+
+        async with main.SessionLocal() as db_a, main.SessionLocal() as db_b:
+            # Lecture A : reconstruction sur 1 examen, puis un nouvel examen et sa mise à jour par B
+            summary = await main.load_patient_trend(InterleavedSession(db_a, 3, lambda: new_exam(db_b)), patient_id)
+            stored = await db_a.get(main.PatientTrend, patient_id, populate_existing=True)
+            return len(summary["points"]), stored.exam_count
+
+    assert client.portal.call(scenario) == (1, 2)
+    assert client.get(f"/patients/{patient_id}/trend", headers=headers).json()["exam_count"] == 2
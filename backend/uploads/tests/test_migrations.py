@@ -0,0 +1,122 @@
+# backend/uploads/tests/test_migrations.py
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, inspect, select
+
+from migrations import MIGRATIONS, _baseline_metadata, apply_migrations, schema_version
+
+LATEST = MIGRATIONS[-1][0]
+
+
+@pytest.fixture(scope="module")
+def metadata():
+    from main import Base
+    return Base.metadata
+
+
+def migrate(url, metadata):
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        apply_migrations(conn, metadata)
+    return engine
+
+
+def schema(engine):
+    """Tables, colonnes, index et clés étrangères, comparables d'une base à l'autre."""
+    inspector = inspect(engine)
+    return {
+        table: {
+            "columns": sorted((c["name"], str(c["type"]), c["nullable"], c["primary_key"] > 0)
+                              for c in inspector.get_columns(table)),
+            "indexes": sorted((ix["name"], tuple(ix["column_names"]), bool(ix["unique"]))
+                              for ix in inspector.get_indexes(table)),
+            "foreign_keys": sorted((tuple(fk["constrained_columns"]), fk["referred_table"])
+                                   for fk in inspector.get_foreign_keys(table)),
+        }
+        for table in sorted(inspector.get_table_names())
+    }
+
+
+def baseline_database(url):
+    """Base créée par l'ancien Base.metadata.create_all, avec une analyse."""
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        _baseline_metadata.create_all(conn)
+        conn.execute(_baseline_metadata.tables["users"].insert().values(
+            id=1, email="ancien@example.com", hashed_password="x", created_at=datetime(2024, 1, 1)))
+        conn.execute(_baseline_metadata.tables["analyses"].insert().values(
+            id=1, filename="a.png", has_glaucoma=True, confidence=0.9, user_id=1, timestamp=datetime(2024, 1, 1)))
+    return engine
+
+
+def version_rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(schema_version.c.id, schema_version.c.version)).all()
+
+
+def test_baseline_and_fresh_databases_converge(tmp_path, metadata):
+    fresh = migrate(f"sqlite:///{tmp_path / 'fresh.db'}", metadata)
+    baseline_database(f"sqlite:///{tmp_path / 'baseline.db'}")
+    upgraded = migrate(f"sqlite:///{tmp_path / 'baseline.db'}", metadata)
+
+    assert schema(upgraded) == schema(fresh)
+    assert version_rows(fresh) == version_rows(upgraded) == [(1, LATEST)]
+    with upgraded.connect() as conn:
+        # Données conservées, nouvelles colonnes vides
+        row = conn.exec_driver_sql("SELECT filename, image_sha256, cam_maps FROM analyses").one()
+    assert tuple(row) == ("a.png", None, None)
+
+
+def test_migrated_schema_matches_the_models(tmp_path, metadata):
+    migrated = schema(migrate(f"sqlite:///{tmp_path / 'fresh.db'}", metadata))
+    assert set(migrated) == set(metadata.tables) | {"schema_version"}
+    for name, table in metadata.tables.items():
+        assert {c[0] for c in migrated[name]["columns"]} == set(table.columns.keys()), name
+        model_indexes = {ix.name for ix in table.indexes}
+        assert model_indexes <= {ix[0] for ix in migrated[name]["indexes"]}, name
+
+
+def test_rerun_is_a_no_op(tmp_path, metadata):
+    url = f"sqlite:///{tmp_path / 'fresh.db'}"
+    before = schema(migrate(url, metadata))
+    assert schema(migrate(url, metadata)) == before
+    assert version_rows(create_engine(url)) == [(1, LATEST)]
+
+
+def test_legacy_version_table_is_upgraded(tmp_path, metadata):
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    engine = baseline_database(url)
+    with engine.begin() as conn:
+        # Ancienne table sans clé primaire, arrêtée après l'étape 2
+        conn.exec_driver_sql("CREATE TABLE schema_version (version INTEGER NOT NULL)")
+        conn.exec_driver_sql("INSERT INTO schema_version VALUES (1), (2)")
+        MIGRATIONS[1][2](conn, metadata)
+
+    upgraded = migrate(url, metadata)
+    assert version_rows(upgraded) == [(1, LATEST)]
+    assert schema(upgraded) == schema(migrate(f"sqlite:///{tmp_path / 'fresh.db'}", metadata))
+
+
+def test_concurrent_workers_migrate_once(tmp_path, metadata):
+    url = f"sqlite:///{tmp_path / 'shared.db'}"
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def worker():
+        engine = create_engine(url, connect_args={"timeout": 30})
+        barrier.wait()
+        try:
+            with engine.begin() as conn:
+                apply_migrations(conn, metadata)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert version_rows(create_engine(url)) == [(1, LATEST)]
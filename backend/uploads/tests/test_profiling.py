@@ -0,0 +1,72 @@
+# backend/uploads/tests/test_profiling.py
+import asyncio
+import os
+
+import pytest
+
+from common import profiling
+from common.profiling import ProfilingMiddleware, current_profile, profile_name
+from tracing import RequestIdMiddleware, get_request_id, valid_request_id
+
+
+async def endpoint(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"x-profiled", b"1" if current_profile.get() else b"0")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def call(app, path="/history", headers=()):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": list(headers)}
+    asyncio.run(app(scope, receive, send))
+    return dict(messages[0]["headers"])
+
+
+@pytest.fixture
+def profiled_app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 0)
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "s3cret")
+    return RequestIdMiddleware(ProfilingMiddleware(endpoint, get_request_id=get_request_id))
+
+
+def test_request_id_is_kept_only_when_safe():
+    assert valid_request_id(b"0af3-12bc") == "0af3-12bc"
+    for value in (b"", b"../../etc", b"ABC", b"a" * 65, "é".encode()):
+        generated = valid_request_id(value)
+        assert generated != value.decode("latin-1") and len(generated) == 16
+
+
+def test_unsafe_request_id_is_regenerated_in_the_response(profiled_app):
+    headers = call(profiled_app, headers=[(b"x-request-id", b"x/../../y")])
+    assert headers[b"x-request-id"] != b"x/../../y"
+    assert headers[b"x-request-id"].decode().isalnum()
+
+
+def test_profile_header_requires_the_admin_token(profiled_app, tmp_path):
+    assert call(profiled_app, headers=[(b"x-profile", b"1")])[b"x-profiled"] == b"0"
+    assert call(profiled_app, headers=[(b"x-profile", b"1"), (b"x-admin-token", b"wrong")])[b"x-profiled"] == b"0"
+    assert os.listdir(tmp_path / "profiles") == []
+
+    headers = [(b"x-profile", b"1"), (b"x-admin-token", b"s3cret"), (b"x-request-id", b"abc-123")]
+    assert call(profiled_app, headers=headers)[b"x-profiled"] == b"1"
+    [name] = os.listdir(tmp_path / "profiles")
+    assert name.endswith("_history_abc-123.collapsed")
+
+
+def test_profile_header_is_ignored_without_configured_token(profiled_app, monkeypatch):
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "")
+    assert call(profiled_app, headers=[(b"x-profile", b"1"), (b"x-admin-token", b"")])[b"x-profiled"] == b"0"
+
+
+def test_profile_name_keeps_only_safe_characters():
+    name = profile_name("/analyses/../../etc/passwd?x=<1>", "abc")
+    assert "/" not in name and ".." not in name
+    assert name.endswith("_analyses_etc_passwd_x_1_abc")
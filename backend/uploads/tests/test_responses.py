@@ -0,0 +1,149 @@
+# backend/uploads/tests/test_responses.py
+import asyncio
+import gzip
+import json
+import zlib
+
+import brotli
+import pytest
+
+from conftest import create_patient, signup_and_login
+from responses import CompressionMiddleware, _accepted_encoding
+
+PAYLOAD = json.dumps([{"id": i, "filename": f"img_{i}.png", "has_glaucoma": i % 2 == 0} for i in range(200)]).encode()
+
+
+def app_sending(*bodies, content_type=b"application/json", headers=()):
+    async def app(scope, receive, send):
+        raw = [(b"content-type", content_type), *headers]
+        if len(bodies) == 1:
+            raw.append((b"content-length", str(len(bodies[0])).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": raw})
+        for i, body in enumerate(bodies):
+            await send({"type": "http.response.body", "body": body, "more_body": i < len(bodies) - 1})
+    return app
+
+
+def call(app, accept_encoding):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding)]}
+    asyncio.run(CompressionMiddleware(app)(scope, receive, send))
+    headers = {name.decode(): value.decode() for name, value in messages[0]["headers"]}
+    return headers, [m["body"] for m in messages[1:]]
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("gzip, deflate, br", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0, gzip;q=0.5", "gzip"),
+    ("gzip;q=0", None),
+    ("identity", None),
+    ("", None),
+    ("*", "br"),
+    ("*;q=0.1, br;q=0", "gzip"),
+])
+def test_accept_encoding_negotiation(accept, expected):
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept.encode())]}
+    assert _accepted_encoding(scope) == expected
+
+
+@pytest.mark.parametrize("encoding, decompress", [("gzip", gzip.decompress), ("br", brotli.decompress)])
+def test_complete_body_is_compressed_with_vary(encoding, decompress):
+    headers, bodies = call(app_sending(PAYLOAD, headers=[(b"vary", b"Origin")]), encoding.encode())
+    assert headers["content-encoding"] == encoding
+    assert headers["vary"] == "Origin, Accept-Encoding"
+    assert headers["content-length"] == str(len(bodies[0]))
+    assert decompress(bodies[0]) == PAYLOAD
+
+
+@pytest.mark.parametrize("body, content_type, encoded", [
+    (b'{"ok": true}', b"application/json", False),  # sous COMPRESSION_MIN_SIZE
+    (PAYLOAD, b"image/png", False),
+    (PAYLOAD, b"application/zip", False),
+    (PAYLOAD, b"application/json", True),  # déjà compressée par la route
+])
+def test_small_binary_or_encoded_bodies_pass_through(body, content_type, encoded):
+    extra = [(b"content-encoding", b"gzip")] if encoded else []
+    headers, bodies = call(app_sending(body, content_type=content_type, headers=extra), b"gzip, br")
+    assert bodies == [body]
+    assert headers.get("content-encoding") == ("gzip" if encoded else None)
+    assert "vary" not in headers
+
+
+def test_identity_request_is_untouched():
+    headers, bodies = call(app_sending(PAYLOAD), b"identity")
+    assert "content-encoding" not in headers and bodies == [PAYLOAD]
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_stream_chunks_are_decodable_as_they_arrive(encoding):
+    chunks = [b'{"line": %d, "text": "token"}\n' % i for i in range(20)]
+    headers, bodies = call(app_sending(*chunks, content_type=b"application/x-ndjson"), encoding.encode())
+    assert headers["content-encoding"] == encoding
+    assert "content-length" not in headers
+    assert "Accept-Encoding" in headers["vary"]
+
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == "gzip" else brotli.Decompressor()
+    decode = decoder.decompress if encoding == "gzip" else decoder.process
+    # Vidage synchrone : chaque morceau compressé restitue exactement le morceau d'origine
+    assert [decode(body) for body in bodies] == chunks
+    if encoding == "gzip":
+        assert decoder.eof
+    assert (gzip.decompress if encoding == "gzip" else brotli.decompress)(b"".join(bodies)) == b"".join(chunks)
+
+
+@pytest.fixture(scope="module")
+def doctor(client):
+    headers = signup_and_login(client, "responses@example.com")
+    for i in range(15):
+        create_patient(client, headers, f"Patient Liste {i}")
+    return headers
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_app_compresses_lists_and_streams(client, doctor, encoding):
+    response = client.get("/patients", headers={**doctor, "Accept-Encoding": encoding})
+    assert response.headers["content-encoding"] == encoding
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(response.json()) == 15
+
+    export = client.get("/export?format=csv", headers={**doctor, "Accept-Encoding": encoding})
+    assert export.headers["content-encoding"] == encoding
+    assert export.text.count("Patient Liste") == 15
+
+
+def test_preflight_from_allowed_origin(client):
+    response = client.options("/patients", headers={
+        "Origin": "http://localhost:3000",
+        "Access-Control-Request-Method": "POST",
+        "Access-Control-Request-Headers": "authorization, content-type",
+        "Accept-Encoding": "gzip, br",
+    })
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
+    assert response.headers["access-control-allow-credentials"] == "true"
+    assert "POST" in response.headers["access-control-allow-methods"]
+    assert "authorization" in response.headers["access-control-allow-headers"].lower()
+    assert "content-encoding" not in response.headers
+
+
+def test_preflight_from_unknown_origin_is_refused(client):
+    response = client.options("/patients", headers={
+        "Origin": "http://ailleurs.example", "Access-Control-Request-Method": "POST"})
+    assert response.status_code == 400
+
+
+def test_cors_headers_on_every_response(client, doctor):
+    response = client.get("/patients", headers={**doctor, "Origin": "http://localhost:5173"})
+    assert response.headers["access-control-allow-origin"] == "http://localhost:5173"
+    # Origine hors liste : en-têtes permissifs du middleware ASGI, y compris sur une erreur
+    response = client.get("/patients", headers={"Origin": "http://ailleurs.example"})
+    assert response.status_code == 401
+    assert response.headers["access-control-allow-origin"] == "*"
@@ -0,0 +1,59 @@
+# backend/uploads/tracing.py
+import re
+import uuid
+import contextvars
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Classe de priorité côté service DL : interactive (médecin en attente), background, bulk
+PRIORITY_HEADER = "X-Priority"
+
+# Identifiant de la requête courante, propagé vers le service DL
+request_id_var = contextvars.ContextVar("request_id", default=None)
+# Id repris du client seulement s'il a cette forme : il finit dans les logs et les noms de fichiers
+REQUEST_ID_PATTERN = re.compile(r"[0-9a-f-]{1,64}")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def valid_request_id(value: bytes) -> str:
+    """Id reçu s'il est sûr, sinon un nouvel id."""
+    request_id = value.decode("latin-1")
+    return request_id if REQUEST_ID_PATTERN.fullmatch(request_id) else new_request_id()
+
+
+def get_request_id():
+    return request_id_var.get()
+
+
+def trace_headers(priority: str = "interactive") -> dict:
+    """En-têtes à ajouter aux appels sortants (un nouvel id hors requête HTTP)."""
+    return {REQUEST_ID_HEADER: request_id_var.get() or new_request_id(), PRIORITY_HEADER: priority}
+
+
+class RequestIdMiddleware:
+    """Middleware ASGI : reprend (s'il est valide) ou crée X-Request-ID et le renvoie au client."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        request_id = valid_request_id(headers.get(REQUEST_ID_HEADER.lower().encode(), b""))
+        token = request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), request_id.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
@@ -49,7 +49,9 @@ const ChatBot = () => {
                 body: formData,
                 // ✅ CORRECTION 2 : On force l'envoi de la langue au Backend
                 headers: {
-                    'Accept-Language': i18n.language
+                    'Accept-Language': i18n.language,
+                    // Identifie l'utilisateur pour la limite de flux simultanés
+                    ...(localStorage.getItem('token') && { Authorization: `Bearer ${localStorage.getItem('token')}` })
                 }
             });
 
@@ -67,7 +67,9 @@ export default function DoctorChat({ analysisResult, imageUrl }) {
                 // ✅ CORRECTION 2 : On envoie la langue active au Backend
                 // C'est ce qui force l'IA à parler Arabe/Espagnol/etc.
                 headers: {
-                    'Accept-Language': i18n.language
+                    'Accept-Language': i18n.language,
+                    // Identifie l'utilisateur pour la limite de flux simultanés
+                    ...(localStorage.getItem('token') && { Authorization: `Bearer ${localStorage.getItem('token')}` })
                 }
             });
 